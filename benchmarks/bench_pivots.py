@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+諧波形態掃描器 - 轉折點引擎基準測試
+==================================
+以隨機（無等值平台）序列驗證滑動最大值轉折點引擎與 scipy argrelextrema
+的輸出完全一致，並比較不同 order 下單一序列與批次（2-D）檢測的耗時。
+
+使用方式：
+    python benchmarks/bench_pivots.py
+    python benchmarks/bench_pivots.py --series 2000 --bars 1000 --orders 5 10 50 200
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+from scipy.signal import argrelextrema
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import harmonic_scanner as hs  # noqa: E402
+
+
+def reference_pivots(high: np.ndarray, low: np.ndarray, order: int) -> tuple:
+    """原本以 argrelextrema 實作的 detect_pivots"""
+    max_idx = argrelextrema(high, np.greater, order=order)[0]
+    min_idx = argrelextrema(low, np.less, order=order)[0]
+    peaks_idx = np.concatenate((max_idx, min_idx))
+    peaks_p = np.concatenate((high[max_idx], low[min_idx]))
+    sort_idx = np.argsort(peaks_idx, kind="stable")
+    return peaks_idx[sort_idx], peaks_p[sort_idx]
+
+
+def validate(rng: np.random.Generator, cases: int) -> int:
+    """隨機長度與 order 的一致性檢查，返回不一致的案例數"""
+    mismatches = 0
+    for _ in range(cases):
+        n = int(rng.integers(2, 600))
+        order = int(rng.integers(1, 80))
+        high = np.cumsum(rng.normal(size=n))
+        low = high - rng.random(n)
+        expected = reference_pivots(high, low, order)
+        actual = hs.detect_pivots(high, low, order, tie="strict", mode="window")
+        if not (np.array_equal(expected[0], actual[0]) and np.array_equal(expected[1], actual[1])):
+            mismatches += 1
+    return mismatches
+
+
+def timed(func, *args) -> float:
+    """執行一次並返回耗時（秒）"""
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="轉折點引擎基準測試")
+    parser.add_argument("--series", type=int, default=1000, help="序列數量")
+    parser.add_argument("--bars", type=int, default=500, help="每個序列的 K線數量")
+    parser.add_argument("--orders", type=int, nargs="+", default=[5, 10, 25, 50, 100])
+    parser.add_argument("--cases", type=int, default=2000, help="一致性檢查的隨機案例數")
+    parser.add_argument("--seed", type=int, default=42, help="亂數種子")
+    parser.add_argument("--output", default="bench_pivots.json", help="JSON 結果輸出路徑")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    mismatches = validate(rng, args.cases)
+    print(f"一致性檢查：{args.cases} 個案例，不一致 {mismatches} 個")
+
+    high = np.cumsum(rng.normal(size=(args.series, args.bars)), axis=1) + 1000
+    low = high - rng.random((args.series, args.bars))
+    lengths = np.full(args.series, args.bars)
+
+    report = {"cases": args.cases, "mismatches": mismatches, "series": args.series,
+              "bars": args.bars, "results": {}}
+
+    for order in args.orders:
+        scipy_s = timed(lambda: [reference_pivots(high[i], low[i], order)
+                                 for i in range(args.series)])
+        single_s = timed(lambda: [hs.detect_pivots(high[i], low[i], order, tie="strict",
+                                                   mode="window")
+                                  for i in range(args.series)])
+        batch_s = timed(hs.detect_pivots_batch, high, low, lengths, order, "strict", "window")
+        report["results"][str(order)] = {
+            "argrelextrema": scipy_s,
+            "sliding_single": single_s,
+            "sliding_batch": batch_s,
+        }
+        print(
+            f"order {order:>4} | argrelextrema {scipy_s:.3f}s | "
+            f"逐一 {single_s:.3f}s | 批次 {batch_s:.3f}s | 加速 {scipy_s / batch_s:.1f}x"
+        )
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"結果已寫入 {args.output}")
+
+    if mismatches:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+諧波形態掃描器 - 效能基準測試
+============================
+以固定亂數種子產生合成 OHLCV（含植入的 XABCD 形態），在完全離線的情況下
+量測數據收集、DataFrame 建立、峰值檢測、形態函數與完整掃描的耗時及記憶體峰值。
+
+交易所與 Discord Webhook 均以本地替身取代，結果輸出為 JSON，
+可與先前保存的基準結果比較以發現效能退化。
+
+使用方式：
+    python benchmarks/bench_scan.py
+    python benchmarks/bench_scan.py --sizes 100 1000 --output bench_output.json
+    python benchmarks/bench_scan.py --baseline bench_baseline.json --tolerance 0.2
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import harmonic_scanner as hs  # noqa: E402
+
+TIMEFRAME = "1h"
+TIMEFRAME_MS = 3600 * 1000
+
+# ============================================================================
+# 合成數據
+# ============================================================================
+
+def planted_bat(order: int) -> np.ndarray:
+    """
+    產生一段以看漲蝙蝠結尾的價格路徑（X → A → B → C → D，最後一根為 D 點）
+
+    每段長度為 3 × order 根，使 X/A/B/C 能被峰值檢測確認。
+    """
+    segment = 3 * order
+    x, a = 100.0, 110.0
+    b = a - 0.45 * (a - x)
+    c = b + 0.8 * (a - b)
+    d = c - 2.2 * (c - b)
+    legs = [(x, a), (a, b), (b, c), (c, d)]
+    path = [np.linspace(start, end, segment, endpoint=False) for start, end in legs]
+    return np.concatenate(path + [[d]])
+
+
+def make_market(n_symbols: int, bars: int, order: int, plant_ratio: float,
+                seed: int) -> tuple:
+    """
+    產生合成市場
+
+    返回：
+        元組：({幣種: OHLCV 列表}, 植入形態的幣種集合)
+    """
+    rng = np.random.default_rng(seed)
+    now = int(time.time() * 1000) // TIMEFRAME_MS * TIMEFRAME_MS
+    timestamps = now - (bars - 1 - np.arange(bars)) * TIMEFRAME_MS
+
+    pattern = planted_bat(order)
+    market = {}
+    planted = set()
+
+    for i in range(n_symbols):
+        symbol = f"SYN{i:05d}/USDT"
+        close = 100 * np.exp(np.cumsum(rng.normal(0, 0.01, bars)))
+
+        if rng.random() < plant_ratio:
+            # 形態前的走勢維持在 X 點之上，最後一根未收盤 K線延續 D 點
+            tail = pattern * close[-len(pattern) - 2] / pattern[0]
+            lift = max(0.0, tail[0] * 1.02 - close[:-len(pattern) - 1].min())
+            close[:-len(pattern) - 1] += lift
+            close[-len(pattern) - 1:-1] = tail
+            close[-1] = tail[-1]
+            planted.add(symbol)
+
+        spread = close * 0.002
+        high = close + spread
+        low = close - spread
+        open_ = np.r_[close[0], close[:-1]]
+        volume = rng.uniform(1e3, 1e5, bars)
+
+        market[symbol] = np.column_stack(
+            [timestamps, open_, high, low, close, volume]
+        ).tolist()
+
+    return market, planted
+
+
+class FakeExchange:
+    """同步交易所替身"""
+
+    def __init__(self, market: dict):
+        self.market = market
+
+    def load_markets(self, reload: bool = False) -> dict:
+        return {symbol: {"symbol": symbol} for symbol in self.market}
+
+    def fetch_tickers(self, symbols: list = None, params: dict = None) -> dict:
+        tickers = {}
+        for symbol, rows in self.market.items():
+            close, volume = rows[-1][4], rows[-1][5]
+            tickers[symbol] = {"symbol": symbol, "quoteVolume": close * volume * 24}
+        return tickers
+
+    def fetch_ohlcv(self, symbol: str, timeframe: str = TIMEFRAME, since=None,
+                    limit: int = 500, params: dict = None) -> list:
+        rows = self.market[symbol]
+        if since is not None:
+            return [row for row in rows if row[0] >= since][:limit]
+        return rows[-limit:]
+
+
+class FakeAsyncExchange(FakeExchange):
+    """非同步交易所替身"""
+
+    async def load_markets(self, reload: bool = False) -> dict:
+        return FakeExchange.load_markets(self, reload)
+
+    async def fetch_ohlcv(self, *args, **kwargs) -> list:
+        await asyncio.sleep(0)
+        return FakeExchange.fetch_ohlcv(self, *args, **kwargs)
+
+    async def close(self):
+        pass
+
+
+def install_fakes(market: dict) -> dict:
+    """以替身取代交易所與 Discord，返回通知計數器"""
+    sent = {"embeds": 0}
+
+    def fake_webhook(embed: dict) -> bool:
+        sent["embeds"] += 1
+        return True
+
+    hs.get_exchange = lambda venue=hs.DEFAULT_VENUE: FakeExchange(market)
+    hs.get_async_exchange = lambda venue=hs.DEFAULT_VENUE: FakeAsyncExchange(market)
+    hs.queue_discord_embed = fake_webhook
+    hs.send_discord_embed = fake_webhook
+    hs.CONFIG.update({
+        "candle_store_path": None,
+        "signal_store_path": None,
+        "markets_cache_path": None,
+        "signal_sink_paths": None,
+        "verbose": False,
+    })
+    return sent
+
+# ============================================================================
+# 量測
+# ============================================================================
+
+def best_of(repeat: int, func, *args, **kwargs) -> tuple:
+    """執行 repeat 次，返回 (最短耗時, 最後一次結果)"""
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def peak_memory_mb(func, *args, **kwargs) -> float:
+    """以 tracemalloc 量測函數執行期間的記憶體峰值（MB）"""
+    tracemalloc.start()
+    try:
+        func(*args, **kwargs)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak / 1024 / 1024
+
+
+def run_pattern_functions(panel: "hs.CandlePanel", order: int) -> int:
+    """以舊版逐一形態介面評估每個幣種"""
+    functions = [
+        hs.bull_bat, hs.bear_bat, hs.bull_gartley, hs.bear_gartley,
+        hs.bull_crab, hs.bear_crab, hs.bull_butterfly, hs.bear_butterfly,
+    ]
+    matches = 0
+    for symbol in panel.symbols:
+        series = panel.series(symbol)
+        _, pivot_price = hs.detect_pivots(series["high"], series["low"], order=order)
+        if len(pivot_price) < 4:
+            continue
+        current_pat, moves = hs.current_pattern(pivot_price, series["low"])
+        for func in functions:
+            matches += bool(func(moves, [symbol], current_pat))
+    return matches
+
+
+def run_peak_detect(panel: "hs.CandlePanel", order: int):
+    """以舊版 DataFrame 介面對每個幣種執行 peak_detect"""
+    for symbol in panel.symbols:
+        hs.peak_detect(panel.symbol_frame(symbol), order=order)
+
+
+def bench_size(n_symbols: int, args) -> dict:
+    """量測單一市場規模"""
+    market, planted = make_market(n_symbols, args.bars, args.order, args.plant_ratio, args.seed)
+    sent = install_fakes(market)
+    limit = args.bars
+
+    result = {"symbols": n_symbols, "bars": args.bars, "planted": len(planted)}
+
+    result["collect_panel"], panel = best_of(args.repeat, hs.collect_panel, TIMEFRAME, limit)
+    result["dataframe_build"], _ = best_of(args.repeat, panel.to_frame)
+    result["peak_detect"], _ = best_of(args.repeat, run_peak_detect, panel, args.order)
+    result["pattern_functions"], _ = best_of(args.repeat, run_pattern_functions, panel, args.order)
+
+    pivots = np.full((len(panel), 5), np.nan)
+    for i, symbol in enumerate(panel.symbols):
+        series = panel.series(symbol)
+        _, pivot_price = hs.detect_pivots(series["high"], series["low"], order=args.order)
+        if len(pivot_price) >= 4:
+            pivots[i], _ = hs.current_pattern(pivot_price, series["low"])
+    result["evaluate_patterns"], _ = best_of(
+        args.repeat, hs.evaluate_patterns, np.diff(pivots, axis=1), pivots
+    )
+
+    sent["embeds"] = 0
+    result["scan_end_to_end"], scan = best_of(
+        args.repeat, hs.scan_harmonic_patterns, panel, order=args.order,
+        send_notifications=True, timeframe=TIMEFRAME
+    )
+    detected = {f"{s.symbol}/USDT" for s in scan["看漲蝙蝠"]}
+    result["planted_detected"] = len(detected & planted)
+    result["signals"] = sum(len(v) for v in scan.values())
+    result["notifications"] = sent["embeds"] // args.repeat
+
+    result["peak_memory_mb"] = {
+        "collect_panel": peak_memory_mb(hs.collect_panel, TIMEFRAME, limit),
+        "scan_end_to_end": peak_memory_mb(
+            hs.scan_harmonic_patterns, panel, order=args.order,
+            send_notifications=False, timeframe=TIMEFRAME
+        ),
+    }
+
+    return result
+
+
+def compare(current: dict, baseline: dict, tolerance: float) -> list:
+    """
+    與基準結果比較各階段耗時
+
+    返回：
+        超出容許範圍的項目列表 [(規模, 階段, 基準秒數, 目前秒數), ...]
+    """
+    regressions = []
+    for size, stages in current["results"].items():
+        base_stages = baseline.get("results", {}).get(size)
+        if not base_stages:
+            continue
+        for stage, value in stages.items():
+            base = base_stages.get(stage)
+            if not isinstance(value, float) or not isinstance(base, float):
+                continue
+            ratio = value / base if base > 0 else float("inf")
+            print(f"  {size:>6} {stage:<20} {base:>9.4f}s -> {value:>9.4f}s  ({ratio:.2f}x)")
+            if ratio > 1 + tolerance:
+                regressions.append((size, stage, base, value))
+    return regressions
+
+
+def main():
+    import pandas as pd
+
+    parser = argparse.ArgumentParser(description="諧波形態掃描器效能基準測試")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 5000],
+                        help="合成市場的幣種數量")
+    parser.add_argument("--bars", type=int, default=500, help="每個幣種的 K線數量")
+    parser.add_argument("--order", type=int, default=10, help="峰值檢測靈敏度")
+    parser.add_argument("--plant-ratio", type=float, default=0.05, help="植入形態的幣種比例")
+    parser.add_argument("--seed", type=int, default=42, help="亂數種子")
+    parser.add_argument("--repeat", type=int, default=3, help="每階段重複次數（取最短）")
+    parser.add_argument("--output", default="bench_output.json", help="JSON 結果輸出路徑")
+    parser.add_argument("--baseline", help="用於比較的基準 JSON")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="允許的耗時增幅比例")
+    args = parser.parse_args()
+
+    hs.logger.setLevel("WARNING")
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "seed": args.seed,
+            "bars": args.bars,
+            "order": args.order,
+        },
+        "results": {},
+    }
+
+    for size in args.sizes:
+        print(f"基準測試：{size} 個幣種 ...")
+        report["results"][str(size)] = result = bench_size(size, args)
+        print(
+            f"  完整掃描 {result['scan_end_to_end']:.3f}s | "
+            f"植入形態 {result['planted_detected']}/{result['planted']} | "
+            f"記憶體峰值 {result['peak_memory_mb']['scan_end_to_end']:.1f} MB"
+        )
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"結果已寫入 {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        print(f"與基準 {args.baseline} 比較：")
+        regressions = compare(report, baseline, args.tolerance)
+        if regressions:
+            print(f"發現 {len(regressions)} 項效能退化（容許 {args.tolerance:.0%}）")
+            sys.exit(1)
+        print("未發現效能退化")
+
+
+if __name__ == "__main__":
+    main()
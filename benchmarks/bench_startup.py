@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+諧波形態掃描器 - 啟動時間基準測試
+================================
+在全新的 Python 進程中執行各 CLI 命令，量測啟動耗時與各套件的匯入成本
+（python -X importtime），並檢查 help / test 是否載入了不需要的重量級套件。
+
+網路請求均以本地替身取代：test 的 Discord 請求直接返回 204，
+scan 使用 bench_scan 的合成市場。
+
+使用方式：
+    python benchmarks/bench_startup.py
+    python benchmarks/bench_startup.py --repeat 10 --output bench_startup.json
+    python benchmarks/bench_startup.py --baseline bench_startup_baseline.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+
+COMMANDS = ("import", "help", "test", "scan")
+
+# 不應在 help / test 中載入的套件
+HEAVY_MODULES = ("ccxt", "scipy", "pandas", "schedule")
+LIGHT_COMMANDS = ("import", "help", "test")
+
+# 在子進程中執行的驅動程式：argv[1] 為命令名稱，結果以一行 JSON 輸出到 stdout
+DRIVER = r"""
+import contextlib, io, json, sys, time
+start = time.perf_counter()
+sys.path[:0] = [{root!r}, {bench_dir!r}]
+import harmonic_scanner as hs
+imported = time.perf_counter()
+
+command = sys.argv[1]
+with contextlib.redirect_stdout(io.StringIO()):
+    if command == "help":
+        sys.argv = ["harmonic_scanner.py", "help"]
+        hs.main()
+    elif command == "test":
+        import requests
+
+        class Response:
+            status_code = 204
+            headers = {{}}
+            text = ""
+
+        requests.Session.post = lambda self, url, **kwargs: Response()
+        sys.argv = ["harmonic_scanner.py", "test"]
+        hs.main()
+    elif command == "scan":
+        import bench_scan
+        market, _ = bench_scan.make_market(20, 500, 10, 0.1, 0)
+        bench_scan.install_fakes(market)
+        hs.CONFIG["metrics_jsonl_path"] = None
+        sys.argv = ["harmonic_scanner.py", "scan"]
+        hs.main()
+done = time.perf_counter()
+
+print(json.dumps({{
+    "import_seconds": imported - start,
+    "command_seconds": done - imported,
+    "modules": sorted(m for m in {heavy!r} if m in sys.modules),
+}}))
+"""
+
+
+def parse_importtime(stderr: str, top: int = 10) -> dict:
+    """
+    解析 -X importtime 輸出，返回最耗時的頂層套件累計匯入時間（毫秒）
+    """
+    costs = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        # 分隔符號後縮排兩格者為直接由 site 或驅動程式匯入的頂層套件
+        if name.startswith("   ") and not name.startswith("    "):
+            package = name.strip().split(".")[0]
+            costs[package] = costs.get(package, 0) + int(cumulative) / 1000
+    ranked = sorted(costs.items(), key=lambda item: item[1], reverse=True)
+    return {package: round(ms, 2) for package, ms in ranked[:top]}
+
+
+def run_command(command: str) -> dict:
+    """在新進程中執行一次命令"""
+    driver = DRIVER.format(root=ROOT, bench_dir=BENCH_DIR, heavy=HEAVY_MODULES)
+    start = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", driver, command],
+        capture_output=True, text=True, cwd=ROOT
+    )
+    wall = time.perf_counter() - start
+    if proc.returncode != 0:
+        raise RuntimeError(f"{command} 執行失敗：\n{proc.stderr[-2000:]}")
+
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    result["wall_seconds"] = wall
+    result["imports_ms"] = parse_importtime(proc.stderr)
+    return result
+
+
+def bench_command(command: str, repeat: int) -> dict:
+    """重複執行命令，耗時取中位數"""
+    runs = [run_command(command) for _ in range(repeat)]
+    return {
+        "wall_seconds": statistics.median(r["wall_seconds"] for r in runs),
+        "import_seconds": statistics.median(r["import_seconds"] for r in runs),
+        "command_seconds": statistics.median(r["command_seconds"] for r in runs),
+        "heavy_modules": runs[-1]["modules"],
+        "imports_ms": runs[-1]["imports_ms"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="諧波形態掃描器啟動時間基準測試")
+    parser.add_argument("--commands", nargs="+", default=list(COMMANDS), choices=COMMANDS,
+                        help="要量測的命令")
+    parser.add_argument("--repeat", type=int, default=5, help="每個命令的執行次數（取中位數）")
+    parser.add_argument("--output", default="bench_startup.json", help="JSON 結果輸出路徑")
+    parser.add_argument("--baseline", help="用於比較的基準 JSON")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="允許的耗時增幅比例")
+    args = parser.parse_args()
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "repeat": args.repeat,
+        },
+        "results": {},
+    }
+
+    failures = []
+    for command in args.commands:
+        report["results"][command] = result = bench_command(command, args.repeat)
+        print(
+            f"{command:<8} 總耗時 {result['wall_seconds']:.3f}s | "
+            f"匯入 {result['import_seconds']:.3f}s | "
+            f"重量級套件: {', '.join(result['heavy_modules']) or '無'}"
+        )
+        if command in LIGHT_COMMANDS and result["heavy_modules"]:
+            failures.append(f"{command} 載入了 {', '.join(result['heavy_modules'])}")
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"結果已寫入 {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f).get("results", {})
+        for command, result in report["results"].items():
+            base = baseline.get(command, {}).get("wall_seconds")
+            if not base:
+                continue
+            ratio = result["wall_seconds"] / base
+            print(f"  {command:<8} {base:.3f}s -> {result['wall_seconds']:.3f}s  ({ratio:.2f}x)")
+            if ratio > 1 + args.tolerance:
+                failures.append(f"{command} 啟動耗時增加 {ratio:.2f} 倍")
+
+    if failures:
+        for failure in failures:
+            print(f"失敗：{failure}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -13,15 +13,33 @@ Louis 諧波形態掃描器
 作者：Louis_LAB / Instagram: @mr.__.l
 """
 
+from __future__ import annotations
+
 import numpy as np
-import pandas as pd
-import ccxt
+import asyncio
 import time
-import requests
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+import gzip
+import json
 import logging
-import schedule
+import os
+import queue
+import sqlite3
+import threading
+import zlib
 from datetime import datetime, timezone
-from scipy.signal import argrelextrema
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import TYPE_CHECKING
+from numpy.lib.stride_tricks import sliding_window_view
+
+# ccxt、pandas、requests、schedule 載入較慢，只在需要的函數內匯入，
+# 使 help / test 等命令不必載入交易所與數值分析套件；型別註解所需的名稱只在型別檢查時匯入
+if TYPE_CHECKING:
+    import pandas as pd
+    import requests
 
 # ============================================================================
 # 配置區 - 請在此處設定你的參數
@@ -32,18 +50,148 @@ DISCORD_WEBHOOK_URL = "https://discord.com/api/webhooks/1456273057818611847/SQ6H
 
 # 掃描設定
 CONFIG = {
+    # 要掃描的交易所（見 EXCHANGES：binance, bybit, okx），各交易所並行抓取
+    "exchanges": ["binance"],
+
     # 谐波形態掃描時間框架（支援：1h, 4h, 1d 等）
     "harmonic_timeframe": "1h",
 
-    # K線數據數量
+    # 多時間框架掃描清單（例如 ["1h", "4h", "1d"]），只抓取最小週期並在本地重採樣；
+    # None 則只掃描 harmonic_timeframe
+    "scan_timeframes": None,
+
+    # 各時間框架的峰值檢測靈敏度（例如 {"1d": 5}），未設定者使用 peak_order
+    "timeframe_peak_orders": {},
+
+    # 多時間框架時基礎週期的抓取數量上限；超過各交易所單次請求上限
+    # （EXCHANGES 的 max_limit：幣安 1500、Bybit 1000、OKX 300）時自動分頁抓取
+    "max_fetch_limit": 1500,
+
+    # K線數據數量（超過交易所單次請求上限時分頁抓取）
     "limit": 500,
 
     # 峰值檢測靈敏度（數值越大越不敏感）
     "peak_order": 10,
 
-    # 定時執行間隔（分鐘）
+    # 轉折點檢測方式："window" = 左右各 peak_order 根的局部極值；"zigzag" = 百分比 ZigZag
+    "pivot_mode": "window",
+
+    # 等高 / 等低平台的處理："strict" = 不視為轉折點（與舊版相同）；
+    # "first" / "last" = 取平台的第一根 / 最後一根 K線
+    "pivot_tie_break": "strict",
+
+    # ZigZag 模式的反轉幅度（0.05 = 5%）
+    "zigzag_pct": 0.05,
+
+    # 定時執行方式："candle_close" = 在各時間框架 K線收盤時觸發；"interval" = 固定間隔
+    "schedule_mode": "candle_close",
+
+    # 定時執行間隔（分鐘，僅 interval 模式）
     "schedule_interval_minutes": 240,  # 預設每 4 小時
 
+    # K線收盤後等待交易所完成結算的秒數（candle_close 模式）
+    "schedule_settle_seconds": 5,
+
+    # 上一次掃描尚未結束時又到觸發時間："coalesce" = 結束後合併補跑一次；"skip" = 略過
+    "schedule_overlap": "coalesce",
+
+    # 是否使用非同步並行抓取 K線（ccxt async_support）
+    "async_fetch": True,
+
+    # 每個交易所非同步抓取的最大同時請求數（adaptive_rate_limit 時為並行視窗的上限）
+    "fetch_concurrency": 20,
+
+    # 依回應的已用權重標頭（幣安 X-MBX-USED-WEIGHT-1M）與 429 / 418 以 AIMD 調整並行請求數，
+    # 有權重標頭的交易所不再使用 ccxt 的固定間隔節流；False 則維持 ccxt 速率限制器與固定並行數
+    "adaptive_rate_limit": True,
+
+    # 每分鐘已用權重達上限的此比例時暫停新請求至下一分鐘，保留餘量給進行中的請求
+    "rate_limit_target": 0.8,
+
+    # 單一交易對抓取失敗（網路錯誤、逾時、429 / 418）後的重試次數，不再直接跳過
+    "fetch_retries": 3,
+
+    # 重試的基本等待秒數（每次加倍並加上 ±50% 抖動，上限 60 秒）
+    "fetch_retry_backoff": 1.0,
+
+    # 24 小時成交額（USDT）低於此值的交易對不抓取也不掃描；0 則不過濾
+    "min_quote_volume": 0,
+
+    # 是否以一次 fetch_tickers 依成交額由高到低排序抓取、掃描與通知順序
+    "liquidity_ordering": True,
+
+    # 成交額最高的前 N 個交易對先完成抓取、掃描與通知，其餘再處理；0 則整批處理
+    "priority_symbols": 0,
+
+    # 市場資料快取（gzip JSON）路徑，避免每次掃描都下載 exchangeInfo；None 則每次重新載入
+    "markets_cache_path": "markets_cache.json.gz",
+
+    # 市場資料快取有效時間（小時），過期後於下次掃描時重新載入
+    "markets_cache_ttl_hours": 12,
+
+    # 定時模式下背景更新市場資料（新上市 / 下市）的間隔（分鐘）
+    "markets_refresh_minutes": 60,
+
+    # 交易所後端："live" = 直接連線；"record" = 連線並錄製回應；"replay" = 離線重播錄製檔
+    "exchange_backend": "live",
+
+    # 錄製檔目錄（record 寫入、replay 讀取）；binance 以外的交易所使用 recordings.<交易所>
+    "exchange_recording_path": "recordings",
+
+    # 重播時每次請求的模擬延遲：基本值加上 0 ~ jitter 的隨機抖動（毫秒）
+    "replay_latency_ms": 0,
+    "replay_jitter_ms": 0,
+
+    # 重播的交易對數量（None = 錄製檔中的全部）；超過錄製數量時自動複製出更多交易對
+    "replay_symbol_count": None,
+
+    # 重播時將整個市場複製的倍數（壓力測試用，例如 10 = 十倍交易對）
+    "replay_symbol_multiplier": 1,
+
+    # 本地 K線快取（SQLite）路徑，每次只抓取新收盤的 K線；設為 None 則每次完整下載
+    "candle_store_path": "candles.db",
+
+    # download 命令的歷史 K線（SQLite）路徑，不裁剪且可中斷後續傳；可直接作為 backtest 的來源
+    "history_store_path": "history.db",
+
+    # 是否在定時掃描之間保留轉折點狀態，只處理新收盤的 K線
+    "incremental_pivots": True,
+
+    # 形態掃描的平行進程數（1 = 單進程；大於 1 時改用進程池並停用 incremental_pivots）
+    "scan_workers": 1,
+
+    # 串流模式（auto --stream）的本地重播數據目錄（CandlePanel.save 輸出）；None 則使用交易所 WebSocket
+    "stream_replay_path": None,
+
+    # 已通知信號紀錄（SQLite）路徑，用於跨次掃描去重；設為 None 則每次都通知
+    "signal_store_path": "signals.db",
+
+    # 同一形態在最後一次出現後多久內不再重複通知（小時）
+    "signal_ttl_hours": 24,
+
+    # 信號歷史保留天數
+    "signal_retention_days": 90,
+
+    # 信號輸出檔（每個信號產生時即寫入，不經過去重），格式依副檔名：
+    # ".jsonl" / ".csv" 附加寫入單一檔案；".parquet" 為目錄，每次掃描寫入一個 part 檔（需要 pyarrow）
+    "signal_sink_paths": ["signals.jsonl"],
+
+    # auto 模式下 Prometheus 指標 HTTP 監聽埠（例如 9108，提供 /metrics）；None 則不啟動
+    "metrics_port": None,
+
+    # 單次掃描的指標紀錄（JSONL，每次掃描附加一行）；None 則不寫入
+    "metrics_jsonl_path": "scan_metrics.jsonl",
+
+    # 每次掃描結束與串流模式停止時等待 Discord 通知送出的上限（秒）；逾時未送出者留在佇列中繼續重送，並記錄於 discord_unsent
+    "notify_flush_timeout": 120,
+
+    # 分片掃描 (i, n)：只掃描 CRC32 雜湊落在第 i 片（1 ~ n）的交易對，供多台主機分擔速率額度；
+    # 分片時不發送掃描摘要，結果寫入 shard_spool_path，由 merge 命令合併後發送一則摘要。None 則掃描全部
+    "shard": None,
+
+    # 分片結果目錄（每次掃描一個子目錄）；多台主機時需為共享目錄，或先將各分片的檔案複製到協調者
+    "shard_spool_path": "spool",
+
     # 是否啟用詳細日誌
     "verbose": True,
 }
@@ -78,6 +226,248 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# ============================================================================
+# 掃描指標模組
+# ============================================================================
+
+class ScanMetrics:
+    """
+    掃描各階段的耗時與計數指標（執行緒安全）
+
+    - stage(): 階段計時，同一次掃描內同名階段累加（例如多時間框架）
+    - observe_fetch(): 單一幣種 fetch_ohlcv 延遲，記錄於直方圖
+    - error() / skip(): 依階段 / 原因分類的錯誤與跳過計數
+    - 本次掃描的數值於 start_cycle() 重設，Prometheus 匯出的累計值則持續累加
+    """
+
+    FETCH_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+    SLOWEST = 10
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.totals = {}
+        self.fetch_buckets = [0] * (len(self.FETCH_BUCKETS) + 1)
+        self.fetch_sum = 0.0
+        self.scans = 0
+        self.last_scan = {}
+        # 各時間框架最近一次排程觸發的延遲（收盤到開始掃描，秒）
+        self.lateness = {}
+        self.start_cycle()
+
+    def start_cycle(self):
+        """開始新一次掃描，清除本次掃描的數值"""
+        with self._lock:
+            self.stages = {}
+            self.cycle = {}
+            self.fetch_latency = []
+
+    def _add(self, metric: str, label: str, value: float):
+        key = (metric, label)
+        self.totals[key] = self.totals.get(key, 0) + value
+        self.cycle[key] = self.cycle.get(key, 0) + value
+
+    @contextmanager
+    def stage(self, name: str):
+        """計時一個掃描階段"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.stages[name] = self.stages.get(name, 0.0) + elapsed
+                self._add("stage_seconds", name, elapsed)
+
+    def observe_fetch(self, symbol: str, seconds: float):
+        """記錄單一幣種的 K線請求延遲"""
+        with self._lock:
+            self.fetch_latency.append((seconds, symbol))
+            self.fetch_sum += seconds
+            for i, bound in enumerate(self.FETCH_BUCKETS):
+                if seconds <= bound:
+                    self.fetch_buckets[i] += 1
+                    break
+            else:
+                self.fetch_buckets[-1] += 1
+
+    def error(self, stage: str, count: int = 1):
+        """記錄錯誤"""
+        with self._lock:
+            self._add("errors", stage, count)
+
+    def skip(self, reason: str, count: int = 1):
+        """記錄被跳過的幣種或信號"""
+        with self._lock:
+            self._add("skips", reason, count)
+
+    def count(self, name: str, value: float = 1):
+        """累加其他計數（例如 Discord 重試與等待秒數）"""
+        with self._lock:
+            self._add(name, "", value)
+
+    def schedule_run(self, timeframes: list, lateness: float):
+        """記錄一次排程觸發：K線收盤到開始掃描的延遲（秒）"""
+        with self._lock:
+            for timeframe in timeframes:
+                self.lateness[timeframe] = lateness
+                self._add("schedule_runs", timeframe, 1)
+                self._add("schedule_lateness_seconds", timeframe, lateness)
+
+    def finish_cycle(self, elapsed: float, signals: int, timeframes: list):
+        """結束一次掃描，記錄總耗時與信號數量"""
+        with self._lock:
+            self.stages["total"] = elapsed
+            self._add("stage_seconds", "total", elapsed)
+            self.scans += 1
+            self.last_scan = {
+                "timestamp": time.time(),
+                "elapsed": elapsed,
+                "signals": signals,
+                "timeframes": list(timeframes),
+            }
+
+    def snapshot(self) -> dict:
+        """
+        返回最近一次掃描的指標摘要
+
+        返回：
+            dict：階段耗時、K線延遲分佈與最慢幣種、錯誤 / 跳過計數、通知佇列深度
+        """
+        with self._lock:
+            latency = sorted(self.fetch_latency, reverse=True)
+            values = np.array([seconds for seconds, _ in latency])
+            cycle = dict(self.cycle)
+            record = dict(self.last_scan)
+            record["stages"] = {name: round(v, 4) for name, v in self.stages.items()}
+            record["lateness"] = {tf: round(v, 3) for tf, v in self.lateness.items()}
+
+        record["timestamp"] = datetime.fromtimestamp(
+            record.get("timestamp", time.time()), timezone.utc
+        ).isoformat()
+        record["fetch_latency"] = {
+            "count": len(values),
+            "p50": round(float(np.percentile(values, 50)), 4) if len(values) else None,
+            "p95": round(float(np.percentile(values, 95)), 4) if len(values) else None,
+            "max": round(float(values[0]), 4) if len(values) else None,
+            "slowest": [[symbol, round(seconds, 4)] for seconds, symbol in latency[:self.SLOWEST]],
+        }
+        for metric in ("errors", "skips"):
+            record[metric] = {label: v for (name, label), v in cycle.items() if name == metric}
+        record["counters"] = {name: v for (name, label), v in cycle.items() if label == ""}
+        record["queue_depth"] = _dispatcher.depth if _dispatcher is not None else 0
+        return record
+
+    def append_jsonl(self, path: str):
+        """將最近一次掃描的指標附加到 JSONL 檔"""
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(self.snapshot(), ensure_ascii=False) + "\n")
+
+    def to_prometheus(self) -> str:
+        """以 Prometheus 文字格式輸出累計指標"""
+        lines = []
+
+        def metric(name: str, kind: str, help_text: str, samples: list):
+            lines.append(f"# HELP harmonic_{name} {help_text}")
+            lines.append(f"# TYPE harmonic_{name} {kind}")
+            for labels, value in samples:
+                lines.append(f"harmonic_{name}{labels} {value}")
+
+        with self._lock:
+            totals = dict(self.totals)
+            stages = dict(self.stages)
+            buckets = list(self.fetch_buckets)
+            fetch_sum = self.fetch_sum
+            scans = self.scans
+            last_scan = dict(self.last_scan)
+            lateness = dict(self.lateness)
+
+        def labelled(metric_name: str, label: str) -> list:
+            return [
+                (f'{{{label}="{key}"}}', value)
+                for (name, key), value in sorted(totals.items()) if name == metric_name
+            ]
+
+        metric("scan_stage_seconds", "gauge", "最近一次掃描各階段耗時（秒）",
+               [(f'{{stage="{name}"}}', value) for name, value in sorted(stages.items())])
+        metric("scan_stage_seconds_total", "counter", "各階段累計耗時（秒）",
+               labelled("stage_seconds", "stage"))
+
+        cumulative = np.cumsum(buckets)
+        samples = [(f'{{le="{bound}"}}', int(n)) for bound, n in zip(self.FETCH_BUCKETS, cumulative)]
+        samples.append(('{le="+Inf"}', int(cumulative[-1])))
+        metric("fetch_latency_seconds", "histogram", "單一幣種 K線請求延遲（秒）", [])
+        lines.extend(f"harmonic_fetch_latency_seconds_bucket{labels} {n}" for labels, n in samples)
+        lines.append(f"harmonic_fetch_latency_seconds_sum {fetch_sum}")
+        lines.append(f"harmonic_fetch_latency_seconds_count {int(cumulative[-1])}")
+
+        metric("scan_errors_total", "counter", "各階段錯誤次數", labelled("errors", "stage"))
+        metric("scan_skips_total", "counter", "被跳過的幣種 / 信號數量", labelled("skips", "reason"))
+        metric("schedule_lateness_seconds", "gauge", "最近一次排程觸發距 K線收盤的延遲（秒）",
+               [(f'{{timeframe="{tf}"}}', value) for tf, value in sorted(lateness.items())])
+        metric("schedule_lateness_seconds_total", "counter", "排程觸發延遲累計（秒）",
+               labelled("schedule_lateness_seconds", "timeframe"))
+        metric("schedule_runs_total", "counter", "各時間框架的排程觸發次數",
+               labelled("schedule_runs", "timeframe"))
+        for (name, label), value in sorted(totals.items()):
+            if label == "":
+                metric(f"{name}_total", "counter", name, [("", value)])
+
+        metric("scans_total", "counter", "完成的掃描次數", [("", scans)])
+        metric("last_scan_timestamp_seconds", "gauge", "最近一次掃描完成時間",
+               [("", last_scan.get("timestamp", 0))])
+        metric("last_scan_signals", "gauge", "最近一次掃描的信號數量",
+               [("", last_scan.get("signals", 0))])
+        metric("notification_queue_depth", "gauge", "Discord 通知佇列中等待發送的數量",
+               [("", _dispatcher.depth if _dispatcher is not None else 0)])
+
+        return "\n".join(lines) + "\n"
+
+
+_metrics = ScanMetrics()
+
+
+def get_metrics() -> ScanMetrics:
+    """取得共用的掃描指標"""
+    return _metrics
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    """提供 /metrics 的 HTTP 處理器"""
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = _metrics.to_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port: int = None):
+    """
+    在背景執行緒啟動 Prometheus 指標 HTTP 監聽（僅綁定本機）
+
+    返回：
+        ThreadingHTTPServer，未設定埠或啟動失敗時返回 None
+    """
+    port = port or CONFIG["metrics_port"]
+    if not port:
+        return None
+    try:
+        server = ThreadingHTTPServer(("127.0.0.1", int(port)), _MetricsHandler)
+    except OSError as e:
+        logger.error(f"指標服務啟動失敗（埠 {port}）：{str(e)}")
+        return None
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    logger.info(f"指標服務已啟動 | http://127.0.0.1:{port}/metrics")
+    return server
+
 # ============================================================================
 # Discord 通知模組
 # ============================================================================
@@ -105,9 +495,31 @@ def get_coin_icon(symbol: str) -> str:
     return icons.get(symbol_lower, "https://assets.coingecko.com/coins/images/1/small/bitcoin.png")
 
 
+_http_session = None
+
+
+def get_http_session() -> requests.Session:
+    """共用的 HTTP Session（重複使用連線）"""
+    global _http_session
+    if _http_session is None:
+        import requests
+
+        _http_session = requests.Session()
+        _http_session.headers.update({"Content-Type": "application/json"})
+    return _http_session
+
+
+def webhook_configured() -> bool:
+    """檢查 Discord Webhook URL 是否已設定"""
+    if DISCORD_WEBHOOK_URL == "你的_DISCORD_WEBHOOK_URL":
+        logger.warning("請先設定 DISCORD_WEBHOOK_URL！")
+        return False
+    return True
+
+
 def send_discord_embed(embed_data: dict) -> bool:
     """
-    發送 Discord Embed 訊息
+    同步發送 Discord Embed 訊息
 
     參數：
         embed_data: 完整的 embed 資料字典
@@ -115,20 +527,15 @@ def send_discord_embed(embed_data: dict) -> bool:
     返回：
         bool: 是否發送成功
     """
-    if DISCORD_WEBHOOK_URL == "你的_DISCORD_WEBHOOK_URL":
-        logger.warning("請先設定 DISCORD_WEBHOOK_URL！")
+    if not webhook_configured():
         return False
 
     payload = {"embeds": [embed_data]}
 
     try:
-        response = requests.post(
-            DISCORD_WEBHOOK_URL,
-            json=payload,
-            headers={"Content-Type": "application/json"}
-        )
+        response = get_http_session().post(DISCORD_WEBHOOK_URL, json=payload)
 
-        if response.status_code == 204:
+        if response.status_code in (200, 204):
             logger.info(f"Discord 通知發送成功：{embed_data.get('title', 'N/A')}")
             return True
         else:
@@ -140,10 +547,195 @@ def send_discord_embed(embed_data: dict) -> bool:
         return False
 
 
+def _embed_length(embed: dict) -> int:
+    """計算 embed 中計入 Discord 6000 字元上限的文字長度"""
+    length = len(embed.get("title", "")) + len(embed.get("description", ""))
+    length += len(embed.get("author", {}).get("name", ""))
+    length += len(embed.get("footer", {}).get("text", ""))
+    for field in embed.get("fields", []):
+        length += len(field.get("name", "")) + len(field.get("value", ""))
+    return length
+
+
+class DiscordDispatcher:
+    """
+    背景 Discord 通知佇列
+
+    - 掃描只需將 embed 放入佇列，由背景執行緒發送，不會阻塞掃描
+    - 共用 requests.Session 連線池
+    - 每則 webhook 訊息最多打包 10 個 embed（且不超過 6000 字元）
+    - 依 X-RateLimit-Remaining / X-RateLimit-Reset-After 節流，
+      收到 429 時依 retry_after 等待後重送，不丟棄通知
+    - 5xx 與網路錯誤以指數退避（上限 max_backoff 秒）持續重送，不丟棄通知；
+      只有 Webhook 拒絕的請求（其他 4xx）與非預期的發送錯誤會丟棄批次，並記錄於 discord_dropped
+    """
+
+    MAX_EMBEDS = 10
+    MAX_CHARS = 6000
+
+    def __init__(self, webhook_url: str = None, max_backoff: float = 30, linger: float = 0.2):
+        self.webhook_url = webhook_url or DISCORD_WEBHOOK_URL
+        self.max_backoff = max_backoff
+        self.linger = linger
+        self.queue = queue.Queue()
+        self.session = get_http_session()
+        self._resume_at = 0.0
+        self._carry = None
+        self._thread = threading.Thread(target=self._run, name="discord-dispatcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, embed: dict):
+        """將 embed 放入發送佇列（立即返回）"""
+        self.queue.put(embed)
+
+    @property
+    def depth(self) -> int:
+        """尚未送出的 embed 數量（含正在重送的批次）"""
+        return self.queue.unfinished_tasks
+
+    def flush(self, timeout: float = None) -> bool:
+        """
+        等待佇列中的通知全部發送完成
+
+        逾時時不丟棄通知：未送出的 embed 留在佇列中由背景執行緒繼續重送，
+        其數量記錄於 discord_unsent
+
+        返回：
+            bool: 是否在 timeout 內完成
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self.queue.all_tasks_done:
+            while self.queue.unfinished_tasks:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    unsent = self.queue.unfinished_tasks
+                    _metrics.count("discord_unsent", unsent)
+                    logger.warning(f"Discord 通知 {timeout:.0f} 秒內未送完：{unsent} 則仍在佇列中重送")
+                    return False
+                self.queue.all_tasks_done.wait(remaining)
+        return True
+
+    def _next_batch(self) -> list:
+        """取出下一批 embed：等待 linger 秒收集更多通知，超出字元上限者留給下一批"""
+        if self._carry is not None:
+            batch, self._carry = [self._carry], None
+        else:
+            batch = [self.queue.get()]
+        chars = _embed_length(batch[0])
+        deadline = time.time() + self.linger
+
+        while len(batch) < self.MAX_EMBEDS:
+            try:
+                embed = self.queue.get(timeout=max(0.0, deadline - time.time()))
+            except queue.Empty:
+                break
+            if chars + _embed_length(embed) > self.MAX_CHARS:
+                self._carry = embed
+                break
+            batch.append(embed)
+            chars += _embed_length(embed)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                self._send(batch)
+            except Exception as e:
+                _metrics.error("discord")
+                _metrics.count("discord_dropped", len(batch))
+                logger.error(f"Discord 通知發送異常，丟棄 {len(batch)} 則：{str(e)}")
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    def _backoff(self, failures: int, reason: str):
+        """5xx / 網路錯誤後以指數退避等待（上限 max_backoff 秒）"""
+        delay = min(self.max_backoff, 2 ** failures)
+        _metrics.error("discord")
+        _metrics.count("discord_sleep_seconds", delay)
+        if failures == 1 or failures % 10 == 0:
+            logger.warning(f"Discord 通知發送失敗（第 {failures} 次），{delay:.0f} 秒後重送：{reason}")
+        time.sleep(delay)
+
+    def _send(self, batch: list) -> bool:
+        failures = 0
+        while True:
+            wait = self._resume_at - time.time()
+            if wait > 0:
+                _metrics.count("discord_sleep_seconds", wait)
+                time.sleep(wait)
+
+            try:
+                response = self.session.post(self.webhook_url, json={"embeds": batch})
+            except Exception as e:
+                failures += 1
+                self._backoff(failures, str(e))
+                continue
+
+            headers = response.headers
+            if headers.get("X-RateLimit-Remaining") == "0":
+                reset_after = float(headers.get("X-RateLimit-Reset-After", 1))
+                self._resume_at = time.time() + reset_after
+
+            if response.status_code in (200, 204):
+                _metrics.count("discord_embeds_sent", len(batch))
+                logger.info(f"Discord 通知發送成功：{len(batch)} 則")
+                return True
+
+            if response.status_code == 429:
+                try:
+                    retry_after = float(response.json().get("retry_after", 1))
+                except (ValueError, AttributeError, TypeError):
+                    try:
+                        retry_after = float(headers.get("Retry-After", 1))
+                    except ValueError:
+                        retry_after = 1.0
+                logger.warning(f"Discord 速率限制，{retry_after:.2f} 秒後重送")
+                _metrics.count("discord_rate_limited")
+                self._resume_at = time.time() + retry_after
+                continue
+
+            if response.status_code >= 500:
+                failures += 1
+                self._backoff(failures, f"HTTP {response.status_code}")
+                continue
+
+            _metrics.error("discord")
+            _metrics.count("discord_dropped", len(batch))
+            logger.error(f"Discord 通知發送失敗，丟棄 {len(batch)} 則：{response.status_code} - {response.text}")
+            return False
+
+
+_dispatcher = None
+
+
+def get_dispatcher() -> DiscordDispatcher:
+    """取得共用的背景通知佇列（首次使用時啟動）"""
+    global _dispatcher
+    if _dispatcher is None:
+        _dispatcher = DiscordDispatcher()
+    return _dispatcher
+
+
+def queue_discord_embed(embed_data: dict) -> bool:
+    """
+    將 Discord Embed 放入背景佇列發送（不阻塞）
+
+    返回：
+        bool: 是否成功加入佇列
+    """
+    if not webhook_configured():
+        return False
+    get_dispatcher().submit(embed_data)
+    return True
+
+
 def send_harmonic_signal(pattern_name: str, symbol: str, prz: float, sl: float,
-                         tp1: float, tp2: float, tp3: float, timeframe: str):
+                         tp1: float, tp2: float, tp3: float, timeframe: str,
+                         venue: str = None):
     """
-    發送谐波形態信號到 Discord（美化版）
+    發送谐波形態信號到 Discord（美化版），提供 venue 時標示交易所
     """
     is_bullish = "看漲" in pattern_name
     direction = "LONG 做多" if is_bullish else "SHORT 做空"
@@ -183,7 +775,7 @@ def send_harmonic_signal(pattern_name: str, symbol: str, prz: float, sl: float,
         "description": (
             f"```\n"
             f"{'═' * 35}\n"
-            f"   {symbol}/USDT 永續合約\n"
+            f"   {symbol}/USDT 永續合約{f' | {venue_label(venue)}' if venue else ''}\n"
             f"{'═' * 35}\n"
             f"```\n"
             f"發現 **{pattern_name}** 諧波形態\n"
@@ -213,12 +805,17 @@ def send_harmonic_signal(pattern_name: str, symbol: str, prz: float, sl: float,
         "timestamp": datetime.now(timezone.utc).isoformat()
     }
 
-    send_discord_embed(embed)
+    queue_discord_embed(embed)
 
 
-def send_scan_summary(harmonic_count: int, timeframe: str):
+def send_scan_summary(harmonic_count: int, timeframe: str, venue_counts: dict = None,
+                      shards: str = None):
     """
     發送掃描摘要到 Discord
+
+    參數：
+        venue_counts: {交易所: 信號數量}，提供時附上各交易所的信號數量
+        shards: 合併分片掃描時的分片完成數（例如 "8/8"）
     """
     # 根據信號數量選擇狀態
     if harmonic_count == 0:
@@ -263,590 +860,3621 @@ def send_scan_summary(harmonic_count: int, timeframe: str):
         "timestamp": datetime.now(timezone.utc).isoformat()
     }
 
-    send_discord_embed(embed)
+    if venue_counts:
+        embed["fields"].append({
+            "name": "交易所",
+            "value": "```" + " | ".join(
+                f"{venue_label(venue)}: {count}" for venue, count in venue_counts.items()
+            ) + "```",
+            "inline": False
+        })
+
+    if shards:
+        embed["fields"].append({"name": "分片", "value": f"```{shards}```", "inline": True})
+
+    queue_discord_embed(embed)
 
 # ============================================================================
-# 數據收集模組
+# K線面板模組
 # ============================================================================
 
-def get_exchange():
+class CandlePanel:
     """
-    建立幣安期貨交易所連接
+    K線面板：以 (幣種 × K線) 的連續 NumPy 陣列保存所有幣種的 OHLCV
+
+    - timestamps: int64 開盤時間（毫秒）
+    - open / high / low / close / volume: float64 陣列
+    - lengths: 每個幣種的有效 K線數量（數據靠左排列，不足部分以 NaN 填補）
+
+    可選擇以記憶體映射（np.memmap）檔案作為底層儲存，
+    並提供 to_frame() 轉回舊版長格式 DataFrame 以維持相容。
     """
-    return ccxt.binance({
-        'enableRateLimit': True,
-        'options': {
-            'defaultType': 'future',
+
+    FIELDS = ("timestamps", "open", "high", "low", "close", "volume")
+
+    def __init__(self, symbols: list, timestamps: np.ndarray, open: np.ndarray,
+                 high: np.ndarray, low: np.ndarray, close: np.ndarray,
+                 volume: np.ndarray, lengths: np.ndarray):
+        self.symbols = list(symbols)
+        self.timestamps = timestamps
+        self.open = open
+        self.high = high
+        self.low = low
+        self.close = close
+        self.volume = volume
+        self.lengths = lengths
+        self.index = {symbol: i for i, symbol in enumerate(self.symbols)}
+
+    def __len__(self) -> int:
+        return len(self.symbols)
+
+    @property
+    def empty(self) -> bool:
+        return len(self.symbols) == 0
+
+    @staticmethod
+    def _allocate(path, shape: tuple) -> dict:
+        """配置面板陣列，指定 path 時以 .npy 記憶體映射檔案儲存"""
+        arrays = {}
+        if path:
+            os.makedirs(path, exist_ok=True)
+        for field in CandlePanel.FIELDS:
+            dtype = np.int64 if field == "timestamps" else np.float64
+            if path:
+                arrays[field] = np.lib.format.open_memmap(
+                    os.path.join(path, f"{field}.npy"), mode="w+", dtype=dtype, shape=shape
+                )
+            else:
+                arrays[field] = np.empty(shape, dtype=dtype)
+            arrays[field][:] = 0 if field == "timestamps" else np.nan
+        return arrays
+
+    @classmethod
+    def from_candles(cls, candles: list, path: str = None) -> "CandlePanel":
+        """
+        由 ccxt OHLCV 列表建立面板
+
+        參數：
+            candles: [(幣種, OHLCV 列表), ...]
+            path: 記憶體映射目錄（可選）
+        """
+        candles = [(symbol, ohlcv) for symbol, ohlcv in candles if len(ohlcv)]
+        lengths = np.array([len(ohlcv) for _, ohlcv in candles], dtype=np.int64)
+        bars = int(lengths.max()) if len(lengths) else 0
+
+        arrays = cls._allocate(path, (len(candles), bars))
+        for i, (_, ohlcv) in enumerate(candles):
+            rows = np.asarray(ohlcv, dtype=np.float64)
+            n = len(rows)
+            arrays["timestamps"][i, :n] = rows[:, 0].astype(np.int64)
+            for col, field in enumerate(cls.FIELDS[1:], start=1):
+                arrays[field][i, :n] = rows[:, col]
+
+        panel = cls([symbol for symbol, _ in candles], lengths=lengths, **arrays)
+        if path:
+            panel._write_meta(path)
+        return panel
+
+    @classmethod
+    def _from_flat(cls, symbols: list, codes: np.ndarray, columns: dict,
+                   path: str = None) -> "CandlePanel":
+        """
+        由扁平欄位陣列建立面板
+
+        參數：
+            symbols: 幣種名稱列表
+            codes: 每一列所屬幣種的索引（同一幣種內需依時間排序）
+            columns: {欄位名稱: 扁平陣列}，欄位與 FIELDS 相同
+        """
+        order = np.argsort(codes, kind="stable")
+        codes = codes[order]
+        lengths = np.bincount(codes, minlength=len(symbols)).astype(np.int64)
+        starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+        positions = np.arange(len(codes)) - starts[codes]
+
+        arrays = cls._allocate(path, (len(symbols), int(lengths.max()) if len(lengths) else 0))
+        for field in cls.FIELDS:
+            arrays[field][codes, positions] = columns[field][order]
+
+        panel = cls(list(symbols), lengths=lengths, **arrays)
+        if path:
+            panel._write_meta(path)
+        return panel
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame, path: str = None) -> "CandlePanel":
+        """由舊版長格式 DataFrame（含 Symbol 欄位）建立面板"""
+        import pandas as pd
+
+        codes, symbols = pd.factorize(df['Symbol'])
+        datetimes = pd.to_datetime(df['Datetime']).values.astype("datetime64[ms]")
+        columns = {"timestamps": datetimes.astype(np.int64)}
+        for field, column in zip(cls.FIELDS[1:], ['Open', 'High', 'Low', 'Close', 'Vol']):
+            columns[field] = df[column].to_numpy(dtype=np.float64)
+
+        return cls._from_flat(list(symbols), codes, columns, path)
+
+    def resample(self, source_timeframe: str, target_timeframe: str) -> "CandlePanel":
+        """
+        將面板重採樣為較大的時間框架
+
+        K線依交易所對齊的 UTC 邊界分桶（週線從週一開始），
+        只保留基礎 K線完整的桶，未收盤或有缺口的桶會被捨棄。
+        """
+        source_ms = timeframe_to_ms(source_timeframe)
+        target_ms = timeframe_to_ms(target_timeframe)
+        if target_timeframe.endswith("M") or target_ms % source_ms:
+            raise ValueError(f"無法由 {source_timeframe} 重採樣為 {target_timeframe}")
+
+        ratio = target_ms // source_ms
+        if ratio == 1:
+            return self
+
+        offset = timeframe_offset_ms(target_timeframe)
+
+        valid = np.arange(self.timestamps.shape[1]) < self.lengths[:, None]
+        codes = np.nonzero(valid)[0]
+        ts = self.timestamps[valid]
+        buckets = (ts - offset) // target_ms
+
+        starts = np.flatnonzero(np.r_[True, (buckets[1:] != buckets[:-1]) | (codes[1:] != codes[:-1])])
+        counts = np.diff(np.r_[starts, len(ts)])
+        ends = starts + counts - 1
+        complete = counts == ratio
+
+        columns = {
+            "timestamps": (buckets[starts] * target_ms + offset)[complete],
+            "open": self.open[valid][starts][complete],
+            "high": np.maximum.reduceat(self.high[valid], starts)[complete],
+            "low": np.minimum.reduceat(self.low[valid], starts)[complete],
+            "close": self.close[valid][ends][complete],
+            "volume": np.add.reduceat(self.volume[valid], starts)[complete],
         }
-    })
+        return CandlePanel._from_flat(self.symbols, codes[starts][complete], columns)
+
+    def _write_meta(self, path: str):
+        for field in self.FIELDS:
+            getattr(self, field).flush()
+        np.save(os.path.join(path, "lengths.npy"), self.lengths)
+        with open(os.path.join(path, "symbols.json"), "w", encoding="utf-8") as f:
+            json.dump(self.symbols, f)
+
+    def save(self, path: str):
+        """將面板寫入目錄，之後可用 CandlePanel.load 以記憶體映射方式讀取"""
+        os.makedirs(path, exist_ok=True)
+        for field in self.FIELDS:
+            np.save(os.path.join(path, f"{field}.npy"), getattr(self, field))
+        np.save(os.path.join(path, "lengths.npy"), self.lengths)
+        with open(os.path.join(path, "symbols.json"), "w", encoding="utf-8") as f:
+            json.dump(self.symbols, f)
+
+    @classmethod
+    def load(cls, path: str, mmap_mode: str = "r") -> "CandlePanel":
+        """從目錄讀取面板，預設以唯讀記憶體映射開啟，不需整份載入記憶體"""
+        with open(os.path.join(path, "symbols.json"), encoding="utf-8") as f:
+            symbols = json.load(f)
+        arrays = {
+            field: np.load(os.path.join(path, f"{field}.npy"), mmap_mode=mmap_mode)
+            for field in cls.FIELDS
+        }
+        lengths = np.load(os.path.join(path, "lengths.npy"))
+        return cls(symbols, lengths=lengths, **arrays)
+
+    def series(self, symbol: str) -> dict:
+        """O(1) 取得單一幣種各欄位的陣列視圖（不複製數據）"""
+        i = self.index[symbol]
+        n = self.lengths[i]
+        return {field: getattr(self, field)[i, :n] for field in self.FIELDS}
+
+    def symbol_frame(self, symbol: str) -> pd.DataFrame:
+        """單一幣種的舊版格式 DataFrame"""
+        import pandas as pd
+
+        s = self.series(symbol)
+        return pd.DataFrame({
+            'Datetime': pd.to_datetime(s["timestamps"], unit='ms'),
+            'Open': s["open"],
+            'High': s["high"],
+            'Low': s["low"],
+            'Close': s["close"],
+            'Vol': s["volume"],
+            'Symbol': symbol,
+        })
+
+    def to_frame(self) -> pd.DataFrame:
+        """轉為舊版長格式 DataFrame（所有幣種串接）"""
+        import pandas as pd
+
+        columns = ['Datetime', 'Open', 'High', 'Low', 'Close', 'Vol', 'Symbol']
+        if self.empty:
+            return pd.DataFrame(columns=columns)
+
+        mask = np.arange(self.timestamps.shape[1]) < self.lengths[:, None]
+        return pd.DataFrame({
+            'Datetime': pd.to_datetime(self.timestamps[mask], unit='ms'),
+            'Open': self.open[mask],
+            'High': self.high[mask],
+            'Low': self.low[mask],
+            'Close': self.close[mask],
+            'Vol': self.volume[mask],
+            'Symbol': np.repeat(np.array(self.symbols, dtype=object), self.lengths),
+        }, columns=columns)
 
+# ============================================================================
+# 交易所錄製 / 重播模組
+# ============================================================================
 
-def collect_data(timeframe: str = '4h', limit: int = 500) -> pd.DataFrame:
+class ExchangeRecording:
     """
-    收集所有 USDT 永續合約的 K線數據
-
-    參數：
-        timeframe: 時間框架（1h, 4h, 1d 等）
-        limit: K線數量
+    交易所回應錄製檔
 
-    返回：
-        包含所有幣種 OHLCV 數據的 DataFrame
+    目錄結構：
+        markets.json.gz  - 最近一次 load_markets 的回應
+        tickers.json.gz  - 最近一次 fetch_tickers 的回應
+        ohlcv.jsonl.gz   - 每次 fetch_ohlcv 附加一個 gzip 成員（一行 JSON）
     """
-    logger.info(f"開始收集數據 | 時間框架: {timeframe} | K線數量: {limit}")
 
-    exchange = get_exchange()
+    MARKETS_FILE = "markets.json.gz"
+    TICKERS_FILE = "tickers.json.gz"
+    OHLCV_FILE = "ohlcv.jsonl.gz"
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def _save_json(self, filename: str, data: dict):
+        os.makedirs(self.path, exist_ok=True)
+        with gzip.open(os.path.join(self.path, filename), "wt", encoding="utf-8") as f:
+            json.dump(data, f, default=str)
+
+    def _load_json(self, filename: str):
+        path = os.path.join(self.path, filename)
+        if not os.path.exists(path):
+            return None
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            return json.load(f)
+
+    def save_markets(self, markets: dict):
+        self._save_json(self.MARKETS_FILE, markets)
+
+    def save_tickers(self, tickers: dict):
+        self._save_json(self.TICKERS_FILE, tickers)
+
+    def append_ohlcv(self, symbol: str, timeframe: str, since, limit, ohlcv: list):
+        os.makedirs(self.path, exist_ok=True)
+        record = {"symbol": symbol, "timeframe": timeframe, "since": since,
+                  "limit": limit, "ohlcv": ohlcv}
+        with gzip.open(os.path.join(self.path, self.OHLCV_FILE), "at", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+
+    def load_markets(self) -> dict:
+        markets = self._load_json(self.MARKETS_FILE)
+        if markets is None:
+            raise FileNotFoundError(os.path.join(self.path, self.MARKETS_FILE))
+        return markets
+
+    def load_tickers(self):
+        """返回錄製的行情資料，未錄製時返回 None"""
+        return self._load_json(self.TICKERS_FILE)
+
+    def load_ohlcv(self) -> dict:
+        """
+        讀取所有錄製的 K線，同一幣種的多次回應依時間合併（重複時以較晚錄製者為準）
+
+        返回：
+            {時間框架: {幣種: (K線數, 6) 陣列}}
+        """
+        merged = {}
+        path = os.path.join(self.path, self.OHLCV_FILE)
+        if not os.path.exists(path):
+            return {}
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                record = json.loads(line)
+                rows = merged.setdefault(record["timeframe"], {}).setdefault(record["symbol"], {})
+                for row in record["ohlcv"]:
+                    rows[row[0]] = row
+        return {
+            timeframe: {
+                symbol: np.array([rows[ts] for ts in sorted(rows)], dtype=np.float64)
+                for symbol, rows in symbols.items()
+            }
+            for timeframe, symbols in merged.items()
+        }
 
-    # 獲取所有 USDT 永續合約
-    all_coins = list(exchange.load_markets().keys())
-    coins = [x for x in all_coins if "/USDT" in x and "_" not in x]
 
-    logger.info(f"找到 {len(coins)} 個 USDT 交易對")
+class RecordingExchange:
+    """包裝 ccxt 同步客戶端，將 load_markets / fetch_ohlcv 的回應寫入錄製檔"""
 
-    all_candles = []
-    success_count = 0
-    total_coins = len(coins)
-    progress_interval = max(1, total_coins // 10)
+    def __init__(self, exchange, recording: ExchangeRecording):
+        self.exchange = exchange
+        self.recording = recording
 
-    for idx, symbol in enumerate(coins):
-        try:
-            df = pd.DataFrame(
-                exchange.fetch_ohlcv(symbol, timeframe=timeframe, limit=limit)
-            )
-            df['symbol'] = symbol
-            df.columns = ['Datetime', 'Open', 'High', 'Low', 'Close', 'Vol', 'Symbol']
+    def __getattr__(self, name):
+        return getattr(self.exchange, name)
 
-            # 時間轉換
-            df['Datetime'] = df['Datetime'].apply(
-                lambda x: time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(x / 1000.))
-            )
+    def load_markets(self, reload: bool = False) -> dict:
+        markets = self.exchange.load_markets(reload)
+        self.recording.save_markets(markets)
+        return markets
 
-            # 移除最後一根未完成的 K線
-            df = df[:-1]
+    def set_markets(self, markets, currencies=None) -> dict:
+        markets = self.exchange.set_markets(markets, currencies)
+        self.recording.save_markets(markets)
+        return markets
 
-            all_candles.append(df)
-            success_count += 1
+    def fetch_tickers(self, symbols: list = None, params: dict = None) -> dict:
+        tickers = self.exchange.fetch_tickers(symbols, params or {})
+        self.recording.save_tickers(tickers)
+        return tickers
 
-            # 顯示進度
-            if (idx + 1) % progress_interval == 0 or (idx + 1) == total_coins:
-                progress = (idx + 1) / total_coins * 100
-                logger.info(f"數據收集進度: {idx + 1}/{total_coins} ({progress:.0f}%)")
+    def fetch_ohlcv(self, symbol: str, timeframe: str = "1m", since=None, limit=None,
+                    params: dict = None) -> list:
+        ohlcv = self.exchange.fetch_ohlcv(symbol, timeframe, since, limit, params or {})
+        self.recording.append_ohlcv(symbol, timeframe, since, limit, ohlcv)
+        return ohlcv
 
-        except Exception as e:
-            if CONFIG["verbose"]:
-                logger.debug(f"跳過 {symbol}: {str(e)}")
 
-    if not all_candles:
-        logger.error("無法收集任何數據！")
-        return pd.DataFrame()
+class AsyncRecordingExchange(RecordingExchange):
+    """包裝 ccxt 非同步客戶端的錄製器"""
 
-    result = pd.concat(all_candles)
-    result['Datetime'] = pd.to_datetime(result['Datetime'])
+    async def load_markets(self, reload: bool = False) -> dict:
+        markets = await self.exchange.load_markets(reload)
+        self.recording.save_markets(markets)
+        return markets
 
-    logger.info(f"數據收集完成 | 成功: {success_count}/{len(coins)} 個交易對")
+    async def fetch_ohlcv(self, symbol: str, timeframe: str = "1m", since=None, limit=None,
+                          params: dict = None) -> list:
+        ohlcv = await self.exchange.fetch_ohlcv(symbol, timeframe, since, limit, params or {})
+        self.recording.append_ohlcv(symbol, timeframe, since, limit, ohlcv)
+        return ohlcv
 
-    return result
+    async def close(self):
+        await self.exchange.close()
 
-# ============================================================================
-# 輔助函數
-# ============================================================================
 
-def list_to_string(s: list) -> str:
-    """將列表轉換為字串"""
-    return "".join(str(ele) for ele in s)
+@lru_cache(maxsize=4)
+def _load_recording(path: str) -> tuple:
+    """讀取並快取錄製檔（定時重播時不重複解壓）"""
+    recording = ExchangeRecording(path)
+    return recording.load_markets(), recording.load_tickers(), recording.load_ohlcv()
 
-# ============================================================================
-# 峰值檢測模組
-# ============================================================================
 
-def peak_detect(df: pd.DataFrame, order: int = 10):
+class ReplayExchange:
     """
-    檢測價格峰值，用於谐波形態識別
-
-    參數：
-        df: 單一幣種的 OHLCV 數據
-        order: 峰值檢測的窗口大小
+    以錄製檔離線模擬交易所（同步介面）
 
-    返回：
-        元組：(時間索引, 價格模式, 起始, 結束, 移動段, 高點, 低點, 最終數據, 幣種)
+    - 每次請求依 latency_ms + 0 ~ jitter_ms 模擬網路延遲（固定亂數種子，可重現）
+    - symbol_count / multiplier 可將市場擴充為錄製數量的數倍：
+      複製的交易對命名為 "<幣種>.R<n>/USDT"，價格乘以微小係數以區分
     """
-    dt = df.Datetime
-    df = df.set_index('Datetime')
 
-    high = df.High
-    low = df.Low
+    def __init__(self, path: str, latency_ms: float = 0, jitter_ms: float = 0,
+                 symbol_count: int = None, multiplier: int = 1, seed: int = 0):
+        markets, self.tickers, self.ohlcv = _load_recording(path)
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.rng = np.random.default_rng(seed)
+
+        recorded = filter_usdt_symbols(markets)
+        multiplier = max(1, int(multiplier))
+        if symbol_count and recorded:
+            multiplier = max(multiplier, -(-symbol_count // len(recorded)))
+
+        # {交易對: (錄製的交易對, 價格係數)}
+        self.sources = {}
+        self.markets = {}
+        for copy in range(multiplier):
+            for symbol in recorded:
+                name = symbol if copy == 0 else symbol.replace("/USDT", f".R{copy}/USDT", 1)
+                self.sources[name] = (symbol, 1 + copy * 1e-3)
+                self.markets[name] = dict(markets[symbol], symbol=name)
+                if symbol_count and len(self.sources) >= symbol_count:
+                    break
+            if symbol_count and len(self.sources) >= symbol_count:
+                break
+
+    @classmethod
+    def from_config(cls, path: str = None) -> "ReplayExchange":
+        return cls(
+            path or CONFIG["exchange_recording_path"],
+            latency_ms=CONFIG["replay_latency_ms"],
+            jitter_ms=CONFIG["replay_jitter_ms"],
+            symbol_count=CONFIG["replay_symbol_count"],
+            multiplier=CONFIG["replay_symbol_multiplier"],
+        )
 
-    # 使用 scipy 檢測局部極值
-    max_idx = list(argrelextrema(high.values, np.greater, order=order)[0])
-    min_idx = list(argrelextrema(low.values, np.less, order=order)[0])
+    def _delay(self) -> float:
+        return (self.latency_ms + self.rng.random() * self.jitter_ms) / 1000
 
-    peak_1 = high.values[max_idx]
-    peak_2 = low.values[min_idx]
+    def _candles(self, symbol: str, timeframe: str, since, limit) -> list:
+        import ccxt
 
-    peaks_p = list(peak_1) + list(peak_2)
-    peaks_idx = list(max_idx) + list(min_idx)
+        if symbol not in self.sources:
+            raise ccxt.BadSymbol(f"replay: 未錄製的交易對 {symbol}")
+        source, scale = self.sources[symbol]
+        rows = self.ohlcv.get(timeframe, {}).get(source)
+        if rows is None:
+            raise ccxt.BadRequest(f"replay: 未錄製 {source} 的 {timeframe} K線")
 
-    peaks_idx_dt = np.array(dt.values[peaks_idx])
-    peaks_p = np.array(peaks_p)
+        if since is not None:
+            rows = rows[np.searchsorted(rows[:, 0], since):]
+            rows = rows[:limit] if limit else rows
+        elif limit:
+            rows = rows[-limit:]
 
-    final_df = pd.DataFrame({"price": peaks_p, "datetime": peaks_idx_dt})
-    final_df = final_df.sort_values(by=['datetime'])
+        rows = rows.copy()
+        rows[:, 1:5] *= scale
+        candles = rows.tolist()
+        for candle in candles:
+            candle[0] = int(candle[0])
+        return candles
 
-    peaks_idx_dt = final_df.datetime
-    peaks_p = final_df.price
+    def load_markets(self, reload: bool = False) -> dict:
+        return self.markets
 
-    # 組合最後 4 個峰值 + 當前價格
-    current_idx = np.array(list(final_df.datetime[-4:]) + list(dt[-1:]))
-    current_pat = np.array(list(final_df.price[-4:]) + list(low[-1:]))
+    def fetch_tickers(self, symbols: list = None, params: dict = None) -> dict:
+        import ccxt
 
-    start = min(current_idx)
-    end = max(current_idx)
+        if self.tickers is None:
+            raise ccxt.NotSupported("replay: 錄製檔沒有行情資料")
+        time.sleep(self._delay())
+        tickers = {}
+        for name, (source, _) in self.sources.items():
+            if source in self.tickers and (symbols is None or name in symbols):
+                tickers[name] = dict(self.tickers[source], symbol=name)
+        return tickers
 
-    # 計算四段移動
-    XA = current_pat[1] - current_pat[0]
-    AB = current_pat[2] - current_pat[1]
-    BC = current_pat[3] - current_pat[2]
-    CD = current_pat[4] - current_pat[3]
+    def fetch_ohlcv(self, symbol: str, timeframe: str = "1m", since=None, limit=None,
+                    params: dict = None) -> list:
+        time.sleep(self._delay())
+        return self._candles(symbol, timeframe, since, limit)
 
-    moves = [XA, AB, BC, CD]
-    symbol = df['Symbol'].unique().tolist()
 
-    return current_idx, current_pat, start, end, moves, high, low, final_df, symbol
+class AsyncReplayExchange(ReplayExchange):
+    """以錄製檔離線模擬交易所（非同步介面）"""
 
-# ============================================================================
-# 谐波形態識別模組
-# ============================================================================
+    async def load_markets(self, reload: bool = False) -> dict:
+        return self.markets
 
-def bull_bat(moves: list, symbol: list, current_pat: np.ndarray):
-    """
-    看漲蝙蝠形態識別
+    async def fetch_ohlcv(self, symbol: str, timeframe: str = "1m", since=None, limit=None,
+                          params: dict = None) -> list:
+        await asyncio.sleep(self._delay())
+        return self._candles(symbol, timeframe, since, limit)
 
-    斐波那契比例：
-    - AB: 0.382-0.5 × XA
-    - BC: 0.382-0.886 × AB
-    - CD: 1.618-2.618 × BC
-    """
-    try:
-        err_allowed = 0.1
-        XA, AB, BC, CD = moves
+    async def close(self):
+        pass
 
-        M_pat = (XA > 0 and AB < 0 and BC > 0 and CD < 0)
+# ============================================================================
+# 數據收集模組
+# ============================================================================
 
-        AB_range = np.array([0.382 - err_allowed, 0.5 + err_allowed]) * abs(XA)
-        BC_range = np.array([0.382 - err_allowed, 0.886 + err_allowed]) * abs(AB)
-        CD_range = np.array([1.618 - err_allowed, 2.618 + err_allowed]) * abs(BC)
+# 交易所登錄表
+# - ccxt / options: ccxt 類別名稱與客戶端選項（每個交易所各自的客戶端與內建速率限制器）
+# - settle: 要掃描的線性永續合約結算幣種
+# - max_limit: 單次 fetch_ohlcv 可取得的 K線數量上限
+# - weight_header / weight_limit: 回應中每分鐘已用權重的標頭與權重上限（供 RateController 使用）
+# - label: 日誌與通知中顯示的名稱
+EXCHANGES = {
+    "binance": {"ccxt": "binance", "options": {"defaultType": "future"},
+                "settle": "USDT", "max_limit": 1500, "label": "Binance",
+                "weight_header": "X-MBX-USED-WEIGHT-1M", "weight_limit": 2400},
+    "bybit": {"ccxt": "bybit", "options": {"defaultType": "swap"},
+              "settle": "USDT", "max_limit": 1000, "label": "Bybit"},
+    "okx": {"ccxt": "okx", "options": {"defaultType": "swap"},
+            "settle": "USDT", "max_limit": 300, "label": "OKX"},
+}
 
-        PRZ = round(current_pat[1] - 0.886 * abs(XA), 4)
-        SL = round(current_pat[0], 4)
-        TP1 = round(current_pat[3] - 0.618 * abs(CD), 4)
-        TP2 = round(current_pat[3] - 0.5 * abs(CD), 4)
-        TP3 = round(current_pat[3] - 0.382 * abs(CD), 4)
+# 預設交易所：本地檔案沿用原路徑，舊版信號紀錄也歸屬於此交易所
+DEFAULT_VENUE = "binance"
 
-        bat_pat = (
-            AB_range[0] < abs(AB) < AB_range[1] and
-            BC_range[0] < abs(BC) < BC_range[1] and
-            abs(CD) >= 0.7 * abs(XA) and
-            abs(CD) <= CD_range[1]
-        )
+# 跨掃描重複使用的同步交易所連接：{交易所: 客戶端}
+_exchanges = {}
 
-        if M_pat and bat_pat:
-            return list_to_string(symbol).replace("/USDT", ""), PRZ, SL, TP1, TP2, TP3
-        return []
 
-    except Exception:
-        return []
+def get_venues() -> list:
+    """返回 CONFIG 中要掃描的交易所（去除重複），未登錄的名稱引發 ValueError"""
+    venues = list(dict.fromkeys(CONFIG["exchanges"] or [DEFAULT_VENUE]))
+    unknown = [venue for venue in venues if venue not in EXCHANGES]
+    if unknown:
+        raise ValueError(f"未支援的交易所: {', '.join(unknown)}（支援 {', '.join(EXCHANGES)}）")
+    return venues
 
 
-def bear_bat(moves: list, symbol: list, current_pat: np.ndarray):
-    """看跌蝙蝠形態識別"""
-    try:
-        err_allowed = 0.1
-        XA, AB, BC, CD = moves
+def venue_label(venue: str) -> str:
+    return EXCHANGES[venue]["label"] if venue in EXCHANGES else venue
 
-        W_pat = (XA < 0 and AB > 0 and BC < 0 and CD > 0)
 
-        AB_range = np.array([0.382 - err_allowed, 0.5 + err_allowed]) * abs(XA)
-        BC_range = np.array([0.382 - err_allowed, 0.886 + err_allowed]) * abs(AB)
-        CD_range = np.array([1.618 - err_allowed, 2.618 + err_allowed]) * abs(BC)
+def venue_path(path: str, venue: str) -> str:
+    """
+    各交易所的本地檔案路徑
 
-        PRZ = round(current_pat[1] + 0.886 * abs(XA), 4)
-        SL = round(current_pat[0], 4)
-        TP1 = round(current_pat[3] + 0.618 * abs(CD), 4)
-        TP2 = round(current_pat[3] + 0.5 * abs(CD), 4)
-        TP3 = round(current_pat[3] + 0.382 * abs(CD), 4)
+    預設交易所維持原路徑；其他交易所在檔名第一個 "." 前加上交易所名稱，
+    例如 candles.db → candles.bybit.db、recordings → recordings.bybit。
+    """
+    if not path or venue == DEFAULT_VENUE:
+        return path
+    head, tail = os.path.split(path.rstrip("/\\"))
+    stem, dot, ext = tail.partition(".")
+    return os.path.join(head, f"{stem}.{venue}{dot}{ext}")
 
-        bat_pat = (
-            AB_range[0] < abs(AB) < AB_range[1] and
-            BC_range[0] < abs(BC) < BC_range[1] and
-            abs(CD) >= 0.7 * abs(XA) and
-            abs(CD) <= CD_range[1]
-        )
 
-        if W_pat and bat_pat:
-            return list_to_string(symbol).replace("/USDT", ""), PRZ, SL, TP1, TP2, TP3
-        return []
+def _ccxt_client(module, venue: str):
+    """
+    以登錄表的設定建立 ccxt（同步 / 非同步 / pro）客戶端
 
-    except Exception:
-        return []
+    啟用 adaptive_rate_limit 且交易所回報已用權重時，改由 RateController 節流，
+    不再使用 ccxt 的固定間隔速率限制器。
+    """
+    spec = EXCHANGES[venue]
+    adaptive = CONFIG["adaptive_rate_limit"] and spec.get("weight_header")
+    return getattr(module, spec["ccxt"])({
+        'enableRateLimit': not adaptive,
+        'options': dict(spec["options"]),
+    })
 
 
-def bull_gartley(moves: list, symbol: list, current_pat: np.ndarray):
+def get_exchange(venue: str = DEFAULT_VENUE):
+    """
+    取得交易所同步連接（首次使用時建立，定時掃描之間重複使用）
     """
-    看漲加特里形態識別
+    if venue not in _exchanges:
+        _exchanges[venue] = create_exchange(venue)
+    return _exchanges[venue]
 
-    斐波那契比例：
-    - AB: 0.618 × XA（精確）
-    - BC: 0.382-0.886 × AB
-    - CD: 1.272-1.618 × BC
+
+def create_exchange(venue: str = DEFAULT_VENUE):
     """
-    try:
-        err_allowed = 0.1
-        XA, AB, BC, CD = moves
+    建立交易所同步連接（依 exchange_backend 可改為錄製或離線重播）
+    """
+    recording_path = venue_path(CONFIG["exchange_recording_path"], venue)
+    if CONFIG["exchange_backend"] == "replay":
+        return ReplayExchange.from_config(recording_path)
 
-        M_pat = (XA > 0 and AB < 0 and BC > 0 and CD < 0)
+    import ccxt
 
-        AB_range = np.array([0.618 - err_allowed, 0.618 + err_allowed]) * abs(XA)
-        BC_range = np.array([0.382 - err_allowed, 0.886 + err_allowed]) * abs(AB)
-        CD_range = np.array([1.272 - err_allowed, 1.618 + err_allowed]) * abs(BC)
+    exchange = _ccxt_client(ccxt, venue)
+    if CONFIG["exchange_backend"] == "record":
+        return RecordingExchange(exchange, ExchangeRecording(recording_path))
+    return exchange
 
-        PRZ = round(current_pat[1] - 0.786 * abs(XA), 4)
-        SL = round(current_pat[0], 4)
-        TP1 = round(current_pat[3] - 0.618 * abs(CD), 4)
-        TP2 = round(current_pat[3] - 0.5 * abs(CD), 4)
-        TP3 = round(current_pat[3] - 0.382 * abs(CD), 4)
 
-        gartley_pat = (
-            AB_range[0] < abs(AB) < AB_range[1] and
-            BC_range[0] < abs(BC) < BC_range[1] and
-            abs(CD) >= 0.6 * abs(XA) and
-            abs(CD) <= CD_range[1]
-        )
+class CandleStore:
+    """
+    本地 K線快取（SQLite）
 
-        if M_pat and gartley_pat:
-            return list_to_string(symbol).replace("/USDT", ""), PRZ, SL, TP1, TP2, TP3
-        return []
+    以 (幣種, 時間框架, 開盤時間) 為主鍵保存已收盤的 K線，
+    讓定時掃描只需抓取上次之後新收盤的 K線。
+    歷史下載（download_history）另以 history_pages 記錄已完成的分頁，中斷後可續傳。
+    """
 
-    except Exception:
-        return []
+    def __init__(self, path: str):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS candles ("
+            " symbol TEXT NOT NULL, timeframe TEXT NOT NULL, ts INTEGER NOT NULL,"
+            " open REAL, high REAL, low REAL, close REAL, volume REAL,"
+            " PRIMARY KEY (symbol, timeframe, ts)) WITHOUT ROWID"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS history_pages ("
+            " symbol TEXT NOT NULL, timeframe TEXT NOT NULL, since INTEGER NOT NULL,"
+            " until INTEGER NOT NULL, PRIMARY KEY (symbol, timeframe, since)) WITHOUT ROWID"
+        )
+        self.conn.commit()
+
+    def last_timestamps(self, timeframe: str, min_bars: int = 0) -> dict:
+        """
+        返回 {幣種: 最後一根已保存 K線的開盤時間（毫秒）}
+
+        已保存的 K線少於 min_bars 根的幣種不列入（例如調高 limit 後），由呼叫端重新完整下載。
+        """
+        rows = self.conn.execute(
+            "SELECT symbol, MAX(ts) FROM candles WHERE timeframe = ? GROUP BY symbol"
+            " HAVING COUNT(*) >= ?",
+            (timeframe, min_bars)
+        )
+        return dict(rows.fetchall())
+
+    def merge(self, timeframe: str, candles: list, keep: int) -> list:
+        """
+        寫入新抓取的 K線並裁剪到最近 keep 根
+
+        參數：
+            timeframe: 時間框架
+            candles: [(幣種, OHLCV 列表), ...]，只含已收盤 K線
+            keep: 每個幣種保留的 K線數量
+
+        返回：
+            [(幣種, 最近 keep 根 OHLCV 列表), ...]，順序與輸入一致
+        """
+        merged = []
+        with self.conn:
+            for symbol, ohlcv in candles:
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO candles VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    [(symbol, timeframe, int(row[0]), *row[1:6]) for row in ohlcv]
+                )
+                self.conn.execute(
+                    "DELETE FROM candles WHERE symbol = ? AND timeframe = ? AND ts < ("
+                    " SELECT ts FROM candles WHERE symbol = ? AND timeframe = ?"
+                    " ORDER BY ts DESC LIMIT 1 OFFSET ?)",
+                    (symbol, timeframe, symbol, timeframe, keep - 1)
+                )
+                rows = self.conn.execute(
+                    "SELECT ts, open, high, low, close, volume FROM candles"
+                    " WHERE symbol = ? AND timeframe = ? ORDER BY ts",
+                    (symbol, timeframe)
+                ).fetchall()
+                merged.append((symbol, [list(row) for row in rows]))
+        return merged
+
+    def completed_pages(self, timeframe: str) -> dict:
+        """返回已下載完成的分頁 {(幣種, 分頁起點): 分頁終點}（毫秒）"""
+        rows = self.conn.execute(
+            "SELECT symbol, since, until FROM history_pages WHERE timeframe = ?", (timeframe,)
+        )
+        return {(symbol, since): until for symbol, since, until in rows}
+
+    def save_page(self, symbol: str, timeframe: str, since: int, until: int, candles: list):
+        """寫入一頁歷史 K線（不裁剪），並在同一交易中記錄檢查點"""
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO candles VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [(symbol, timeframe, int(row[0]), *row[1:6]) for row in candles]
+            )
+            self.conn.execute(
+                "INSERT OR REPLACE INTO history_pages VALUES (?, ?, ?, ?)",
+                (symbol, timeframe, since, until)
+            )
 
+    def forget_pages(self, symbol: str, timeframe: str, since: int, until: int):
+        """移除與 [since, until) 重疊的分頁檢查點，使其重新下載"""
+        with self.conn:
+            self.conn.execute(
+                "DELETE FROM history_pages WHERE symbol = ? AND timeframe = ?"
+                " AND since < ? AND until > ?",
+                (symbol, timeframe, until, since)
+            )
 
-def bear_gartley(moves: list, symbol: list, current_pat: np.ndarray):
-    """看跌加特里形態識別"""
-    try:
-        err_allowed = 0.1
-        XA, AB, BC, CD = moves
+    def timestamps(self, symbol: str, timeframe: str, since: int, until: int) -> np.ndarray:
+        """返回 [since, until) 內已保存 K線的開盤時間（遞增）"""
+        rows = self.conn.execute(
+            "SELECT ts FROM candles WHERE symbol = ? AND timeframe = ? AND ts >= ? AND ts < ?"
+            " ORDER BY ts",
+            (symbol, timeframe, since, until)
+        ).fetchall()
+        return np.array([row[0] for row in rows], dtype=np.int64)
+
+    def load_panel(self, timeframe: str, path: str = None,
+                   block_rows: int = 65536) -> "CandlePanel":
+        """
+        將某個時間框架的所有已保存 K線讀為 CandlePanel
+
+        先統計各幣種的 K線數量配置面板，再逐一幣種、每次 block_rows 列讀入，
+        記憶體中最多只有一個區塊的資料列；指定 path 時面板為記憶體映射檔案，
+        多年的長期歷史也不需整份載入記憶體。
+        """
+        counts = self.conn.execute(
+            "SELECT symbol, COUNT(*) FROM candles WHERE timeframe = ? GROUP BY symbol ORDER BY symbol",
+            (timeframe,)
+        ).fetchall()
+        symbols = [symbol for symbol, _ in counts]
+        lengths = np.array([n for _, n in counts], dtype=np.int64)
+        arrays = CandlePanel._allocate(path, (len(symbols), int(lengths.max()) if len(lengths) else 0))
+
+        for i, symbol in enumerate(symbols):
+            cursor = self.conn.execute(
+                "SELECT ts, open, high, low, close, volume FROM candles"
+                " WHERE symbol = ? AND timeframe = ? ORDER BY ts",
+                (symbol, timeframe)
+            )
+            n = 0
+            while True:
+                rows = cursor.fetchmany(block_rows)
+                if not rows:
+                    break
+                values = np.array(rows, dtype=np.float64)
+                stop = n + len(values)
+                arrays["timestamps"][i, n:stop] = values[:, 0].astype(np.int64)
+                for col, field in enumerate(CandlePanel.FIELDS[1:], start=1):
+                    arrays[field][i, n:stop] = values[:, col]
+                n = stop
 
-        W_pat = (XA < 0 and AB > 0 and BC < 0 and CD > 0)
+        panel = CandlePanel(symbols, lengths=lengths, **arrays)
+        if path:
+            panel._write_meta(path)
+        return panel
 
-        AB_range = np.array([0.618 - err_allowed, 0.618 + err_allowed]) * abs(XA)
-        BC_range = np.array([0.382 - err_allowed, 0.886 + err_allowed]) * abs(AB)
-        CD_range = np.array([1.272 - err_allowed, 1.618 + err_allowed]) * abs(BC)
+    def close(self):
+        self.conn.close()
 
-        PRZ = round(current_pat[1] + 0.786 * abs(XA), 4)
-        SL = round(current_pat[0], 4)
-        TP1 = round(current_pat[3] + 0.618 * abs(CD), 4)
-        TP2 = round(current_pat[3] + 0.5 * abs(CD), 4)
-        TP3 = round(current_pat[3] + 0.382 * abs(CD), 4)
 
-        gartley_pat = (
-            AB_range[0] < abs(AB) < AB_range[1] and
-            BC_range[0] < abs(BC) < BC_range[1] and
-            abs(CD) >= 0.6 * abs(XA) and
-            abs(CD) <= CD_range[1]
-        )
+def timeframe_to_ms(timeframe: str) -> int:
+    """將時間框架字串（1h, 4h, 1d 等）轉為毫秒"""
+    import ccxt
 
-        if W_pat and gartley_pat:
-            return list_to_string(symbol).replace("/USDT", ""), PRZ, SL, TP1, TP2, TP3
-        return []
+    return ccxt.Exchange.parse_timeframe(timeframe) * 1000
 
-    except Exception:
-        return []
 
+def timeframe_offset_ms(timeframe: str) -> int:
+    """K線邊界相對 Unix 紀元的偏移：1970-01-01 為週四，週線以週一 00:00 UTC 為起點"""
+    return 4 * 86400000 if timeframe.endswith("w") else 0
 
-def bull_crab(moves: list, symbol: list, current_pat: np.ndarray):
+
+def last_close_ms(timeframe: str, now_ms: int = None) -> int:
     """
-    看漲螃蟹形態識別
+    now_ms（預設現在）之前最近一次 K線收盤的時間，即目前未完成 K線的開盤時間（毫秒）
 
-    斐波那契比例：
-    - AB: 0.382-0.618 × XA
-    - BC: 0.382-0.886 × AB
-    - CD: 2.618-3.618 × BC（最激進的形態）
+    依交易所的 UTC 邊界計算，週線從週一開始。
     """
-    try:
-        err_allowed = 0.1
-        XA, AB, BC, CD = moves
+    tf_ms = timeframe_to_ms(timeframe)
+    offset = timeframe_offset_ms(timeframe)
+    now_ms = int(time.time() * 1000) if now_ms is None else int(now_ms)
+    return (now_ms - offset) // tf_ms * tf_ms + offset
 
-        M_pat = (XA > 0 and AB < 0 and BC > 0 and CD < 0)
 
-        AB_range = np.array([0.382 - err_allowed, 0.618 + err_allowed]) * abs(XA)
-        BC_range = np.array([0.382 - err_allowed, 0.886 + err_allowed]) * abs(AB)
-        CD_range = np.array([2.618 - err_allowed, 3.618 + err_allowed]) * abs(BC)
+def _incremental_request(last_ts, timeframe: str, limit: int) -> tuple:
+    """
+    根據本地最後一根 K線決定抓取參數
 
-        PRZ = round(current_pat[1] - 1.618 * abs(XA), 4)
-        SL = PRZ * 0.98
-        TP1 = round(current_pat[3] - 0.618 * abs(CD), 4)
-        TP2 = round(current_pat[3] - 0.5 * abs(CD), 4)
-        TP3 = round(current_pat[3] - 0.382 * abs(CD), 4)
+    參數：
+        last_ts: 本地最後一根 K線的開盤時間；快取不足 limit - 1 根時呼叫端傳入 None
 
-        crab_pat = (
-            AB_range[0] < abs(AB) < AB_range[1] and
-            BC_range[0] < abs(BC) < BC_range[1] and
-            abs(CD) >= 1.3 * abs(XA) and
-            abs(CD) <= CD_range[1]
-        )
+    返回：
+        元組：(since, limit)；無快取、快取不足或斷檔超過 limit 時為 (None, limit)，
+        即從 now - limit × 時間框架 起完整下載（超過單次上限時由 _fetch_windows 分頁）
+    """
+    if last_ts is None:
+        return None, limit
 
-        if M_pat and crab_pat:
-            return list_to_string(symbol).replace("/USDT", ""), PRZ, SL, TP1, TP2, TP3
-        return []
+    tf_ms = timeframe_to_ms(timeframe)
+    missing = (int(time.time() * 1000) - int(last_ts)) // tf_ms
+    if missing >= limit - 1:
+        return None, limit
 
-    except Exception:
-        return []
+    # 多抓一根作為未完成 K線，稍後移除
+    return int(last_ts) + tf_ms, int(missing) + 1
 
 
-def bear_crab(moves: list, symbol: list, current_pat: np.ndarray):
-    """看跌螃蟹形態識別"""
-    try:
-        err_allowed = 0.1
-        XA, AB, BC, CD = moves
+def get_async_exchange(venue: str = DEFAULT_VENUE):
+    """
+    建立交易所非同步連接（ccxt.async_support，依 exchange_backend 可改為錄製或離線重播）
+    """
+    recording_path = venue_path(CONFIG["exchange_recording_path"], venue)
+    if CONFIG["exchange_backend"] == "replay":
+        return AsyncReplayExchange.from_config(recording_path)
 
-        W_pat = (XA < 0 and AB > 0 and BC < 0 and CD > 0)
+    import ccxt.async_support as ccxt_async
 
-        AB_range = np.array([0.382 - err_allowed, 0.618 + err_allowed]) * abs(XA)
-        BC_range = np.array([0.382 - err_allowed, 0.886 + err_allowed]) * abs(AB)
-        CD_range = np.array([2.618 - err_allowed, 3.618 + err_allowed]) * abs(BC)
+    exchange = _ccxt_client(ccxt_async, venue)
+    if CONFIG["exchange_backend"] == "record":
+        return AsyncRecordingExchange(exchange, ExchangeRecording(recording_path))
+    return exchange
 
-        PRZ = round(current_pat[1] + 1.618 * abs(XA), 4)
-        SL = PRZ * 1.02
-        TP1 = round(current_pat[3] + 0.618 * abs(CD), 4)
-        TP2 = round(current_pat[3] + 0.5 * abs(CD), 4)
-        TP3 = round(current_pat[3] + 0.382 * abs(CD), 4)
 
-        crab_pat = (
-            AB_range[0] < abs(AB) < AB_range[1] and
-            BC_range[0] < abs(BC) < BC_range[1] and
-            abs(CD) >= 1.3 * abs(XA) and
-            abs(CD) <= CD_range[1]
-        )
+def filter_usdt_symbols(markets: dict, settle: str = "USDT") -> list:
+    """
+    從市場資料中篩選線性永續合約交易對（以 settle 計價並結算、未下市）
 
-        if W_pat and crab_pat:
-            return list_to_string(symbol).replace("/USDT", ""), PRZ, SL, TP1, TP2, TP3
-        return []
+    市場資料沒有合約類型欄位時（例如精簡的錄製檔），改以交易對名稱判斷。
+    """
+    symbols = []
+    for symbol, market in markets.items():
+        if "swap" in market:
+            if (market["swap"] and market.get("linear") and market.get("settle") == settle
+                    and market.get("quote") == settle and market.get("active") is not False):
+                symbols.append(symbol)
+        elif f"/{settle}" in symbol and "_" not in symbol:
+            symbols.append(symbol)
+    return symbols
 
-    except Exception:
-        return []
 
+def display_symbol(symbol: str) -> str:
+    """通知與信號中顯示的幣種名稱（BTC/USDT:USDT → BTC）"""
+    return symbol.split("/")[0]
 
-def bull_butterfly(moves: list, symbol: list, current_pat: np.ndarray):
-    """
-    看漲蝴蝶形態識別
 
-    斐波那契比例：
-    - AB: 0.786 × XA
-    - BC: 0.382-0.886 × AB
-    - CD: 1.618-2.618 × BC
+class MarketCache:
     """
-    try:
-        err_allowed = 0.1
-        XA, AB, BC, CD = moves
-
-        M_pat = (XA > 0 and AB < 0 and BC > 0 and CD < 0)
+    交易所市場資料快取
 
-        AB_range = np.array([0.786 - err_allowed, 0.786 + err_allowed]) * abs(XA)
-        BC_range = np.array([0.382 - err_allowed, 0.886 + err_allowed]) * abs(AB)
-        CD_range = np.array([1.618 - err_allowed, 2.618 + err_allowed]) * abs(BC)
-
-        PRZ = round(current_pat[1] - 1.27 * abs(XA), 4)
-        SL = PRZ * 0.98
-        TP1 = round(current_pat[3] - 0.618 * abs(CD), 4)
-        TP2 = round(current_pat[3] - 0.5 * abs(CD), 4)
-        TP3 = round(current_pat[3] - 0.382 * abs(CD), 4)
+    - 記憶體與磁碟（gzip JSON）兩層，超過 TTL 才重新呼叫 load_markets
+    - 快取命中時以 set_markets 注入交易所客戶端，ccxt 不會再下載 exchangeInfo
+    - 定時模式下由背景執行緒定期更新，新上市 / 下市不必等到 TTL 過期
+    """
 
-        butterfly_pat = (
-            AB_range[0] < abs(AB) < AB_range[1] and
-            BC_range[0] < abs(BC) < BC_range[1] and
-            abs(CD) >= 1.2 * abs(XA) and
-            abs(CD) <= CD_range[1]
+    def __init__(self, path: str, ttl_hours: float = 12, venue: str = DEFAULT_VENUE):
+        self.path = path
+        self.venue = venue
+        self.ttl = ttl_hours * 3600
+        self.markets = None
+        self.fetched_at = 0.0
+        self._lock = threading.Lock()
+        self._refresher = None
+        self._load()
+
+    @property
+    def fresh(self) -> bool:
+        return self.markets is not None and time.time() - self.fetched_at < self.ttl
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with gzip.open(self.path, "rt", encoding="utf-8") as f:
+                data = json.load(f)
+            self.markets, self.fetched_at = data["markets"], data["fetched_at"]
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"市場資料快取讀取失敗，將重新載入：{str(e)}")
+
+    def _save(self):
+        tmp = self.path + ".tmp"
+        with gzip.open(tmp, "wt", encoding="utf-8") as f:
+            json.dump({"fetched_at": self.fetched_at, "markets": self.markets}, f, default=str)
+        os.replace(tmp, self.path)
+
+    def update(self, markets: dict):
+        """以新下載的市場資料更新快取，並記錄新上市 / 下市的交易對"""
+        with self._lock:
+            if self.markets is not None:
+                old = set(filter_usdt_symbols(self.markets))
+                new = set(filter_usdt_symbols(markets))
+                added, removed = sorted(new - old), sorted(old - new)
+                if added or removed:
+                    logger.info(
+                        f"[{venue_label(self.venue)}] 市場資料更新 | 新上市: {', '.join(added) or '無'} | "
+                        f"下市: {', '.join(removed) or '無'}"
+                    )
+            self.markets = markets
+            self.fetched_at = time.time()
+            try:
+                self._save()
+            except OSError as e:
+                logger.error(f"市場資料快取寫入失敗：{str(e)}")
+
+    def apply(self, exchange) -> dict:
+        """將快取的市場資料注入交易所客戶端（已是最新版本時不重複處理）"""
+        if getattr(exchange, "markets_cached_at", None) != self.fetched_at:
+            exchange.set_markets(list(self.markets.values()))
+            exchange.markets_cached_at = self.fetched_at
+        return self.markets
+
+    def start_refresh(self, interval_minutes: float):
+        """啟動背景執行緒，每 interval_minutes 分鐘重新載入一次市場資料"""
+        if self._refresher is not None or not interval_minutes:
+            return
+
+        def refresh():
+            exchange = None
+            while True:
+                time.sleep(interval_minutes * 60)
+                try:
+                    exchange = exchange or create_exchange(self.venue)
+                    self.update(exchange.load_markets(reload=True))
+                except Exception as e:
+                    _metrics.error("load_markets")
+                    logger.warning(f"[{venue_label(self.venue)}] 背景更新市場資料失敗：{str(e)}")
+
+        self._refresher = threading.Thread(
+            target=refresh, name=f"market-refresh-{self.venue}", daemon=True
+        )
+        self._refresher.start()
+        logger.info(
+            f"[{venue_label(self.venue)}] 市場資料背景更新已啟動 | 間隔: 每 {interval_minutes} 分鐘"
         )
 
-        if M_pat and butterfly_pat:
-            return list_to_string(symbol).replace("/USDT", ""), PRZ, SL, TP1, TP2, TP3
-        return []
 
-    except Exception:
-        return []
+# 各交易所的市場資料快取：{交易所: MarketCache}
+_market_caches = {}
 
 
-def bear_butterfly(moves: list, symbol: list, current_pat: np.ndarray):
-    """看跌蝴蝶形態識別"""
-    try:
-        err_allowed = 0.1
-        XA, AB, BC, CD = moves
+def get_market_cache(venue: str = DEFAULT_VENUE):
+    """
+    取得交易所共用的市場資料快取
 
-        W_pat = (XA < 0 and AB > 0 and BC < 0 and CD > 0)
+    返回：
+        MarketCache，未設定 markets_cache_path 或使用重播後端時返回 None
+    """
+    if not CONFIG["markets_cache_path"] or CONFIG["exchange_backend"] == "replay":
+        return None
+    if venue not in _market_caches:
+        _market_caches[venue] = MarketCache(
+            venue_path(CONFIG["markets_cache_path"], venue),
+            CONFIG["markets_cache_ttl_hours"],
+            venue
+        )
+    return _market_caches[venue]
 
-        AB_range = np.array([0.786 - err_allowed, 0.786 + err_allowed]) * abs(XA)
-        BC_range = np.array([0.382 - err_allowed, 0.886 + err_allowed]) * abs(AB)
-        CD_range = np.array([1.618 - err_allowed, 2.618 + err_allowed]) * abs(BC)
 
-        PRZ = round(current_pat[1] + 1.27 * abs(XA), 4)
-        SL = PRZ * 0.98
-        TP1 = round(current_pat[3] + 0.618 * abs(CD), 4)
-        TP2 = round(current_pat[3] + 0.5 * abs(CD), 4)
-        TP3 = round(current_pat[3] + 0.382 * abs(CD), 4)
+def load_markets_cached(exchange, venue: str = DEFAULT_VENUE) -> dict:
+    """以快取取得市場資料，過期時才呼叫 exchange.load_markets（同步客戶端）"""
+    cache = get_market_cache(venue)
+    if cache is None:
+        return exchange.load_markets()
+    if not cache.fresh:
+        cache.update(exchange.load_markets(reload=True))
+        exchange.markets_cached_at = cache.fetched_at
+    return cache.apply(exchange)
 
-        butterfly_pat = (
-            AB_range[0] < abs(AB) < AB_range[1] and
-            BC_range[0] < abs(BC) < BC_range[1] and
-            abs(CD) >= 1.2 * abs(XA) and
-            abs(CD) <= CD_range[1]
-        )
 
-        if W_pat and butterfly_pat:
-            return list_to_string(symbol).replace("/USDT", ""), PRZ, SL, TP1, TP2, TP3
-        return []
+async def load_markets_cached_async(exchange, venue: str = DEFAULT_VENUE) -> dict:
+    """以快取取得市場資料，過期時才呼叫 exchange.load_markets（非同步客戶端）"""
+    cache = get_market_cache(venue)
+    if cache is None:
+        return await exchange.load_markets()
+    if not cache.fresh:
+        cache.update(await exchange.load_markets(reload=True))
+        exchange.markets_cached_at = cache.fetched_at
+    return cache.apply(exchange)
 
-    except Exception:
-        return []
 
-# ============================================================================
-# 谐波形態掃描主函數
-# ============================================================================
+def _log_fetch_progress(done: int, total: int, venue: str = DEFAULT_VENUE):
+    """依 10% 間隔顯示數據收集進度"""
+    progress_interval = max(1, total // 10)
+    if done % progress_interval == 0 or done == total:
+        progress = done / total * 100
+        logger.info(f"[{venue_label(venue)}] 數據收集進度: {done}/{total} ({progress:.0f}%)")
+
 
-def scan_harmonic_patterns(data: pd.DataFrame, order: int = 10,
-                           send_notifications: bool = True) -> dict:
+def rank_by_liquidity(symbols: list, tickers: dict, min_quote_volume: float = 0) -> list:
     """
-    掃描所有谐波形態
+    依 24 小時成交額（quoteVolume）由高到低排序，並移除低於門檻的交易對
 
     參數：
-        data: OHLCV 數據
-        order: 峰值檢測靈敏度
-        send_notifications: 是否發送 Discord 通知
+        symbols: 交易對列表
+        tickers: fetch_tickers 的回應
+        min_quote_volume: 成交額門檻（USDT），沒有行情資料者視為 0
 
     返回：
-        包含所有檢測到形態的字典
+        排序後的交易對列表（成交額相同者維持原順序）
     """
-    logger.info("開始谐波形態掃描...")
+    volumes = {
+        symbol: float((tickers.get(symbol) or {}).get("quoteVolume") or 0)
+        for symbol in symbols
+    }
+    ranked = sorted(symbols, key=lambda symbol: -volumes[symbol])
+    return [symbol for symbol in ranked if volumes[symbol] >= min_quote_volume]
 
-    coins = data['Symbol'].unique().tolist()
-    timeframe = CONFIG["harmonic_timeframe"]
 
-    # 形態檢測函數映射
-    pattern_functions = {
-        "看漲蝙蝠": bull_bat,
-        "看跌蝙蝠": bear_bat,
-        "看漲加特里": bull_gartley,
-        "看跌加特里": bear_gartley,
-        "看漲螃蟹": bull_crab,
-        "看跌螃蟹": bear_crab,
-        "看漲蝴蝶": bull_butterfly,
-        "看跌蝴蝶": bear_butterfly,
+def select_symbols(venue: str = DEFAULT_VENUE) -> list:
+    """
+    取得交易所要掃描的 USDT 永續合約
+
+    設定 shard 時只保留屬於本分片的交易對。以一次 fetch_tickers 取得所有交易對的成交額，
+    移除低於 min_quote_volume 者，並依流動性排序，使主流幣最先被抓取、掃描與通知。
+    行情請求失敗時不篩選。
+
+    返回：
+        交易對列表
+    """
+    exchange = get_exchange(venue)
+    label = venue_label(venue)
+
+    # 獲取所有 USDT 永續合約
+    with _metrics.stage("load_markets"):
+        coins = filter_usdt_symbols(
+            load_markets_cached(exchange, venue), EXCHANGES[venue]["settle"]
+        )
+    logger.info(f"[{label}] 找到 {len(coins)} 個 USDT 交易對")
+
+    if CONFIG["shard"]:
+        total = len(coins)
+        coins = shard_symbols(coins, CONFIG["shard"])
+        logger.info(f"[{label}] 分片 {CONFIG['shard'][0]}/{CONFIG['shard'][1]} | 交易對: {len(coins)}/{total}")
+
+    min_quote_volume = CONFIG["min_quote_volume"]
+    if not CONFIG["liquidity_ordering"] and not min_quote_volume:
+        return coins
+
+    try:
+        with _metrics.stage("fetch_tickers"):
+            tickers = exchange.fetch_tickers()
+    except Exception as e:
+        _metrics.error("fetch_tickers")
+        logger.warning(f"[{label}] 無法取得行情資料，略過流動性篩選：{str(e)}")
+        return coins
+
+    ranked = rank_by_liquidity(coins, tickers, min_quote_volume)
+    if len(ranked) < len(coins):
+        _metrics.skip("low_liquidity", len(coins) - len(ranked))
+    logger.info(
+        f"[{label}] 流動性篩選 | 保留: {len(ranked)}/{len(coins)} 個交易對 | "
+        f"成交額門檻: {min_quote_volume:,.0f} USDT"
+    )
+    return ranked
+
+
+class RateController:
+    """
+    AIMD 自適應速率控制器（每個交易所一個，跨掃描保留收斂後的並行視窗）
+
+    - 每個成功回應將並行視窗加性增加 1/視窗（約每輪 +1），上限為 max_concurrency
+    - 回應帶有每分鐘已用權重（例如幣安 X-MBX-USED-WEIGHT-1M）時，用量達
+      weight_limit × target 即將視窗減半，並暫停新請求至下一個整分鐘權重重設
+    - 收到 429 / 418 時將視窗減半，並依 Retry-After（沒有則以退避秒數）暫停所有請求
+    - 視窗每輪（約一個視窗的回應數）最多減半一次，同一批進行中請求的回應不會連續減半
+    - adaptive=False 時視窗固定為 max_concurrency，只遵守 429 / 418 的暫停
+
+    同一交易所的抓取只在單一執行緒（或事件迴圈）中進行，因此不需要執行緒鎖；
+    等待並行名額的協程以 asyncio.Condition 掛起，由 release() 喚醒；取得名額後視窗仍有空位時接力喚醒下一個。
+    """
+
+    WEIGHT_PERIOD = 60
+
+    def __init__(self, max_concurrency: int, weight_header: str = None,
+                 weight_limit: int = None, target: float = 0.8, adaptive: bool = True):
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.weight_header = weight_header.lower() if weight_header else None
+        self.weight_limit = weight_limit
+        self.target = target
+        self.adaptive = adaptive
+        self.window = float(self.max_concurrency)
+        self.in_flight = 0
+        self.used_weight = None
+        self.paused_until = 0.0
+        self._since_decrease = self.max_concurrency
+        self._cond = None
+        self._cond_loop = None
+
+    @staticmethod
+    def header(headers, name: str):
+        """不分大小寫讀取回應標頭，沒有則返回 None"""
+        if not headers or not name:
+            return None
+        name = name.lower()
+        for key, value in headers.items():
+            if key.lower() == name:
+                return value
+        return None
+
+    def _pause(self, until: float):
+        extended = until - max(self.paused_until, time.time())
+        if extended > 0:
+            _metrics.count("rate_limit_pause_seconds", extended)
+            self.paused_until = until
+
+    def _decrease(self):
+        if not self.adaptive or self._since_decrease < self.window:
+            return
+        self.window = max(1.0, self.window / 2)
+        self._since_decrease = 0
+        _metrics.count("rate_limit_decreases")
+
+    def pause_remaining(self) -> float:
+        """距離暫停結束的秒數（0 = 未暫停）"""
+        return max(0.0, self.paused_until - time.time())
+
+    def wait_sync(self):
+        """同步抓取：等待暫停結束"""
+        delay = self.pause_remaining()
+        if delay > 0:
+            time.sleep(delay)
+
+    def _condition(self) -> asyncio.Condition:
+        # 控制器跨掃描保留，而每次 asyncio.run 是新的事件迴圈，Condition 需隨迴圈重建
+        loop = asyncio.get_running_loop()
+        if self._cond_loop is not loop:
+            self._cond, self._cond_loop = asyncio.Condition(), loop
+        return self._cond
+
+    async def acquire(self):
+        """非同步抓取：等待暫停結束且並行數低於視窗後佔用一個名額"""
+        cond = self._condition()
+        async with cond:
+            while True:
+                delay = self.pause_remaining()
+                if delay > 0:
+                    # 暫停期間只等到暫停結束（期間被喚醒則重新檢查）
+                    try:
+                        await asyncio.wait_for(cond.wait(), delay)
+                    except asyncio.TimeoutError:
+                        pass
+                elif self.in_flight < int(self.window):
+                    self.in_flight += 1
+                    # 視窗仍有空位（例如視窗剛增加或暫停剛結束）時接力喚醒下一個
+                    if self.in_flight < int(self.window):
+                        cond.notify(1)
+                    return
+                else:
+                    await cond.wait()
+
+    async def release(self):
+        """歸還名額並喚醒一個等待中的協程（應在 observe / throttled 之後呼叫）"""
+        cond = self._condition()
+        async with cond:
+            self.in_flight -= 1
+            cond.notify(1)
+
+    def observe(self, headers):
+        """
+        依成功回應的標頭調整並行視窗
+
+        ccxt 只提供客戶端共用的 last_response_headers，並行請求時讀到的可能是另一個
+        剛完成的請求的標頭。已用權重是交易所端每分鐘的累計值，任一最近回應的數值都
+        接近實際用量，因此以此近似，不影響減半與暫停的判斷。
+        """
+        self._since_decrease += 1
+        used = self.header(headers, self.weight_header)
+        if used is not None:
+            self.used_weight = int(float(used))
+            if self.weight_limit and self.used_weight >= self.weight_limit * self.target:
+                self._decrease()
+                # 權重以整分鐘為週期重設，多等 1 秒容忍時鐘誤差
+                now = time.time()
+                self._pause((now // self.WEIGHT_PERIOD + 1) * self.WEIGHT_PERIOD + 1)
+                return
+        if self.adaptive:
+            self.window = min(float(self.max_concurrency), self.window + 1 / self.window)
+
+    def throttled(self, headers, fallback: float):
+        """收到 429 / 418：視窗減半並暫停所有請求至 Retry-After（沒有則等待 fallback 秒）"""
+        self._since_decrease += 1
+        self._decrease()
+        retry_after = self.header(headers, "Retry-After")
+        try:
+            delay = float(retry_after) if retry_after is not None else fallback
+        except ValueError:
+            delay = fallback
+        self._pause(time.time() + delay)
+
+    def summary(self) -> str:
+        text = f"並行視窗: {self.window:.0f}/{self.max_concurrency}"
+        if self.used_weight is not None:
+            text += f" | 已用權重: {self.used_weight}/{self.weight_limit}"
+        return text
+
+
+# 跨掃描保留的速率控制器：{交易所: RateController}
+_rate_controllers = {}
+
+
+def get_rate_controller(venue: str = DEFAULT_VENUE) -> RateController:
+    """取得交易所的速率控制器（首次使用時依 CONFIG 與登錄表建立）"""
+    if venue not in _rate_controllers:
+        spec = EXCHANGES[venue]
+        _rate_controllers[venue] = RateController(
+            CONFIG["fetch_concurrency"],
+            weight_header=spec.get("weight_header"),
+            weight_limit=spec.get("weight_limit"),
+            target=CONFIG["rate_limit_target"],
+            adaptive=CONFIG["adaptive_rate_limit"],
+        )
+    return _rate_controllers[venue]
+
+
+def _retry_delay(attempt: int) -> float:
+    """第 attempt 次（從 0 起）重試前的退避秒數：指數增長並加上 ±50% 抖動"""
+    delay = min(60.0, CONFIG["fetch_retry_backoff"] * 2 ** attempt)
+    return delay * np.random.uniform(0.5, 1.5)
+
+
+def _fetch_failed(controller: RateController, error: Exception, headers,
+                  attempt: int, final: bool = False) -> float:
+    """
+    記錄一次 K線抓取失敗
+
+    速率限制（429 / 418）由控制器暫停該交易所的所有請求；
+    其他網路錯誤（逾時、連線中斷）只延後此交易對。
+    最後一次嘗試（final）失敗時同樣通知控制器，使其他進行中的請求也暫停，但不計入重試。
+
+    返回：
+        此交易對重試前需額外等待的秒數
+    """
+    import ccxt
+
+    if not final:
+        _metrics.count("fetch_retries")
+    delay = _retry_delay(attempt)
+    if isinstance(error, (ccxt.RateLimitExceeded, ccxt.DDoSProtection)):
+        _metrics.count("rate_limited")
+        controller.throttled(headers, delay)
+        return 0.0
+    return delay
+
+
+def _log_fetch_failures(venue: str, failed: list, controller: RateController):
+    """抓取結束後記錄速率控制狀態與重試後仍失敗的交易對"""
+    label = venue_label(venue)
+    logger.info(f"[{label}] 速率控制 | {controller.summary()}")
+    if failed:
+        shown = ", ".join(failed[:10]) + (" ..." if len(failed) > 10 else "")
+        logger.warning(
+            f"[{label}] {len(failed)} 個交易對抓取失敗（網路錯誤已重試 {CONFIG['fetch_retries']} 次）: {shown}"
+        )
+
+
+def page_windows(since: int, until: int, timeframe: str, page: int) -> list:
+    """
+    將 [since, until) 切成每頁最多 page 根 K線的請求視窗
+
+    返回：
+        [(since, limit), ...]，依時間排序
+    """
+    tf_ms = timeframe_to_ms(timeframe)
+    span = page * tf_ms
+    return [(start, int(min(page, -(-(until - start) // tf_ms))))
+            for start in range(int(since), int(until), span)]
+
+
+def _fetch_windows(since, fetch_limit: int, timeframe: str, max_limit: int) -> list:
+    """
+    單一交易對的請求視窗：fetch_limit 不超過交易所單次上限時維持一次請求，
+    否則從 since（None 則由未完成 K線往回推算）起分頁
+
+    返回：
+        [(since, limit), ...]
+    """
+    if fetch_limit <= max_limit:
+        return [(since, fetch_limit)]
+    tf_ms = timeframe_to_ms(timeframe)
+    if since is None:
+        since = last_close_ms(timeframe) - (fetch_limit - 1) * tf_ms
+    return page_windows(since, since + fetch_limit * tf_ms, timeframe, max_limit)
+
+
+def stitch_pages(pages: list) -> list:
+    """
+    拼接分頁抓取的 K線：依開盤時間排序，重複的 K線保留較晚的頁面
+
+    返回：
+        OHLCV 列表
+    """
+    merged = {}
+    for rows in pages:
+        for row in rows:
+            merged[int(row[0])] = row
+    return [merged[ts] for ts in sorted(merged)]
+
+
+def find_gaps(timestamps, timeframe: str) -> list:
+    """
+    檢查連續 K線之間的缺口
+
+    返回：
+        [(缺口前最後一根開盤時間, 缺口後第一根開盤時間), ...]
+    """
+    ts = np.asarray(timestamps, dtype=np.int64)
+    if len(ts) < 2:
+        return []
+    idx = np.flatnonzero(np.diff(ts) > timeframe_to_ms(timeframe))
+    return [(int(ts[i]), int(ts[i + 1])) for i in idx]
+
+
+def _fetch_ohlcv_sync(exchange, controller: RateController, symbol: str, timeframe: str,
+                      since, limit: int, venue: str) -> list:
+    """單次 fetch_ohlcv：網路錯誤與 429 / 418 依 fetch_retries 退避重試，仍失敗則引發例外"""
+    import ccxt
+
+    retries = max(0, CONFIG["fetch_retries"])
+    for attempt in range(retries + 1):
+        controller.wait_sync()
+        start = time.perf_counter()
+        try:
+            ohlcv = exchange.fetch_ohlcv(symbol, timeframe=timeframe, since=since, limit=limit)
+        except ccxt.NetworkError as e:
+            headers = getattr(exchange, "last_response_headers", None)
+            delay = _fetch_failed(controller, e, headers, attempt, final=attempt == retries)
+            if attempt == retries:
+                raise
+            time.sleep(delay)
+            continue
+        controller.observe(getattr(exchange, "last_response_headers", None))
+        _metrics.observe_fetch(f"{venue}:{symbol}", time.perf_counter() - start)
+        return ohlcv
+
+
+async def _fetch_ohlcv_async(exchange, controller: RateController, symbol: str,
+                             timeframe: str, since, limit: int, venue: str) -> list:
+    """單次非同步 fetch_ohlcv：佔用控制器的並行名額，失敗時依 fetch_retries 退避重試"""
+    import ccxt
+
+    retries = max(0, CONFIG["fetch_retries"])
+    for attempt in range(retries + 1):
+        await controller.acquire()
+        start = time.perf_counter()
+        try:
+            ohlcv = await exchange.fetch_ohlcv(
+                symbol, timeframe=timeframe, since=since, limit=limit
+            )
+        except ccxt.NetworkError as e:
+            error = e
+        except BaseException:
+            await controller.release()
+            raise
+        else:
+            error = None
+
+        # 先依回應調整視窗 / 暫停，再歸還名額，使 release() 以更新後的視窗喚醒等待者
+        headers = getattr(exchange, "last_response_headers", None)
+        delay = 0.0
+        if error is None:
+            controller.observe(headers)
+        else:
+            delay = _fetch_failed(controller, error, headers, attempt, final=attempt == retries)
+        await controller.release()
+
+        if error is None:
+            _metrics.observe_fetch(f"{venue}:{symbol}", time.perf_counter() - start)
+            return ohlcv
+        if attempt == retries:
+            raise error
+        await asyncio.sleep(delay)
+
+
+def _collect_candles_sync(timeframe: str, limit: int, last_timestamps: dict,
+                          coins: list, venue: str = DEFAULT_VENUE) -> tuple:
+    """
+    逐一抓取指定交易對的 K線
+
+    網路錯誤與 429 / 418 依 fetch_retries 重試，速率限制時等待控制器的暫停結束；
+    超過交易所單次上限的數量分頁抓取後拼接。
+
+    參數：
+        last_timestamps: {幣種: 本地最後一根 K線時間}，用於增量抓取
+        coins: 交易對列表（依此順序抓取）
+        venue: 交易所
+
+    返回：
+        元組：(交易對數量, [(幣種, 已收盤 OHLCV 列表), ...])
+    """
+    exchange = get_exchange(venue)
+    controller = get_rate_controller(venue)
+    max_limit = EXCHANGES[venue]["max_limit"]
+
+    candles = []
+    failed = []
+    with _metrics.stage("fetch_ohlcv"):
+        for idx, symbol in enumerate(coins):
+            since, fetch_limit = _incremental_request(
+                last_timestamps.get(symbol), timeframe, limit
+            )
+            try:
+                pages = [
+                    _fetch_ohlcv_sync(exchange, controller, symbol, timeframe,
+                                      page_since, page_limit, venue)
+                    for page_since, page_limit in _fetch_windows(
+                        since, fetch_limit, timeframe, max_limit)
+                ]
+                # 移除最後一根未完成的 K線
+                candles.append((symbol, stitch_pages(pages)[:-1]))
+            except Exception as e:
+                _metrics.error("fetch_ohlcv")
+                failed.append(symbol)
+                if CONFIG["verbose"]:
+                    logger.debug(f"跳過 {symbol}: {str(e)}")
+
+            _log_fetch_progress(idx + 1, len(coins), venue)
+
+    _log_fetch_failures(venue, failed, controller)
+    return len(coins), candles
+
+
+async def _collect_candles_async(timeframe: str, limit: int, last_timestamps: dict,
+                                 coins: list, concurrency: int,
+                                 venue: str = DEFAULT_VENUE) -> tuple:
+    """
+    以 ccxt 非同步客戶端並行抓取指定交易對的 K線
+
+    同時進行中的請求數由交易所的 RateController 依回應權重與 429 / 418 調整
+    （上限為 concurrency）。失敗的請求依 fetch_retries 退避重試；超過交易所
+    單次上限的數量分頁並行抓取後拼接。請求依 coins 的順序發出。
+
+    返回：
+        元組：(交易對數量, [(幣種, 已收盤 OHLCV 列表), ...])，順序與 coins 一致
+    """
+    exchange = get_async_exchange(venue)
+    controller = get_rate_controller(venue)
+    controller.max_concurrency = max(1, concurrency)
+    controller.window = min(controller.window, float(controller.max_concurrency))
+    max_limit = EXCHANGES[venue]["max_limit"]
+    failed = []
+    done = 0
+
+    async def fetch(symbol: str):
+        nonlocal done
+        since, fetch_limit = _incremental_request(
+            last_timestamps.get(symbol), timeframe, limit
+        )
+        try:
+            pages = await asyncio.gather(*(
+                _fetch_ohlcv_async(exchange, controller, symbol, timeframe,
+                                   page_since, page_limit, venue)
+                for page_since, page_limit in _fetch_windows(
+                    since, fetch_limit, timeframe, max_limit)
+            ))
+            # 移除最後一根未完成的 K線
+            return stitch_pages(pages)[:-1]
+        except Exception as e:
+            _metrics.error("fetch_ohlcv")
+            failed.append(symbol)
+            if CONFIG["verbose"]:
+                logger.debug(f"跳過 {symbol}: {str(e)}")
+            return None
+        finally:
+            done += 1
+            _log_fetch_progress(done, len(coins), venue)
+
+    try:
+        # 注入市場資料，避免 ccxt 在第一次請求前自行載入
+        with _metrics.stage("load_markets"):
+            await load_markets_cached_async(exchange, venue)
+        logger.info(
+            f"[{venue_label(venue)}] 開始抓取 {len(coins)} 個交易對 | {controller.summary()}"
+        )
+
+        with _metrics.stage("fetch_ohlcv"):
+            fetched = await asyncio.gather(*(fetch(symbol) for symbol in coins))
+    finally:
+        await exchange.close()
+
+    _log_fetch_failures(venue, failed, controller)
+    candles = [(symbol, ohlcv) for symbol, ohlcv in zip(coins, fetched) if ohlcv is not None]
+    return len(coins), candles
+
+
+def collect_panel(timeframe: str = '4h', limit: int = 500, symbols: list = None,
+                  venue: str = DEFAULT_VENUE) -> CandlePanel:
+    """
+    收集 USDT 永續合約的 K線數據
+
+    參數：
+        timeframe: 時間框架（1h, 4h, 1d 等）
+        limit: K線數量
+        symbols: 要抓取的交易對（依此順序）；None 則由 select_symbols 決定
+        venue: 交易所（各交易所使用各自的 K線快取檔）
+
+    返回：
+        CandlePanel（幣種 × K線），幣種順序與 symbols 一致
+    """
+    label = venue_label(venue)
+    max_limit = EXCHANGES[venue]["max_limit"]
+    logger.info(f"[{label}] 開始收集數據 | 時間框架: {timeframe} | K線數量: {limit}")
+    if limit > max_limit:
+        logger.info(f"[{label}] 超過單次請求上限 {max_limit} 根，每個交易對分 {-(-limit // max_limit)} 頁抓取")
+
+    if symbols is None:
+        symbols = select_symbols(venue)
+
+    store_path = venue_path(CONFIG["candle_store_path"], venue)
+    store = CandleStore(store_path) if store_path else None
+    try:
+        with _metrics.stage("candle_store"):
+            # 快取不足 limit - 1 根的幣種（調高 limit 或曾被裁剪）不做增量，改為完整下載回補
+            last_timestamps = store.last_timestamps(timeframe, min_bars=limit - 1) if store else {}
+
+        if CONFIG["async_fetch"]:
+            total_coins, candles = asyncio.run(_collect_candles_async(
+                timeframe, limit, last_timestamps, symbols, CONFIG["fetch_concurrency"], venue
+            ))
+        else:
+            total_coins, candles = _collect_candles_sync(
+                timeframe, limit, last_timestamps, symbols, venue
+            )
+
+        # 合併本地快取，返回最近 limit - 1 根已收盤 K線；快取的保留量不低於
+        # 多時間框架掃描所需的數量，避免只掃描部分時間框架時裁剪掉較大週期的歷史
+        if store:
+            with _metrics.stage("candle_store"):
+                keep = max(limit, store_keep_limit(timeframe)) - 1
+                candles = [(symbol, rows[-(limit - 1):])
+                           for symbol, rows in store.merge(timeframe, candles, keep=keep)]
+    finally:
+        if store:
+            store.close()
+
+    with _metrics.stage("panel_build"):
+        panel = CandlePanel.from_candles(candles)
+
+    if panel.empty:
+        logger.error(f"[{label}] 無法收集任何數據！")
+        return panel
+
+    failed = total_coins - len(panel)
+    if failed:
+        _metrics.skip("no_candles", failed)
+    logger.info(f"[{label}] 數據收集完成 | 成功: {len(panel)}/{total_coins} 個交易對")
+
+    return panel
+
+
+def collect_data(timeframe: str = '4h', limit: int = 500,
+                 venue: str = DEFAULT_VENUE) -> pd.DataFrame:
+    """
+    收集所有 USDT 永續合約的 K線數據（長格式 DataFrame，相容舊版介面）
+
+    參數：
+        timeframe: 時間框架（1h, 4h, 1d 等）
+        limit: K線數量
+        venue: 交易所
+
+    返回：
+        包含所有幣種 OHLCV 數據的 DataFrame
+    """
+    return collect_panel(timeframe, limit, venue=venue).to_frame()
+
+# ============================================================================
+# 歷史數據下載模組
+# ============================================================================
+
+def parse_date_ms(text: str) -> int:
+    """將日期（YYYY-MM-DD 或 ISO 8601，未標示時區者視為 UTC）轉為毫秒時間戳"""
+    dt = datetime.fromisoformat(text)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return int(dt.timestamp() * 1000)
+
+
+def _format_ms(ms: int) -> str:
+    return datetime.fromtimestamp(ms / 1000, timezone.utc).strftime("%Y-%m-%d %H:%M")
+
+
+async def _download_pages(exchange, controller: RateController, store: CandleStore,
+                          pages: list, timeframe: str, venue: str) -> int:
+    """
+    以並行工作協程下載分頁並逐頁寫入 store（每頁一個交易，中斷後已完成的頁面不會遺失）
+
+    參數：
+        pages: [(幣種, 分頁起點, K線數量), ...]
+
+    返回：
+        失敗（重試後仍無法取得）的分頁數
+    """
+    tf_ms = timeframe_to_ms(timeframe)
+    pending = deque(pages)
+    done = failed = 0
+
+    async def worker():
+        nonlocal done, failed
+        while pending:
+            symbol, since, limit = pending.popleft()
+            until = since + limit * tf_ms
+            try:
+                ohlcv = await _fetch_ohlcv_async(
+                    exchange, controller, symbol, timeframe, since, limit, venue
+                )
+                store.save_page(symbol, timeframe, since, until,
+                                [row for row in ohlcv if since <= row[0] < until])
+            except Exception as e:
+                failed += 1
+                _metrics.error("download")
+                if CONFIG["verbose"]:
+                    logger.debug(f"{symbol} {_format_ms(since)} 分頁下載失敗: {str(e)}")
+            done += 1
+            _log_fetch_progress(done, len(pages), venue)
+
+    await asyncio.gather(*(worker() for _ in range(controller.max_concurrency)))
+    return failed
+
+
+async def _download_history_async(store: CandleStore, symbols: list, timeframe: str,
+                                  since: int, until: int, venue: str) -> dict:
+    exchange = get_async_exchange(venue)
+    controller = get_rate_controller(venue)
+    label = venue_label(venue)
+    page = EXCHANGES[venue]["max_limit"]
+    tf_ms = timeframe_to_ms(timeframe)
+    offset = timeframe_offset_ms(timeframe)
+
+    # 只下載已收盤的 K線；起點向下對齊到分頁邊界，以不同起點重跑時仍能沿用檢查點
+    until = min(until, last_close_ms(timeframe))
+    span = page * tf_ms
+    first = (since - offset) // span * span + offset
+    windows = page_windows(first, until, timeframe, page)
+
+    try:
+        with _metrics.stage("load_markets"):
+            markets = await load_markets_cached_async(exchange, venue)
+        settle = EXCHANGES[venue]["settle"]
+        symbols = [symbol if "/" in symbol else f"{symbol.upper()}/{settle}:{settle}"
+                   for symbol in symbols or filter_usdt_symbols(markets, settle)]
+
+        completed = store.completed_pages(timeframe)
+        pages = [(symbol, start, limit) for symbol in symbols for start, limit in windows
+                 if completed.get((symbol, start), 0) < start + limit * tf_ms]
+        resumed = len(symbols) * len(windows) - len(pages)
+        logger.info(
+            f"[{label}] 下載歷史 K線 | {timeframe} | {_format_ms(first)} ~ {_format_ms(until)} | "
+            f"{len(symbols)} 個交易對 × {len(windows)} 頁 | 已完成略過: {resumed} 頁"
+        )
+
+        with _metrics.stage("fetch_ohlcv"):
+            failed = await _download_pages(exchange, controller, store, pages, timeframe, venue)
+
+            # 缺口檢查：重新下載涵蓋缺口的分頁一次，仍存在者（交易所停機等）列入結果
+            gaps = {symbol: find_gaps(store.timestamps(symbol, timeframe, first, until), timeframe)
+                    for symbol in symbols}
+            retry = []
+            for symbol, spans in gaps.items():
+                for gap_from, gap_to in spans:
+                    store.forget_pages(symbol, timeframe, gap_from + tf_ms, gap_to)
+                    retry += [(symbol, start, limit) for start, limit in windows
+                              if start < gap_to and start + limit * tf_ms > gap_from + tf_ms]
+            if retry:
+                logger.info(f"[{label}] 發現缺口，重新下載 {len(set(retry))} 頁")
+                failed += await _download_pages(
+                    exchange, controller, store, sorted(set(retry)), timeframe, venue
+                )
+                gaps = {symbol: find_gaps(store.timestamps(symbol, timeframe, first, until),
+                                          timeframe)
+                        for symbol in symbols}
+    finally:
+        await exchange.close()
+
+    logger.info(f"[{label}] 速率控制 | {controller.summary()}")
+    gaps = {symbol: spans for symbol, spans in gaps.items() if spans}
+    for symbol, spans in gaps.items():
+        shown = ", ".join(f"{_format_ms(a)} → {_format_ms(b)}" for a, b in spans[:3])
+        logger.warning(f"[{label}] {symbol} 有 {len(spans)} 個 K線缺口: {shown}")
+    if failed:
+        logger.warning(f"[{label}] {failed} 頁下載失敗，重新執行相同命令即可續傳")
+
+    return {"symbols": len(symbols), "pages": len(pages), "resumed": resumed,
+            "failed": failed, "gaps": gaps}
+
+
+def download_history(since, until=None, timeframe: str = None, symbols: list = None,
+                     venue: str = DEFAULT_VENUE, path: str = None) -> dict:
+    """
+    下載超過單次請求上限的長期歷史 K線
+
+    將 [since, until) 切成交易所單次上限大小的分頁，於速率控制器的額度內並行抓取，
+    逐頁寫入 SQLite（以主鍵去重）並記錄檢查點；完成後檢查 K線缺口。
+    中斷後以相同參數重新執行，只會下載尚未完成的分頁。
+
+    參數：
+        since / until: 起訖時間（毫秒或日期字串）；until 預設為現在
+        timeframe: 時間框架，預設 harmonic_timeframe
+        symbols: 交易對（可只寫幣種，例如 "BTC"）；None 則為全部 USDT 永續合約
+        venue: 交易所
+        path: SQLite 路徑，預設 history_store_path（非預設交易所加上交易所名稱）
+
+    返回：
+        dict：交易對數量、下載 / 續傳略過 / 失敗的分頁數，以及 {幣種: [(缺口前, 缺口後), ...]}
+    """
+    timeframe = timeframe or CONFIG["harmonic_timeframe"]
+    since = parse_date_ms(since) if isinstance(since, str) else int(since)
+    if until is None:
+        until = int(time.time() * 1000)
+    until = parse_date_ms(until) if isinstance(until, str) else int(until)
+    path = path or venue_path(CONFIG["history_store_path"], venue)
+
+    store = CandleStore(path)
+    try:
+        with _metrics.stage("download"):
+            result = asyncio.run(_download_history_async(
+                store, symbols, timeframe, since, until, venue
+            ))
+    finally:
+        store.close()
+
+    logger.info(
+        f"[{venue_label(venue)}] 歷史下載完成 | {path} | 下載: {result['pages'] - result['failed']} 頁 | "
+        f"缺口: {sum(len(spans) for spans in result['gaps'].values())} 個"
+    )
+    return result
+
+# ============================================================================
+# 輔助函數
+# ============================================================================
+
+def list_to_string(s: list) -> str:
+    """將列表轉換為字串"""
+    return "".join(str(ele) for ele in s)
+
+# ============================================================================
+# 峰值檢測模組
+# ============================================================================
+
+PIVOT_TIE_BREAKS = ("strict", "first", "last")
+
+
+def _sliding_max(x: np.ndarray, window: int) -> np.ndarray:
+    """
+    沿最後一軸計算長度 window 的滑動最大值
+
+    以 van Herk / Gil-Werman 演算法將序列切成 window 長的區塊，
+    由區塊內前綴最大值與後綴最大值組合出每個窗口的最大值：
+    每個元素成本為 O(1)，與 window 無關，並可一次處理多個序列。
+
+    返回：
+        形狀 (..., n - window + 1)，第 k 個元素為 x[..., k:k + window] 的最大值
+    """
+    n = x.shape[-1]
+    blocks = -(-n // window)
+    pad = np.full(x.shape[:-1] + (blocks * window - n,), -np.inf)
+    padded = np.concatenate([x, pad], axis=-1)
+    shaped = padded.reshape(x.shape[:-1] + (blocks, window))
+
+    prefix = np.maximum.accumulate(shaped, axis=-1).reshape(padded.shape)
+    suffix = np.maximum.accumulate(shaped[..., ::-1], axis=-1)[..., ::-1].reshape(padded.shape)
+    return np.maximum(suffix[..., :n - window + 1], prefix[..., window - 1:n])
+
+
+def pivot_mask(values: np.ndarray, order: int = 10, tie: str = "strict",
+               lengths: np.ndarray = None) -> np.ndarray:
+    """
+    標記局部極大值（局部極小值請傳入負值）
+
+    與 argrelextrema 的 clip 邊界模式一致：第 i 根需高於左右各 order 根
+    （超出序列者不比較），每段序列的第一根與最後一根永遠不是轉折點。
+
+    參數：
+        values: 1-D 序列或 (序列數, K線數) 陣列
+        order: 左右比較的 K線數量
+        tie: 等值平台的處理（strict / first / last）
+        lengths: 2-D 輸入時每個序列的有效長度，之後的部分忽略
+
+    返回：
+        與 values 形狀相同的布林陣列
+    """
+    if order < 1:
+        raise ValueError("order 必須大於等於 1")
+    if tie not in PIVOT_TIE_BREAKS:
+        raise ValueError(f"不支援的平台處理方式: {tie}")
+
+    x = np.asarray(values, dtype=np.float64)
+    rows = np.atleast_2d(x)
+    n = rows.shape[1]
+    if lengths is None:
+        lengths = np.full(len(rows), n)
+    positions = np.arange(n)
+    valid = (positions >= 1) & (positions < np.asarray(lengths)[:, None] - 1)
+
+    data = np.where(np.isnan(rows) | (positions >= np.asarray(lengths)[:, None]), -np.inf, rows)
+    fill = np.full((len(rows), order), -np.inf)
+    window_max = _sliding_max(np.concatenate([fill, data, fill], axis=1), order)
+    left = window_max[:, :n]
+    right = window_max[:, order + 1:order + 1 + n]
+
+    # first：平台左側須嚴格較低、右側可相等；last 相反
+    above_left = data >= left if tie == "last" else data > left
+    above_right = data >= right if tie == "first" else data > right
+    mask = above_left & above_right & valid & np.isfinite(data)
+    return mask if x.ndim == 2 else mask[0]
+
+
+def zigzag_pivots(high: np.ndarray, low: np.ndarray, pct: float = 0.05) -> tuple:
+    """
+    百分比 ZigZag 轉折點
+
+    追蹤目前走勢的極值，當價格自極值反向移動超過 pct 時確認該極值為轉折點，
+    高低點因此交替出現；最後一段尚未反轉的極值不列入。
+
+    返回：
+        元組：(轉折點 K線索引, 轉折點價格)
+    """
+    high = np.asarray(high, dtype=np.float64)
+    low = np.asarray(low, dtype=np.float64)
+    pivots = []
+    trend = 0  # 1 = 上升段（追蹤高點），-1 = 下降段（追蹤低點），0 = 尚未確定
+    hi_i = lo_i = 0
+
+    for i in range(1, len(high)):
+        if trend == 0:
+            if high[i] > high[hi_i]:
+                hi_i = i
+            if low[i] < low[lo_i]:
+                lo_i = i
+            if lo_i < hi_i and high[hi_i] >= low[lo_i] * (1 + pct):
+                pivots.append((lo_i, low[lo_i]))
+                trend = 1
+            elif hi_i < lo_i and low[lo_i] <= high[hi_i] * (1 - pct):
+                pivots.append((hi_i, high[hi_i]))
+                trend = -1
+        elif trend == 1:
+            if high[i] > high[hi_i]:
+                hi_i = i
+            elif low[i] <= high[hi_i] * (1 - pct):
+                pivots.append((hi_i, high[hi_i]))
+                trend, lo_i = -1, i
+        else:
+            if low[i] < low[lo_i]:
+                lo_i = i
+            elif high[i] >= low[lo_i] * (1 + pct):
+                pivots.append((lo_i, low[lo_i]))
+                trend, hi_i = 1, i
+
+    pivot_idx = np.array([i for i, _ in pivots], dtype=np.int64)
+    pivot_price = np.array([price for _, price in pivots], dtype=np.float64)
+    return pivot_idx, pivot_price
+
+
+def _merge_pivots(max_idx: np.ndarray, min_idx: np.ndarray, high: np.ndarray,
+                  low: np.ndarray) -> tuple:
+    """合併高低點並依時間排序（同一根 K線先高點後低點）"""
+    peaks_idx = np.concatenate((max_idx, min_idx))
+    peaks_p = np.concatenate((high[max_idx], low[min_idx]))
+
+    sort_idx = np.argsort(peaks_idx, kind="stable")
+    return peaks_idx[sort_idx], peaks_p[sort_idx]
+
+
+def detect_pivots(high: np.ndarray, low: np.ndarray, order: int = 10, tie: str = None,
+                  mode: str = None, pct: float = None) -> tuple:
+    """
+    檢測高低點轉折並依時間排序
+
+    參數：
+        high: 最高價陣列
+        low: 最低價陣列
+        order: 峰值檢測的窗口大小
+        tie: 等值平台的處理（strict / first / last），預設為 pivot_tie_break
+        mode: window 或 zigzag，預設為 pivot_mode
+        pct: ZigZag 反轉幅度，預設為 zigzag_pct
+
+    返回：
+        元組：(轉折點 K線索引, 轉折點價格)
+    """
+    high = np.asarray(high, dtype=np.float64)
+    low = np.asarray(low, dtype=np.float64)
+
+    if (mode or CONFIG["pivot_mode"]) == "zigzag":
+        return zigzag_pivots(high, low, CONFIG["zigzag_pct"] if pct is None else pct)
+
+    tie = tie or CONFIG["pivot_tie_break"]
+    max_idx = np.flatnonzero(pivot_mask(high, order, tie))
+    min_idx = np.flatnonzero(pivot_mask(-low, order, tie))
+    return _merge_pivots(max_idx, min_idx, high, low)
+
+
+def detect_pivots_batch(high: np.ndarray, low: np.ndarray, lengths: np.ndarray,
+                        order: int = 10, tie: str = None, mode: str = None,
+                        pct: float = None, chunk_bars: int = 1 << 22) -> list:
+    """
+    批次檢測多個序列的轉折點（例如整個 CandlePanel）
+
+    window 模式下每批序列以一次 2-D 滑動最大值運算完成，
+    結果與逐一呼叫 detect_pivots 相同。
+
+    參數：
+        high / low: (序列數, K線數) 陣列，超出 lengths 的部分忽略
+        lengths: 每個序列的有效長度
+        chunk_bars: 每批最多處理的 K線格數（序列數 × K線數），
+            限制 2-D 暫存陣列的大小，長期歷史時每批的序列數會相應減少
+
+    返回：
+        [(轉折點 K線索引, 轉折點價格), ...]，每個序列一組
+    """
+    lengths = np.asarray(lengths)
+    mode = mode or CONFIG["pivot_mode"]
+    if mode == "zigzag":
+        return [
+            detect_pivots(high[i, :n], low[i, :n], order, mode=mode, pct=pct)
+            for i, n in enumerate(lengths)
+        ]
+
+    tie = tie or CONFIG["pivot_tie_break"]
+    chunk_size = max(1, chunk_bars // max(1, high.shape[1]))
+    results = []
+    for start in range(0, len(lengths), chunk_size):
+        stop = min(start + chunk_size, len(lengths))
+        chunk_high = np.asarray(high[start:stop], dtype=np.float64)
+        chunk_low = np.asarray(low[start:stop], dtype=np.float64)
+        chunk_lengths = lengths[start:stop]
+        max_mask = pivot_mask(chunk_high, order, tie, chunk_lengths)
+        min_mask = pivot_mask(-chunk_low, order, tie, chunk_lengths)
+        for i in range(stop - start):
+            results.append(_merge_pivots(
+                np.flatnonzero(max_mask[i]), np.flatnonzero(min_mask[i]),
+                chunk_high[i], chunk_low[i]
+            ))
+    return results
+
+
+def current_pattern(pivot_price: np.ndarray, low: np.ndarray) -> tuple:
+    """
+    組合最後 4 個峰值 + 當前價格，計算 XA/AB/BC/CD 四段移動
+
+    返回：
+        元組：(價格模式, 移動段)
+    """
+    current_pat = np.append(pivot_price[-4:], low[-1])
+    return current_pat, list(np.diff(current_pat))
+
+
+class PivotTracker:
+    """
+    單一幣種的串流轉折點追蹤器
+
+    每次輸入一根已收盤 K線；當窗口中央的 K線高（低）點高（低）於
+    左右各 order 根時（等值依 tie 處理），確認為轉折高（低）點。每根 K線成本為 O(order)，
+    只保留最近 max_pivots 個已確認轉折點。僅支援 window 模式。
+
+    detect_pivots（argrelextrema 的 clip 邊界模式）也會回報最後 order 根內
+    暫時成立的轉折點，current_pattern() 會在最近窗口上補算這些點，
+    使輸出與整段重算完全一致。
+    """
+
+    def __init__(self, order: int = 10, max_pivots: int = 8, tie: str = "strict"):
+        self.order = order
+        self.tie = tie
+        self.window = 2 * order + 1
+        self.highs = deque(maxlen=self.window)
+        self.lows = deque(maxlen=self.window)
+        self.timestamps = deque(maxlen=self.window)
+        # 已確認轉折點：(K線序號, 開盤時間, 價格)
+        self.pivots = deque(maxlen=max_pivots)
+        self.bar_count = 0
+        self.last_ts = None
+
+    def update(self, timestamp: int, high: float, low: float) -> list:
+        """
+        輸入一根已收盤 K線
+
+        返回：
+            本次新確認的轉折點列表
+        """
+        self.highs.append(high)
+        self.lows.append(low)
+        self.timestamps.append(timestamp)
+        self.bar_count += 1
+        self.last_ts = timestamp
+
+        # 中央 K線右側需滿 order 根；第一根 K線在 clip 模式下永遠不是轉折點
+        center = len(self.highs) - 1 - self.order
+        if center < 1:
+            return []
+
+        bar = self.bar_count - 1 - self.order
+        center_high = self.highs[center]
+        center_low = self.lows[center]
+
+        # 同一根 K線同時為高低點時，與 detect_pivots 一致先記錄高點
+        confirmed = []
+        if self._is_extreme(self.highs, center, 1):
+            confirmed.append((bar, self.timestamps[center], center_high))
+        if self._is_extreme(self.lows, center, -1):
+            confirmed.append((bar, self.timestamps[center], center_low))
+
+        self.pivots.extend(confirmed)
+        return confirmed
+
+    def _is_extreme(self, values: deque, center: int, sign: int) -> bool:
+        """窗口中央是否為極值（sign = 1 高點、-1 低點），等值依 tie 決定"""
+        center_value = sign * values[center]
+        for j, value in enumerate(values):
+            value = sign * value
+            if j == center or center_value > value:
+                continue
+            if center_value < value:
+                return False
+            # 等值：first 允許右側相等、last 允許左側相等
+            if self.tie != ("last" if j < center else "first"):
+                return False
+        return True
+
+    def warmup(self, timestamps: np.ndarray, high: np.ndarray, low: np.ndarray):
+        """以整段歷史一次性初始化（向量化檢測，保留最後 2 × order 根 K線作為窗口）"""
+        pivot_idx, pivot_price = detect_pivots(
+            high, low, order=self.order, tie=self.tie, mode="window"
+        )
+
+        # 只保留右側已滿 order 根的確認點
+        confirmed = pivot_idx <= len(high) - 1 - self.order
+        pivot_idx = pivot_idx[confirmed][-self.pivots.maxlen:]
+        pivot_price = pivot_price[confirmed][-self.pivots.maxlen:]
+
+        self.pivots.clear()
+        self.pivots.extend(
+            zip(pivot_idx.tolist(), timestamps[pivot_idx].tolist(), pivot_price.tolist())
+        )
+
+        keep = self.window - 1
+        self.highs.clear()
+        self.lows.clear()
+        self.timestamps.clear()
+        self.highs.extend(high[-keep:].tolist())
+        self.lows.extend(low[-keep:].tolist())
+        self.timestamps.extend(timestamps[-keep:].tolist())
+        self.bar_count = len(high)
+        self.last_ts = int(timestamps[-1]) if len(timestamps) else None
+
+    def sync(self, timestamps: np.ndarray, high: np.ndarray, low: np.ndarray):
+        """
+        與最新的 K線序列同步：只輸入上次之後的新 K線，
+        序列無法銜接（首次使用或斷檔）時重新初始化
+        """
+        start = None
+        if self.last_ts is not None:
+            pos = int(np.searchsorted(timestamps, self.last_ts))
+            if pos < len(timestamps) and timestamps[pos] == self.last_ts:
+                start = pos + 1
+
+        if start is None:
+            self.warmup(timestamps, high, low)
+            return
+
+        for i in range(start, len(timestamps)):
+            self.update(int(timestamps[i]), float(high[i]), float(low[i]))
+
+    def provisional_pivots(self) -> list:
+        """最後 order 根 K線內暫時成立（尚未確認）的轉折點"""
+        highs = np.array(self.highs)
+        lows = np.array(self.lows)
+        pivot_idx, pivot_price = detect_pivots(
+            highs, lows, order=self.order, tie=self.tie, mode="window"
+        )
+
+        first_bar = self.bar_count - len(highs)
+        tail = pivot_idx > len(highs) - 1 - self.order
+        return [
+            (first_bar + int(i), self.timestamps[i], float(price))
+            for i, price in zip(pivot_idx[tail], pivot_price[tail])
+        ]
+
+    def recent_pivots(self, count: int = 4) -> list:
+        """最近 count 個轉折點（含暫時成立的點），依時間排序"""
+        return (list(self.pivots) + self.provisional_pivots())[-count:]
+
+    def current_pattern(self) -> tuple:
+        """
+        最後 4 個轉折點 + 最新低點，與 current_pattern() 輸出相同；
+        轉折點不足 4 個時返回 None
+
+        返回：
+            元組：(價格模式, 移動段)
+        """
+        pivots = self.recent_pivots(4)
+        if len(pivots) < 4 or not self.lows:
+            return None
+
+        prices = np.array([price for _, _, price in pivots])
+        return current_pattern(prices, np.array([self.lows[-1]]))
+
+
+def peak_detect(df: pd.DataFrame, order: int = 10):
+    """
+    檢測價格峰值，用於谐波形態識別
+
+    參數：
+        df: 單一幣種的 OHLCV 數據
+        order: 峰值檢測的窗口大小
+
+    返回：
+        元組：(時間索引, 價格模式, 起始, 結束, 移動段, 高點, 低點, 最終數據, 幣種)
+    """
+    import pandas as pd
+
+    dt = df.Datetime
+    df = df.set_index('Datetime')
+
+    high = df.High
+    low = df.Low
+
+    peaks_idx, peaks_p = detect_pivots(high.values, low.values, order=order)
+    final_df = pd.DataFrame({"price": peaks_p, "datetime": dt.values[peaks_idx]})
+
+    # 組合最後 4 個峰值 + 當前價格
+    current_idx = np.array(list(final_df.datetime[-4:]) + list(dt[-1:]))
+    current_pat, moves = current_pattern(peaks_p, low.values)
+
+    start = min(current_idx)
+    end = max(current_idx)
+
+    symbol = df['Symbol'].unique().tolist()
+
+    return current_idx, current_pat, start, end, moves, high, low, final_df, symbol
+
+# ============================================================================
+# 谐波形態識別模組
+# ============================================================================
+
+# 形態比例誤差容許值
+PATTERN_ERR_ALLOWED = 0.1
+
+# 谐波形態比例表
+# - direction: 1 = 看漲（M 形：XA 上、AB 下、BC 上、CD 下），-1 = 看跌（W 形）
+# - ab / bc: AB 相對 XA、BC 相對 AB 的比例區間
+# - cd_xa_min / cd_bc_max: CD 至少為 XA 的倍數、至多為 BC 的倍數
+# - prz_xa: PRZ 位於 A 點外延 XA 的比例
+# - sl_prz: 止損為 PRZ 的倍數；None 表示以 X 點作為止損
+PATTERN_TABLE = {
+    "看漲蝙蝠": {"direction": 1, "ab": (0.382, 0.5), "bc": (0.382, 0.886),
+                "cd_xa_min": 0.7, "cd_bc_max": 2.618, "prz_xa": 0.886, "sl_prz": None},
+    "看跌蝙蝠": {"direction": -1, "ab": (0.382, 0.5), "bc": (0.382, 0.886),
+                "cd_xa_min": 0.7, "cd_bc_max": 2.618, "prz_xa": 0.886, "sl_prz": None},
+    "看漲加特里": {"direction": 1, "ab": (0.618, 0.618), "bc": (0.382, 0.886),
+                  "cd_xa_min": 0.6, "cd_bc_max": 1.618, "prz_xa": 0.786, "sl_prz": None},
+    "看跌加特里": {"direction": -1, "ab": (0.618, 0.618), "bc": (0.382, 0.886),
+                  "cd_xa_min": 0.6, "cd_bc_max": 1.618, "prz_xa": 0.786, "sl_prz": None},
+    "看漲螃蟹": {"direction": 1, "ab": (0.382, 0.618), "bc": (0.382, 0.886),
+                "cd_xa_min": 1.3, "cd_bc_max": 3.618, "prz_xa": 1.618, "sl_prz": 0.98},
+    "看跌螃蟹": {"direction": -1, "ab": (0.382, 0.618), "bc": (0.382, 0.886),
+                "cd_xa_min": 1.3, "cd_bc_max": 3.618, "prz_xa": 1.618, "sl_prz": 1.02},
+    "看漲蝴蝶": {"direction": 1, "ab": (0.786, 0.786), "bc": (0.382, 0.886),
+                "cd_xa_min": 1.2, "cd_bc_max": 2.618, "prz_xa": 1.27, "sl_prz": 0.98},
+    "看跌蝴蝶": {"direction": -1, "ab": (0.786, 0.786), "bc": (0.382, 0.886),
+                "cd_xa_min": 1.2, "cd_bc_max": 2.618, "prz_xa": 1.27, "sl_prz": 0.98},
+}
+
+PATTERN_NAMES = list(PATTERN_TABLE.keys())
+
+# 獲利目標：C 點往 D 點方向回撤 CD 的比例
+TP_RATIOS = (0.618, 0.5, 0.382)
+
+
+def _pattern_columns() -> dict:
+    """將形態比例表轉為 (形態數, 1) 欄向量，供廣播運算使用"""
+    rows = [PATTERN_TABLE[name] for name in PATTERN_NAMES]
+    err = PATTERN_ERR_ALLOWED
+
+    def column(values):
+        return np.array(values, dtype=np.float64)[:, None]
+
+    return {
+        "direction": column([r["direction"] for r in rows]),
+        "ab_lo": column([r["ab"][0] - err for r in rows]),
+        "ab_hi": column([r["ab"][1] + err for r in rows]),
+        "bc_lo": column([r["bc"][0] - err for r in rows]),
+        "bc_hi": column([r["bc"][1] + err for r in rows]),
+        "cd_xa_min": column([r["cd_xa_min"] for r in rows]),
+        "cd_bc_max": column([r["cd_bc_max"] + err for r in rows]),
+        "prz_xa": column([r["prz_xa"] for r in rows]),
+        "sl_prz": column([np.nan if r["sl_prz"] is None else r["sl_prz"] for r in rows]),
+    }
+
+
+_PATTERN_COLUMNS = _pattern_columns()
+
+
+def evaluate_patterns(moves: np.ndarray, pivots: np.ndarray) -> dict:
+    """
+    批次評估所有谐波形態
+
+    參數：
+        moves: (N, 4) XA/AB/BC/CD 移動段矩陣
+        pivots: (N, 5) X/A/B/C/D 價格矩陣；轉折點不足的列以 NaN 填補
+
+    返回：
+        字典：mask 為 (形態數, N) 布林矩陣，prz/sl/tp1/tp2/tp3 為同形狀的價格矩陣，
+        形態順序與 PATTERN_NAMES 一致
+    """
+    moves = np.asarray(moves, dtype=np.float64).reshape(-1, 4)
+    pivots = np.asarray(pivots, dtype=np.float64).reshape(-1, 5)
+    cols = _PATTERN_COLUMNS
+
+    abs_moves = np.abs(moves)
+    XA, AB, BC, CD = abs_moves.T
+    direction = cols["direction"]
+
+    with np.errstate(invalid="ignore"):
+        # 看漲：+ - + -；看跌：- + - +
+        signed = moves[None, :, :] * direction[:, :, None] * np.array([1, -1, 1, -1])
+        mask = (
+            np.all(signed > 0, axis=2) &
+            (cols["ab_lo"] * XA < AB) & (AB < cols["ab_hi"] * XA) &
+            (cols["bc_lo"] * AB < BC) & (BC < cols["bc_hi"] * AB) &
+            (CD >= cols["cd_xa_min"] * XA) &
+            (CD <= cols["cd_bc_max"] * BC)
+        )
+
+    prz = np.round(pivots[:, 1] - direction * cols["prz_xa"] * XA, 4)
+    sl = np.where(np.isnan(cols["sl_prz"]), np.round(pivots[:, 0], 4), prz * cols["sl_prz"])
+
+    result = {"mask": mask, "prz": prz, "sl": sl}
+    for k, ratio in enumerate(TP_RATIOS, start=1):
+        result[f"tp{k}"] = np.round(pivots[:, 3] - direction * ratio * CD, 4)
+
+    return result
+
+
+def match_pattern(pattern_name: str, moves: list, symbol: list, current_pat: np.ndarray):
+    """
+    以單一形態檢查一組移動段（舊版逐一形態介面）
+
+    返回：
+        符合時為 (幣種, PRZ, SL, TP1, TP2, TP3)，否則為空列表
+    """
+    try:
+        result = evaluate_patterns(moves, current_pat)
+        p = PATTERN_NAMES.index(pattern_name)
+        if result["mask"][p, 0]:
+            return (
+                list_to_string(symbol).replace("/USDT", ""),
+                result["prz"][p, 0], result["sl"][p, 0],
+                result["tp1"][p, 0], result["tp2"][p, 0], result["tp3"][p, 0]
+            )
+        return []
+
+    except Exception:
+        return []
+
+
+def bull_bat(moves: list, symbol: list, current_pat: np.ndarray):
+    """看漲蝙蝠形態識別（AB 0.382-0.5 XA，CD 1.618-2.618 BC）"""
+    return match_pattern("看漲蝙蝠", moves, symbol, current_pat)
+
+
+def bear_bat(moves: list, symbol: list, current_pat: np.ndarray):
+    """看跌蝙蝠形態識別"""
+    return match_pattern("看跌蝙蝠", moves, symbol, current_pat)
+
+
+def bull_gartley(moves: list, symbol: list, current_pat: np.ndarray):
+    """看漲加特里形態識別（AB 0.618 XA，CD 1.272-1.618 BC）"""
+    return match_pattern("看漲加特里", moves, symbol, current_pat)
+
+
+def bear_gartley(moves: list, symbol: list, current_pat: np.ndarray):
+    """看跌加特里形態識別"""
+    return match_pattern("看跌加特里", moves, symbol, current_pat)
+
+
+def bull_crab(moves: list, symbol: list, current_pat: np.ndarray):
+    """看漲螃蟹形態識別（AB 0.382-0.618 XA，CD 2.618-3.618 BC）"""
+    return match_pattern("看漲螃蟹", moves, symbol, current_pat)
+
+
+def bear_crab(moves: list, symbol: list, current_pat: np.ndarray):
+    """看跌螃蟹形態識別"""
+    return match_pattern("看跌螃蟹", moves, symbol, current_pat)
+
+
+def bull_butterfly(moves: list, symbol: list, current_pat: np.ndarray):
+    """看漲蝴蝶形態識別（AB 0.786 XA，CD 1.618-2.618 BC）"""
+    return match_pattern("看漲蝴蝶", moves, symbol, current_pat)
+
+
+def bear_butterfly(moves: list, symbol: list, current_pat: np.ndarray):
+    """看跌蝴蝶形態識別"""
+    return match_pattern("看跌蝴蝶", moves, symbol, current_pat)
+
+# ============================================================================
+# 信號輸出模組
+# ============================================================================
+
+class Signal:
+    """
+    單一形態信號（__slots__，不建立實例字典）
+
+    pivot_bars / pivot_ts 依序為 X/A/B/C 轉折點在掃描序列中的 K線位置
+    （串流模式為暖機起算的 K線序號）與開盤時間，d_bar / d_ts 為 D 點（最新一根 K線）。
+    仍可用 signal["prz"] 的舊版字典方式存取。
+    """
+
+    __slots__ = ("symbol", "pattern", "timeframe", "venue", "pivot_bars", "pivot_ts",
+                 "d_bar", "d_ts", "prz", "sl", "tp1", "tp2", "tp3", "detected_at")
+
+    # 輸出到 JSONL / CSV / Parquet 的扁平欄位（時間皆為毫秒）
+    COLUMNS = ("symbol", "pattern", "timeframe", "venue",
+               "x_bar", "a_bar", "b_bar", "c_bar", "d_bar",
+               "x_ts", "a_ts", "b_ts", "c_ts", "d_ts",
+               "prz", "sl", "tp1", "tp2", "tp3", "detected_at")
+
+    def __init__(self, symbol: str, pattern: str, timeframe: str, pivot_bars: tuple,
+                 pivot_ts: tuple, d_bar: int, d_ts: int, prz: float, sl: float,
+                 tp1: float, tp2: float, tp3: float, detected_at: int = None,
+                 venue: str = DEFAULT_VENUE):
+        self.symbol = symbol
+        self.pattern = pattern
+        self.timeframe = timeframe
+        self.venue = venue
+        self.pivot_bars = tuple(int(i) for i in pivot_bars)
+        self.pivot_ts = tuple(int(ts) for ts in pivot_ts)
+        self.d_bar = int(d_bar)
+        self.d_ts = int(d_ts)
+        self.prz = float(prz)
+        self.sl = float(sl)
+        self.tp1 = float(tp1)
+        self.tp2 = float(tp2)
+        self.tp3 = float(tp3)
+        self.detected_at = int(time.time() * 1000) if detected_at is None else int(detected_at)
+
+    def __getitem__(self, key: str):
+        return getattr(self, key)
+
+    def __repr__(self) -> str:
+        return (f"Signal({self.venue}:{self.symbol}, {self.pattern}, {self.timeframe}, "
+                f"prz={self.prz:.8g})")
+
+    def to_row(self) -> dict:
+        """轉為扁平欄位字典（欄位順序同 COLUMNS）"""
+        return dict(zip(self.COLUMNS, (
+            self.symbol, self.pattern, self.timeframe, self.venue,
+            *self.pivot_bars, self.d_bar, *self.pivot_ts, self.d_ts,
+            self.prz, self.sl, self.tp1, self.tp2, self.tp3, self.detected_at,
+        )))
+
+
+class SignalSink:
+    """
+    信號輸出介面
+
+    write() 在信號產生時逐筆呼叫；flush() 於每個時間框架掃描結束時呼叫；
+    close() 於整次掃描（或串流）結束時呼叫。
+    """
+
+    def write(self, signal: Signal):
+        raise NotImplementedError
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.flush()
+
+
+class JsonlSignalSink(SignalSink):
+    """附加寫入 JSONL 檔，每個信號一行"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.file = open(path, "a", encoding="utf-8")
+
+    def write(self, signal: Signal):
+        self.file.write(json.dumps(signal.to_row(), ensure_ascii=False) + "\n")
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class CsvSignalSink(SignalSink):
+    """附加寫入 CSV 檔，新檔案時先寫入標題列"""
+
+    def __init__(self, path: str):
+        import csv
+
+        self.path = path
+        is_new = not os.path.exists(path) or os.path.getsize(path) == 0
+        self.file = open(path, "a", encoding="utf-8", newline="")
+        self.writer = csv.writer(self.file)
+        if is_new:
+            self.writer.writerow(Signal.COLUMNS)
+
+    def write(self, signal: Signal):
+        self.writer.writerow(signal.to_row().values())
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetSignalSink(SignalSink):
+    """
+    寫入 Parquet 資料集目錄（需要 pyarrow）
+
+    Parquet 檔案無法附加，因此每次開啟在目錄下建立一個新的 part 檔，
+    每次 flush() 或累積 row_group_size 筆時寫出一個 row group；
+    整個目錄可直接以 pandas.read_parquet 讀取。
+    """
+
+    def __init__(self, path: str, row_group_size: int = 4096):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        os.makedirs(path, exist_ok=True)
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S")
+        self.path = os.path.join(path, f"part-{stamp}-{os.getpid()}.parquet")
+        self.row_group_size = row_group_size
+        self.schema = pa.schema(
+            [(name, pa.string()) for name in Signal.COLUMNS[:4]]
+            + [(name, pa.int64()) for name in Signal.COLUMNS[4:14]]
+            + [(name, pa.float64()) for name in Signal.COLUMNS[14:19]]
+            + [("detected_at", pa.int64())]
+        )
+        self.writer = pq.ParquetWriter(self.path, self.schema)
+        self.rows = []
+
+    def write(self, signal: Signal):
+        self.rows.append(signal.to_row())
+        if len(self.rows) >= self.row_group_size:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        import pyarrow as pa
+
+        self.writer.write_table(pa.Table.from_pylist(self.rows, schema=self.schema))
+        self.rows = []
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+
+# 依路徑副檔名選擇輸出格式；可註冊其他 SignalSink 子類別
+SIGNAL_SINKS = {
+    ".jsonl": JsonlSignalSink,
+    ".csv": CsvSignalSink,
+    ".parquet": ParquetSignalSink,
+}
+
+
+class MultiSignalSink(SignalSink):
+    """同時輸出到多個 sink；單一 sink 失敗只記錄錯誤，不中斷掃描"""
+
+    def __init__(self, sinks: list):
+        self.sinks = sinks
+
+    def _each(self, method: str, *args):
+        for sink in self.sinks:
+            try:
+                getattr(sink, method)(*args)
+            except Exception as e:
+                _metrics.error("signal_sink")
+                logger.error(f"信號輸出 {sink.path} 失敗: {str(e)}")
+
+    def write(self, signal: Signal):
+        self._each("write", signal)
+
+    def flush(self):
+        self._each("flush")
+
+    def close(self):
+        self._each("close")
+
+
+def open_signal_sinks():
+    """依 CONFIG 開啟信號輸出，未設定任何路徑時返回 None"""
+    sinks = []
+    for path in CONFIG["signal_sink_paths"] or []:
+        sink_class = SIGNAL_SINKS.get(os.path.splitext(path.rstrip("/\\"))[1].lower())
+        if sink_class is None:
+            logger.warning(f"不支援的信號輸出格式: {path}（支援 {', '.join(SIGNAL_SINKS)}）")
+            continue
+        try:
+            sinks.append(sink_class(path))
+        except ImportError as e:
+            logger.warning(f"無法輸出 {path}，缺少套件: {e.name}（pip install pyarrow）")
+        except OSError as e:
+            logger.error(f"無法開啟信號輸出 {path}: {str(e)}")
+    return MultiSignalSink(sinks) if sinks else None
+
+
+def read_signals(path: str, columns: list = None) -> pd.DataFrame:
+    """
+    讀取信號輸出檔（JSONL、CSV 或 Parquet 目錄）
+
+    參數：
+        path: 輸出路徑，格式依副檔名判斷
+        columns: 只讀取的欄位（Parquet 只讀取指定欄位，其他格式讀取後篩選）
+
+    返回：
+        DataFrame，幣種 / 形態 / 時間框架 / 交易所為 category 型別
+    """
+    import pandas as pd
+
+    ext = os.path.splitext(path.rstrip("/\\"))[1].lower()
+    if ext == ".parquet":
+        df = pd.read_parquet(path, columns=columns)
+    elif ext == ".csv":
+        df = pd.read_csv(path, usecols=columns, dtype={"symbol": str})
+    elif ext == ".jsonl":
+        df = pd.read_json(path, lines=True, dtype={"symbol": str}, convert_dates=False)
+        if columns is not None:
+            df = df[columns]
+    else:
+        raise ValueError(f"不支援的信號輸出格式: {path}")
+
+    for column in ("symbol", "pattern", "timeframe", "venue"):
+        if column in df:
+            df[column] = df[column].astype("category")
+    return df
+
+# ============================================================================
+# 信號紀錄模組
+# ============================================================================
+
+class SignalStore:
+    """
+    已通知信號紀錄（SQLite）
+
+    以 (交易所, 幣種, 形態, 時間框架, XABC 轉折點時間) 識別同一個形態；
+    最後一次出現距今未超過 TTL 的信號不會重複通知，並保留歷史供查詢。
+    """
+
+    KEY = "venue, symbol, pattern, timeframe, x_ts, a_ts, b_ts, c_ts"
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS signals ("
+        " venue TEXT NOT NULL,"
+        " symbol TEXT NOT NULL, pattern TEXT NOT NULL, timeframe TEXT NOT NULL,"
+        " x_ts INTEGER NOT NULL, a_ts INTEGER NOT NULL,"
+        " b_ts INTEGER NOT NULL, c_ts INTEGER NOT NULL,"
+        " prz REAL, sl REAL, tp1 REAL, tp2 REAL, tp3 REAL,"
+        " first_seen REAL NOT NULL, last_seen REAL NOT NULL,"
+        f" PRIMARY KEY ({KEY}))"
+    )
+
+    def __init__(self, path: str, ttl_hours: float = 24, retention_days: float = 90):
+        self.path = path
+        self.ttl = ttl_hours * 3600
+        self.retention = retention_days * 86400
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self._migrate()
+        self.conn.execute(self.SCHEMA)
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_signals_symbol_seen ON signals (symbol, first_seen)"
+        )
+        self.purge()
+
+    def _migrate(self):
+        """舊版紀錄沒有交易所欄位：重建資料表，既有紀錄歸屬於預設交易所"""
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(signals)")]
+        if not columns or "venue" in columns:
+            return
+        legacy = ", ".join(columns)
+        with self.conn:
+            self.conn.execute("ALTER TABLE signals RENAME TO signals_legacy")
+            self.conn.execute(self.SCHEMA)
+            self.conn.execute(
+                f"INSERT INTO signals (venue, {legacy}) SELECT ?, {legacy} FROM signals_legacy",
+                (DEFAULT_VENUE,)
+            )
+            self.conn.execute("DROP TABLE signals_legacy")
+        logger.info(f"信號紀錄已升級為多交易所格式 | 既有紀錄歸屬: {venue_label(DEFAULT_VENUE)}")
+
+    @staticmethod
+    def _key(signal: Signal) -> tuple:
+        return (signal.venue, signal.symbol, signal.pattern, signal.timeframe, *signal.pivot_ts)
+
+    def filter_new(self, signals: list) -> list:
+        """
+        批次查詢 TTL 內已通知過的信號
+
+        參數：
+            signals: Signal 列表
+
+        返回：
+            尚未通知過的信號，順序與輸入一致
+        """
+        self.conn.execute(
+            "CREATE TEMP TABLE IF NOT EXISTS pending ("
+            " venue TEXT, symbol TEXT, pattern TEXT, timeframe TEXT,"
+            " x_ts INTEGER, a_ts INTEGER, b_ts INTEGER, c_ts INTEGER)"
+        )
+        self.conn.execute("DELETE FROM pending")
+        self.conn.executemany(
+            "INSERT INTO pending VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [self._key(signal) for signal in signals]
+        )
+        seen = set(self.conn.execute(
+            "SELECT s.venue, s.symbol, s.pattern, s.timeframe, s.x_ts, s.a_ts, s.b_ts, s.c_ts"
+            f" FROM pending p JOIN signals s USING ({self.KEY})"
+            " WHERE s.last_seen >= ?",
+            (time.time() - self.ttl,)
+        ).fetchall())
+        return [signal for signal in signals if self._key(signal) not in seen]
+
+    def record(self, signals: list):
+        """寫入本次出現的信號，已存在者只更新最後出現時間"""
+        now = time.time()
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO signals VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+                f" ON CONFLICT ({self.KEY})"
+                " DO UPDATE SET last_seen = excluded.last_seen",
+                [
+                    (*self._key(signal),
+                     signal.prz, signal.sl, signal.tp1, signal.tp2, signal.tp3,
+                     now, now)
+                    for signal in signals
+                ]
+            )
+
+    def history(self, symbol: str, days: float = 7, venue: str = None) -> list:
+        """查詢某幣種最近 days 天內首次出現的信號（新到舊），可指定交易所"""
+        rows = self.conn.execute(
+            "SELECT * FROM signals WHERE symbol = ? AND first_seen >= ?"
+            " AND (? IS NULL OR venue = ?) ORDER BY first_seen DESC",
+            (symbol, time.time() - days * 86400, venue, venue)
+        )
+        columns = [c[0] for c in rows.description]
+        return [dict(zip(columns, row)) for row in rows.fetchall()]
+
+    def purge(self):
+        """刪除超過保留天數的信號紀錄"""
+        with self.conn:
+            self.conn.execute(
+                "DELETE FROM signals WHERE last_seen < ?", (time.time() - self.retention,)
+            )
+
+    def close(self):
+        self.conn.close()
+
+
+def open_signal_store():
+    """依 CONFIG 開啟信號紀錄，未設定路徑時返回 None"""
+    if not CONFIG["signal_store_path"]:
+        return None
+    return SignalStore(
+        CONFIG["signal_store_path"],
+        ttl_hours=CONFIG["signal_ttl_hours"],
+        retention_days=CONFIG["signal_retention_days"]
+    )
+
+# ============================================================================
+# 谐波形態掃描主函數
+# ============================================================================
+
+def _detect_chunk(high: np.ndarray, low: np.ndarray, lengths: np.ndarray,
+                  order: int, pivot_options: dict) -> tuple:
+    """
+    進程池工作函數：檢測一組幣種的轉折點並組合 XABCD 價格
+
+    參數：
+        pivot_options: detect_pivots_batch 的 tie / mode / pct（由主進程傳入，不依賴子進程的 CONFIG）
+
+    返回：
+        元組：((幣種數, 5) 價格矩陣, (幣種數, 4) XABC 轉折點 K線位置)，
+        轉折點不足或發生錯誤的幣種為 NaN / -1
+    """
+    pivots = np.full((len(lengths), 5), np.nan)
+    bars = np.full((len(lengths), 4), -1, dtype=np.int64)
+    detected = detect_pivots_batch(high, low, lengths, order, **pivot_options)
+    for i, n in enumerate(lengths):
+        try:
+            pivot_idx, pivot_price = detected[i]
+            if len(pivot_price) >= 4:
+                pivots[i], _ = current_pattern(pivot_price, low[i, :n])
+                bars[i] = pivot_idx[-4:]
+        except Exception:
+            pass
+    return pivots, bars
+
+
+def _detect_patterns_parallel(panel: CandlePanel, order: int, workers: int) -> tuple:
+    """
+    將幣種切分成區塊，以進程池平行檢測轉折點
+
+    每個區塊只傳送 High/Low 陣列與長度，結果依區塊順序寫回，輸出與單進程一致。
+
+    返回：
+        元組：((幣種數, 5) XABCD 價格矩陣, (幣種數, 4) XABC 轉折點 K線位置, (幣種數, 4) XABC 轉折點時間)
+    """
+    total_coins = len(panel)
+    chunk_size = max(1, -(-total_coins // (workers * 4)))
+    bounds = [(i, min(i + chunk_size, total_coins)) for i in range(0, total_coins, chunk_size)]
+    pivots = np.full((total_coins, 5), np.nan)
+    bars = np.full((total_coins, 4), -1, dtype=np.int64)
+    pivot_options = {
+        "tie": CONFIG["pivot_tie_break"],
+        "mode": CONFIG["pivot_mode"],
+        "pct": CONFIG["zigzag_pct"],
     }
 
-    results = {name: [] for name in pattern_functions.keys()}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(
+                _detect_chunk,
+                np.ascontiguousarray(panel.high[start:stop]),
+                np.ascontiguousarray(panel.low[start:stop]),
+                np.asarray(panel.lengths[start:stop]),
+                order,
+                pivot_options
+            )
+            for start, stop in bounds
+        ]
+
+        progress_interval = max(1, len(bounds) // 10)
+        for n, ((start, stop), future) in enumerate(zip(bounds, futures), start=1):
+            pivots[start:stop], bars[start:stop] = future.result()
+
+            # 顯示掃描進度
+            if n % progress_interval == 0 or n == len(bounds):
+                progress = stop / total_coins * 100
+                logger.info(f"形態掃描進度: {stop}/{total_coins} ({progress:.0f}%)")
+
+    rows = np.arange(total_coins)[:, None]
+    pivot_ts = np.where(bars >= 0, panel.timestamps[rows, np.maximum(bars, 0)], -1)
+    return pivots, bars, pivot_ts
+
+
+def scan_harmonic_patterns(data, order: int = 10,
+                           send_notifications: bool = True,
+                           trackers: dict = None,
+                           workers: int = 1,
+                           timeframe: str = None,
+                           signal_store: "SignalStore" = None,
+                           sink: SignalSink = None,
+                           venue: str = DEFAULT_VENUE) -> dict:
+    """
+    掃描所有谐波形態
+
+    參數：
+        data: OHLCV 數據（CandlePanel 或舊版長格式 DataFrame）
+        order: 峰值檢測靈敏度
+        send_notifications: 是否發送 Discord 通知
+        trackers: {幣種: PivotTracker}，提供時跨次掃描保留轉折點狀態，只處理新 K線（僅 window 模式）
+        workers: 平行進程數，大於 1 時以進程池檢測轉折點（不使用 trackers）
+        timeframe: 數據的時間框架，會標記在信號與通知中（預設為 harmonic_timeframe）
+        signal_store: 信號紀錄，提供時只通知 TTL 內未通知過的形態
+        sink: 信號輸出，每個信號產生時即寫入（不經過去重）
+        venue: 數據來源交易所，會標記在信號與通知中
+
+    返回：
+        {形態名稱: [Signal, ...]}
+    """
+    timeframe = timeframe or CONFIG["harmonic_timeframe"]
+    label = venue_label(venue)
+    logger.info(f"[{label}] 開始谐波形態掃描... | 時間框架: {timeframe}")
+
+    panel = data if isinstance(data, CandlePanel) else CandlePanel.from_frame(data)
+    coins = panel.symbols
+
+    results = {name: [] for name in PATTERN_NAMES}
     signal_count = 0
     total_coins = len(coins)
     progress_interval = max(1, total_coins // 10)
 
-    for idx, coin in enumerate(coins):
-        try:
-            data_coin = data[data['Symbol'] == coin]
-            _, current_pat, _, _, moves, _, _, _, symbol = peak_detect(
-                data_coin, order=order
+    # 轉折點不足 4 個的幣種保持 NaN，批次評估時自動不符合
+    pivots = np.full((total_coins, 5), np.nan)
+    pivot_bars = np.full((total_coins, 4), -1, dtype=np.int64)
+    pivot_ts = np.full((total_coins, 4), -1, dtype=np.int64)
+
+    with _metrics.stage("pivot_detect"):
+        if workers > 1:
+            pivots, pivot_bars, pivot_ts = _detect_patterns_parallel(panel, order, workers)
+        else:
+            # 不保留狀態時，整個面板以一次批次運算檢測轉折點
+            detected = None
+            if trackers is None:
+                detected = detect_pivots_batch(panel.high, panel.low, panel.lengths, order)
+
+            for idx, coin in enumerate(coins):
+                try:
+                    series = panel.series(coin)
+
+                    if trackers is not None:
+                        tracker = trackers.get(coin)
+                        tie = CONFIG["pivot_tie_break"]
+                        if tracker is None or tracker.order != order or tracker.tie != tie:
+                            tracker = trackers[coin] = PivotTracker(order=order, tie=tie)
+                        tracker.sync(series["timestamps"], series["high"], series["low"])
+
+                        pattern = tracker.current_pattern()
+                        if pattern is not None:
+                            # 追蹤器跨掃描保留轉折點；早於本次面板視窗者無法對應到 K線位置，
+                            # 逐一檢測同一視窗也找不到，因此不評估（視為轉折點不足）
+                            window = series["timestamps"]
+                            ts = np.array([t for _, t, _ in tracker.recent_pivots(4)], dtype=np.int64)
+                            bars = np.searchsorted(window, ts)
+                            if bars[-1] < len(window) and np.array_equal(window[bars], ts):
+                                pivots[idx], _ = pattern
+                                pivot_ts[idx] = ts
+                                pivot_bars[idx] = bars
+                    else:
+                        pivot_idx, pivot_price = detected[idx]
+
+                        if len(pivot_price) >= 4:
+                            pivots[idx], _ = current_pattern(pivot_price, series["low"])
+                            pivot_bars[idx] = pivot_idx[-4:]
+                            pivot_ts[idx] = series["timestamps"][pivot_bars[idx]]
+
+                except Exception as e:
+                    _metrics.error("pivot_detect")
+                    if CONFIG["verbose"]:
+                        logger.debug(f"掃描 {coin} 時發生錯誤: {str(e)}")
+
+                # 顯示掃描進度
+                if (idx + 1) % progress_interval == 0 or (idx + 1) == total_coins:
+                    progress = (idx + 1) / total_coins * 100
+                    logger.info(f"形態掃描進度: {idx + 1}/{total_coins} ({progress:.0f}%)")
+
+    insufficient = int(np.isnan(pivots[:, 0]).sum())
+    if insufficient:
+        _metrics.skip("insufficient_pivots", insufficient)
+
+    with _metrics.stage("pattern_eval"):
+        matches = evaluate_patterns(np.diff(pivots, axis=1), pivots)
+
+        # 依幣種、形態順序輸出信號
+        found = []
+        last_bar = np.asarray(panel.lengths) - 1
+        for idx, p in zip(*np.nonzero(matches["mask"].T)):
+            pattern_name = PATTERN_NAMES[p]
+            signal = Signal(
+                symbol=display_symbol(coins[idx]),
+                pattern=pattern_name,
+                timeframe=timeframe,
+                pivot_bars=pivot_bars[idx],
+                pivot_ts=pivot_ts[idx],
+                d_bar=last_bar[idx],
+                d_ts=panel.timestamps[idx, last_bar[idx]],
+                venue=venue,
+                **{key: matches[key][p, idx] for key in ("prz", "sl", "tp1", "tp2", "tp3")}
             )
 
-            for pattern_name, pattern_func in pattern_functions.items():
-                result = pattern_func(moves, symbol, current_pat)
-
-                if result:
-                    symbol_name, prz, sl, tp1, tp2, tp3 = result
-                    results[pattern_name].append({
-                        "symbol": symbol_name,
-                        "prz": prz,
-                        "sl": sl,
-                        "tp1": tp1,
-                        "tp2": tp2,
-                        "tp3": tp3,
-                    })
-                    signal_count += 1
-
-                    logger.info(f"發現信號: {symbol_name} | {pattern_name}")
-
-                    if send_notifications:
-                        send_harmonic_signal(
-                            pattern_name, symbol_name, prz, sl, tp1, tp2, tp3, timeframe
-                        )
-                        time.sleep(0.5)  # 避免 Discord 速率限制
+            results[pattern_name].append(signal)
+            found.append(signal)
+            signal_count += 1
+            if sink is not None:
+                sink.write(signal)
 
-        except Exception as e:
-            if CONFIG["verbose"]:
-                logger.debug(f"掃描 {coin} 時發生錯誤: {str(e)}")
+            logger.info(f"發現信號: {label} | {signal.symbol} | {pattern_name} | {timeframe}")
+
+    if sink is not None:
+        sink.flush()
 
-        # 顯示掃描進度
-        if (idx + 1) % progress_interval == 0 or (idx + 1) == total_coins:
-            progress = (idx + 1) / total_coins * 100
-            logger.info(f"形態掃描進度: {idx + 1}/{total_coins} ({progress:.0f}%)")
+    # 只通知 TTL 內尚未通知過的形態
+    new_signals = found
+    if signal_store is not None and found:
+        with _metrics.stage("signal_dedupe"):
+            new_signals = signal_store.filter_new(found)
+            signal_store.record(found)
+        _metrics.skip("duplicate_signal", len(found) - len(new_signals))
+        logger.info(f"信號去重 | 新信號: {len(new_signals)} | 重複: {len(found) - len(new_signals)}")
 
-    logger.info(f"谐波形態掃描完成 | 發現 {signal_count} 個信號")
+    if send_notifications:
+        with _metrics.stage("notify"):
+            for signal in new_signals:
+                send_harmonic_signal(
+                    signal.pattern, signal.symbol, signal.prz, signal.sl,
+                    signal.tp1, signal.tp2, signal.tp3, timeframe, venue
+                )
+
+    logger.info(f"[{label}] 谐波形態掃描完成 | {timeframe} | 發現 {signal_count} 個信號")
 
     return results
 
+# ============================================================================
+# 歷史形態搜尋模組
+# ============================================================================
+
+# 歷史形態紀錄：幣種與形態為面板 / PATTERN_NAMES 的索引，bars 與 timestamps 依序為 X/A/B/C/D
+PATTERN_HISTORY_DTYPE = np.dtype([
+    ("symbol", np.int32),
+    ("pattern", np.int8),
+    ("bars", np.int64, (5,)),
+    ("timestamps", np.int64, (5,)),
+    ("prz", np.float64),
+    ("sl", np.float64),
+    ("tp1", np.float64),
+    ("tp2", np.float64),
+    ("tp3", np.float64),
+])
+
+
+def find_historical_patterns(data, order: int = 10) -> np.ndarray:
+    """
+    搜尋每個幣種轉折點歷史中所有連續 5 點（XABCD）窗口的谐波形態
+
+    每個幣種的轉折點以 sliding_window_view 建立窗口視圖，
+    所有幣種的窗口合併後一次交給 evaluate_patterns 評估。
+
+    參數：
+        data: OHLCV 數據（CandlePanel 或舊版長格式 DataFrame）
+        order: 峰值檢測靈敏度
+
+    返回：
+        PATTERN_HISTORY_DTYPE 結構化陣列，依幣種、D 點時間排序
+    """
+    panel = data if isinstance(data, CandlePanel) else CandlePanel.from_frame(data)
+
+    window_bars = []
+    window_prices = []
+    window_symbols = []
+
+    detected = detect_pivots_batch(panel.high, panel.low, panel.lengths, order)
+    for idx, (pivot_idx, pivot_price) in enumerate(detected):
+        if len(pivot_idx) < 5:
+            continue
+
+        window_bars.append(sliding_window_view(pivot_idx, 5))
+        window_prices.append(sliding_window_view(pivot_price, 5))
+        window_symbols.append(np.full(len(pivot_idx) - 4, idx, dtype=np.int32))
+
+    if not window_bars:
+        return np.empty(0, dtype=PATTERN_HISTORY_DTYPE)
+
+    bars = np.concatenate(window_bars)
+    prices = np.concatenate(window_prices)
+    symbols = np.concatenate(window_symbols)
+
+    matches = evaluate_patterns(np.diff(prices, axis=1), prices)
+    window, pattern = np.nonzero(matches["mask"].T)
+
+    history = np.empty(len(window), dtype=PATTERN_HISTORY_DTYPE)
+    history["symbol"] = symbols[window]
+    history["pattern"] = pattern
+    history["bars"] = bars[window]
+    history["timestamps"] = panel.timestamps[symbols[window][:, None], bars[window]]
+    for key in ("prz", "sl", "tp1", "tp2", "tp3"):
+        history[key] = matches[key][pattern, window]
+
+    logger.info(f"歷史形態搜尋完成 | 窗口: {len(bars)} | 符合: {len(history)}")
+
+    return history
+
+# ============================================================================
+# 回測模組
+# ============================================================================
+
+# 回測交易紀錄：各 K線位置為面板中的索引，未發生為 -1；r 為各 TP 目標的 R 倍數
+BACKTEST_TRADE_DTYPE = np.dtype([
+    ("symbol", np.int32),
+    ("pattern", np.int8),
+    ("signal_bar", np.int64),
+    ("fill_bar", np.int64),
+    ("sl_bar", np.int64),
+    ("tp_bars", np.int64, (3,)),
+    ("r", np.float64, (3,)),
+])
+
+
+def _first_true(mask: np.ndarray) -> np.ndarray:
+    """每列第一個 True 的位置，沒有則為 -1"""
+    first = np.argmax(mask, axis=1)
+    return np.where(mask[np.arange(len(mask)), first], first, -1)
+
+
+def _simulate_trades(panel: CandlePanel, history: np.ndarray, start: np.ndarray,
+                     max_hold: int) -> np.ndarray:
+    """
+    以向量化首次觸及搜尋模擬一批信號
+
+    參數：
+        history: PATTERN_HISTORY_DTYPE 信號
+        start: 每個信號開始觀察的 K線位置
+        max_hold: 最多觀察的 K線數量
+    """
+    n = len(history)
+    symbols = history["symbol"]
+    offsets = np.arange(max_hold)
+    bars = start[:, None] + offsets
+    inside = bars < panel.lengths[symbols][:, None]
+    bars = np.minimum(bars, panel.lengths[symbols][:, None] - 1)
+
+    high = np.where(inside, panel.high[symbols[:, None], bars], np.nan)
+    low = np.where(inside, panel.low[symbols[:, None], bars], np.nan)
+    close = panel.close[symbols[:, None], bars]
+
+    direction = np.array(
+        [PATTERN_TABLE[name]["direction"] for name in PATTERN_NAMES]
+    )[history["pattern"]][:, None]
+    prz = history["prz"][:, None]
+    sl = history["sl"][:, None]
+
+    # 看漲：價格回落至 PRZ 成交，跌破 SL 止損、漲至 TP 獲利；看跌相反
+    favorable = np.where(direction > 0, high, -low)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        fill = _first_true(np.where(direction > 0, low <= prz, high >= prz))
+        after_fill = (fill[:, None] >= 0) & (offsets >= fill[:, None])
+        sl_first = _first_true(after_fill & np.where(direction > 0, low <= sl, high >= sl))
+
+        trades = np.empty(n, dtype=BACKTEST_TRADE_DTYPE)
+        trades["symbol"] = symbols
+        trades["pattern"] = history["pattern"]
+        trades["signal_bar"] = start
+        trades["fill_bar"] = np.where(fill >= 0, start + fill, -1)
+        trades["sl_bar"] = np.where(sl_first >= 0, start + sl_first, -1)
+
+        # PRZ 與 SL 相同的退化信號沒有風險基準，R 倍數為 NaN
+        risk = np.abs(history["prz"] - history["sl"])
+        risk = np.where(risk > 0, risk, np.nan)
+        last = np.clip(inside.sum(axis=1) - 1, 0, None)
+        exit_price = close[np.arange(n), last]
+        open_r = (exit_price - history["prz"]) * direction[:, 0] / risk
+
+        for k in range(3):
+            tp = history[f"tp{k + 1}"][:, None]
+            tp_first = _first_true(after_fill & (favorable >= tp * direction))
+            # 同一根 K線同時觸及 SL 與 TP 時保守視為止損
+            win = (tp_first >= 0) & ((sl_first < 0) | (tp_first < sl_first))
+            loss = (sl_first >= 0) & ~win
+
+            trades["tp_bars"][:, k] = np.where(win, start + tp_first, -1)
+            trades["r"][:, k] = np.select(
+                [(fill < 0) | np.isnan(risk), win, loss],
+                [np.nan, np.abs(history[f"tp{k + 1}"] - history["prz"]) / risk, -1.0],
+                default=open_r
+            )
+
+    return trades
+
+
+def backtest_patterns(data, order: int = 10, max_hold: int = 200,
+                      chunk_size: int = 4096) -> tuple:
+    """
+    回測歷史形態的 PRZ / SL / TP 成效
+
+    找出所有歷史形態後，自 D 點確認（D 點後 order 根）的下一根 K線開始，
+    以向量化首次觸及搜尋判斷 PRZ 是否成交，以及成交後 SL 或各 TP 何者先觸及。
+    信號分批處理以限制記憶體，面板可使用記憶體映射數據。
+
+    參數：
+        data: OHLCV 數據（CandlePanel 或舊版長格式 DataFrame）
+        order: 峰值檢測靈敏度
+        max_hold: 成交前後最多觀察的 K線數量
+        chunk_size: 每批模擬的信號數量
+
+    返回：
+        元組：(BACKTEST_TRADE_DTYPE 交易紀錄, 各形態統計 DataFrame)
+    """
+    import pandas as pd
+
+    panel = data if isinstance(data, CandlePanel) else CandlePanel.from_frame(data)
+    history = find_historical_patterns(panel, order=order)
+
+    start = history["bars"][:, 4] + order + 1
+    tradable = start < panel.lengths[history["symbol"]]
+    # PRZ 與 SL 相同的退化信號無法計算 R 倍數，不納入回測
+    degenerate = history["prz"] == history["sl"]
+    if degenerate.any():
+        _metrics.skip("zero_risk", int(degenerate.sum()))
+    tradable &= ~degenerate
+    history, start = history[tradable], start[tradable]
+
+    trades = np.concatenate([
+        _simulate_trades(panel, history[i:i + chunk_size], start[i:i + chunk_size], max_hold)
+        for i in range(0, len(history), chunk_size)
+    ]) if len(history) else np.empty(0, dtype=BACKTEST_TRADE_DTYPE)
+
+    rows = []
+    for p, pattern_name in enumerate(PATTERN_NAMES):
+        t = trades[trades["pattern"] == p]
+        filled = t[t["fill_bar"] >= 0]
+        row = {
+            "形態": pattern_name,
+            "信號數": len(t),
+            "成交率": len(filled) / len(t) if len(t) else np.nan,
+            "止損率": np.mean((filled["sl_bar"] >= 0) & (filled["tp_bars"][:, 0] < 0))
+            if len(filled) else np.nan,
+        }
+        for k in range(3):
+            hit = filled["tp_bars"][:, k] >= 0
+            row[f"TP{k + 1}命中率"] = hit.mean() if len(filled) else np.nan
+            row[f"TP{k + 1}平均R"] = filled["r"][:, k].mean() if len(filled) else np.nan
+            row[f"TP{k + 1}平均K線"] = (
+                (filled["tp_bars"][hit, k] - filled["fill_bar"][hit]).mean() if hit.any() else np.nan
+            )
+        rows.append(row)
+
+    summary = pd.DataFrame(rows).set_index("形態")
+    logger.info(f"回測完成 | 信號: {len(trades)} | 成交: {int((trades['fill_bar'] >= 0).sum())}")
+
+    return trades, summary
+
+
+def run_backtest(source: str, max_hold: int = 200):
+    """
+    對本地歷史數據執行回測並輸出統計
+
+    參數：
+        source: CandlePanel 目錄（以記憶體映射讀取）或 K線快取 .db 檔
+        max_hold: 最多觀察的 K線數量
+    """
+    timeframe = CONFIG["harmonic_timeframe"]
+    if not source.endswith(".db"):
+        return _backtest_panel(CandlePanel.load(source), timeframe, max_hold)
+
+    # .db 逐一幣種串流寫入暫存的記憶體映射面板，回測結束後刪除
+    import tempfile
+
+    with tempfile.TemporaryDirectory(prefix="backtest-", dir=os.path.dirname(os.path.abspath(source))) as path:
+        store = CandleStore(source)
+        try:
+            panel = store.load_panel(timeframe, path=path)
+        finally:
+            store.close()
+        summary = _backtest_panel(panel, timeframe, max_hold)
+        del panel
+    return summary
+
+
+def _backtest_panel(panel: CandlePanel, timeframe: str, max_hold: int):
+    """回測單一面板並輸出統計"""
+    logger.info(f"開始回測 | 幣種: {len(panel)} | 時間框架: {timeframe}")
+
+    _, summary = backtest_patterns(
+        panel,
+        order=CONFIG["timeframe_peak_orders"].get(timeframe, CONFIG["peak_order"]),
+        max_hold=max_hold
+    )
+    print(summary.to_string(float_format=lambda x: f"{x:.3f}"))
+
+    return summary
+
 # ============================================================================
 # 主掃描函數
 # ============================================================================
 
-def run_scan(send_notifications: bool = True):
+# 定時掃描之間保留的轉折點追蹤器：{(交易所, 時間框架): {幣種: PivotTracker}}
+_pivot_trackers = {}
+
+
+def get_scan_timeframes() -> list:
+    """返回要掃描的時間框架，依週期由小到大排序（第一個為抓取的基礎週期）"""
+    timeframes = CONFIG["scan_timeframes"] or [CONFIG["harmonic_timeframe"]]
+    return sorted(dict.fromkeys(timeframes), key=timeframe_to_ms)
+
+
+def base_fetch_limit(timeframes: list, log: bool = True) -> int:
+    """
+    計算基礎週期需要抓取的 K線數量，使每個時間框架都能重採樣出 limit 根 K線
+
+    受 max_fetch_limit 限制，超出時較大週期的 K線數會相應減少。
+    超過交易所單次請求上限的部分由 collect_panel 分頁抓取。
+    """
+    base_ms = timeframe_to_ms(timeframes[0])
+    needed = max(CONFIG["limit"] * (timeframe_to_ms(tf) // base_ms) for tf in timeframes)
+    if needed > CONFIG["max_fetch_limit"] and log:
+        logger.info(
+            f"基礎週期 {timeframes[0]} 需要 {needed} 根 K線，"
+            f"受 max_fetch_limit 限制為 {CONFIG['max_fetch_limit']} 根"
+        )
+    return min(needed, CONFIG["max_fetch_limit"])
+
+
+def store_keep_limit(timeframe: str) -> int:
+    """K線快取中 timeframe 至少保留的數量：為掃描的基礎週期時取全部掃描時間框架所需的抓取量"""
+    timeframes = get_scan_timeframes()
+    return base_fetch_limit(timeframes, log=False) if timeframes[0] == timeframe else 0
+
+
+def _collect_venue(venue: str, timeframe: str, limit: int, ready: queue.Queue):
+    """
+    工作執行緒：收集單一交易所的 K線
+
+    依流動性分批（priority_symbols），每完成一批即放入 ready 佇列交由主執行緒掃描，
+    結束時（包含失敗）放入 (交易所, None)。各交易所使用各自的客戶端與速率限制器，
+    因此整次掃描的抓取時間約等於最慢的單一交易所。
+    """
+    label = venue_label(venue)
+    try:
+        with _metrics.stage(f"collect_{venue}"):
+            symbols = select_symbols(venue)
+            priority = CONFIG["priority_symbols"]
+            batches = (
+                [symbols[:priority], symbols[priority:]] if 0 < priority < len(symbols)
+                else [symbols]
+            )
+
+            for batch_idx, batch in enumerate(batches, start=1):
+                if len(batches) > 1:
+                    logger.info(f"[{label}] 掃描批次 {batch_idx}/{len(batches)} | 交易對: {len(batch)}")
+                ready.put((venue, collect_panel(timeframe, limit, symbols=batch, venue=venue)))
+    except Exception as e:
+        _metrics.error("collect")
+        logger.error(f"[{label}] 數據收集失敗: {str(e)}")
+    finally:
+        ready.put((venue, None))
+
+
+def run_scan(send_notifications: bool = True, timeframes: list = None):
     """
     執行諧波形態掃描
 
     參數：
         send_notifications: 是否發送 Discord 通知
+        timeframes: 本次要掃描的時間框架（例如剛收盤的週期）；None 則為全部
     """
     logger.info("=" * 60)
     logger.info("開始諧波形態掃描")
     logger.info("=" * 60)
 
     start_time = time.time()
-
-    # 收集數據
-    data = collect_data(
-        timeframe=CONFIG["harmonic_timeframe"],
-        limit=CONFIG["limit"]
-    )
-
-    # 執行谐波形態掃描
-    harmonic_results = {}
-    harmonic_count = 0
-    if not data.empty:
-        harmonic_results = scan_harmonic_patterns(
-            data,
-            order=CONFIG["peak_order"],
-            send_notifications=send_notifications
+    _metrics.start_cycle()
+
+    timeframes = sorted(timeframes or get_scan_timeframes(), key=timeframe_to_ms)
+    # 抓取量依全部設定的時間框架計算：只有 1h 收盤時也抓取足夠重採樣 4h / 1d 的 K線，
+    # 使共用的 K線快取維持完整的掃描視窗
+    configured = sorted(set(get_scan_timeframes()) | set(timeframes), key=timeframe_to_ms)
+    base_timeframe = configured[0]
+    limit = base_fetch_limit(configured)
+    venues = get_venues()
+
+    # 各交易所並行收集（只抓取最小週期），主執行緒依完成順序重採樣、掃描與通知
+    ready = queue.Queue()
+    workers = [
+        threading.Thread(
+            target=_collect_venue, args=(venue, base_timeframe, limit, ready),
+            name=f"collect-{venue}", daemon=True
         )
-        harmonic_count = sum(len(v) for v in harmonic_results.values())
+        for venue in venues
+    ]
+    for worker in workers:
+        worker.start()
+    if len(venues) > 1:
+        logger.info(f"並行掃描交易所: {', '.join(venue_label(venue) for venue in venues)}")
+
+    harmonic_results = {name: [] for name in PATTERN_NAMES}
+    venue_counts = dict.fromkeys(venues, 0)
+    venue_symbols = dict.fromkeys(venues, 0)
+    harmonic_count = 0
+    signal_store = open_signal_store()
+    sink = open_signal_sinks()
+    try:
+        remaining = len(workers)
+        while remaining:
+            venue, data = ready.get()
+            if data is None:
+                remaining -= 1
+                continue
+            venue_symbols[venue] += len(data)
+
+            # 執行谐波形態掃描：較大週期在本地重採樣
+            for timeframe in timeframes if not data.empty else []:
+                try:
+                    with _metrics.stage("resample"):
+                        panel = data.resample(base_timeframe, timeframe)
+                except Exception as e:
+                    _metrics.error("resample")
+                    logger.error(f"[{venue_label(venue)}] 重採樣 {timeframe} 失敗: {str(e)}")
+                    continue
+
+                trackers = None
+                if (CONFIG["incremental_pivots"] and CONFIG["scan_workers"] <= 1
+                        and CONFIG["pivot_mode"] == "window"):
+                    trackers = _pivot_trackers.setdefault((venue, timeframe), {})
+
+                results = scan_harmonic_patterns(
+                    panel,
+                    order=CONFIG["timeframe_peak_orders"].get(timeframe, CONFIG["peak_order"]),
+                    send_notifications=send_notifications,
+                    trackers=trackers,
+                    workers=CONFIG["scan_workers"],
+                    timeframe=timeframe,
+                    signal_store=signal_store,
+                    sink=sink,
+                    venue=venue
+                )
+                for pattern_name, signals in results.items():
+                    harmonic_results[pattern_name].extend(signals)
+                    venue_counts[venue] += len(signals)
+    finally:
+        if signal_store:
+            signal_store.close()
+        if sink:
+            sink.close()
+
+    harmonic_count = sum(len(v) for v in harmonic_results.values())
+
+    # 發送掃描摘要（分片掃描改由 merge 命令合併後發送），並等待背景佇列中的通知全部送出
+    shard = CONFIG["shard"]
+    if send_notifications:
+        if not shard:
+            send_scan_summary(
+                harmonic_count, ", ".join(timeframes), venue_counts if len(venues) > 1 else None
+            )
+        if _dispatcher is not None:
+            with _metrics.stage("notify_flush"):
+                _dispatcher.flush(timeout=CONFIG["notify_flush_timeout"])
 
     elapsed_time = time.time() - start_time
+    _metrics.finish_cycle(elapsed_time, harmonic_count, timeframes)
 
-    # 發送掃描摘要
-    if send_notifications:
-        send_scan_summary(harmonic_count, CONFIG["harmonic_timeframe"])
+    if shard:
+        try:
+            path = write_shard_result(
+                shard, scan_cycle_id(base_timeframe, start_time), timeframes,
+                harmonic_results, venue_counts, venue_symbols, elapsed_time
+            )
+            logger.info(f"分片 {shard[0]}/{shard[1]} 結果已寫入 {path}")
+        except OSError as e:
+            _metrics.error("shard_spool")
+            logger.error(f"寫入分片結果失敗：{str(e)}")
 
     logger.info("=" * 60)
     logger.info(f"掃描完成 | 耗時: {elapsed_time:.2f} 秒")
     logger.info(f"諧波形態: {harmonic_count} 個信號")
+    if len(venues) > 1:
+        logger.info(" | ".join(
+            f"{venue_label(venue)}: {count} 個信號" for venue, count in venue_counts.items()
+        ))
     logger.info("=" * 60)
 
     return {
         "harmonic": harmonic_results,
+        "venues": venue_counts,
         "elapsed_time": elapsed_time,
     }
 
+# ============================================================================
+# 分片掃描模組
+# ============================================================================
+
+def parse_shard(text: str) -> tuple:
+    """解析 "i/n" 分片參數（1 ≤ i ≤ n），格式錯誤引發 ValueError"""
+    try:
+        index, count = (int(part) for part in text.split("/"))
+    except ValueError:
+        raise ValueError(f"分片格式應為 i/n（例如 2/8）: {text}") from None
+    if not 1 <= index <= count:
+        raise ValueError(f"分片編號需介於 1 與 {count} 之間: {text}")
+    return index, count
+
+
+def shard_index(symbol: str, shards: int) -> int:
+    """交易對所屬的分片（0 起）：CRC32 不受 PYTHONHASHSEED 影響，各進程與主機的結果一致"""
+    return zlib.crc32(symbol.encode("utf-8")) % shards
+
+
+def shard_symbols(symbols: list, shard: tuple) -> list:
+    """只保留屬於分片 (i, n) 的交易對（維持原順序）"""
+    index, count = shard
+    return [symbol for symbol in symbols if shard_index(symbol, count) == index - 1]
+
+
+def scan_cycle_id(timeframe: str, at: float = None) -> str:
+    """
+    掃描週期代號：基礎週期最近一次收盤的 UTC 時間（例如 20240101T0400Z）
+
+    同一根 K線收盤後啟動的各分片得到相同代號，作為 spool 子目錄名稱。
+    """
+    close = last_close_ms(timeframe, None if at is None else at * 1000)
+    return datetime.fromtimestamp(close / 1000, timezone.utc).strftime("%Y%m%dT%H%MZ")
+
+
+def _write_json_atomic(path: str, payload: dict):
+    """先寫入暫存檔再改名，讀取端不會讀到寫到一半的檔案"""
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(payload, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def write_shard_result(shard: tuple, cycle: str, timeframes: list, harmonic_results: dict,
+                       venue_counts: dict, venue_symbols: dict, elapsed: float) -> str:
+    """
+    將本分片的掃描結果寫入 <shard_spool_path>/<週期代號>/shard-<i>-of-<n>.json
+
+    返回：
+        寫入的檔案路徑
+    """
+    import socket
+
+    index, count = shard
+    directory = os.path.join(CONFIG["shard_spool_path"], cycle)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"shard-{index:03d}-of-{count:03d}.json")
+    signals = [signal.to_row() for found in harmonic_results.values() for signal in found]
+    _write_json_atomic(path, {
+        "cycle": cycle,
+        "shard": [index, count],
+        "host": socket.gethostname(),
+        "timeframes": list(timeframes),
+        "elapsed": elapsed,
+        "finished_at": int(time.time() * 1000),
+        "venues": venue_counts,
+        "symbols": venue_symbols,
+        "signals": signals,
+    })
+    return path
+
+
+def _load_shard_results(directory: str) -> list:
+    parts = []
+    for name in sorted(os.listdir(directory)):
+        if name.startswith("shard-") and name.endswith(".json"):
+            with open(os.path.join(directory, name), encoding="utf-8") as f:
+                parts.append(json.load(f))
+    return parts
+
+
+def merge_shards(cycle: str = None, wait: float = 0, send_notifications: bool = True) -> dict:
+    """
+    合併同一次掃描各分片的結果，並以 send_scan_summary 發送一則摘要
+
+    參數：
+        cycle: 週期代號（spool 子目錄）；None 則為最新一次
+        wait: 等待所有分片到齊的最長秒數；逾時則以已到齊的分片合併並標示缺少的分片
+        send_notifications: 是否發送 Discord 摘要
+
+    合併結果寫入同目錄的 merged.json，重複執行不會再次發送摘要。
+
+    返回：
+        合併結果 dict；沒有任何分片結果時為 None
+    """
+    spool = CONFIG["shard_spool_path"]
+    if cycle is None:
+        cycles = sorted(
+            name for name in (os.listdir(spool) if os.path.isdir(spool) else [])
+            if os.path.isdir(os.path.join(spool, name))
+        )
+        if not cycles:
+            logger.error(f"{spool} 中沒有分片掃描結果")
+            return None
+        cycle = cycles[-1]
+
+    directory = os.path.join(spool, cycle)
+    marker = os.path.join(directory, "merged.json")
+    if os.path.exists(marker):
+        logger.info(f"掃描 {cycle} 已合併，不重複發送摘要")
+        with open(marker, encoding="utf-8") as f:
+            return json.load(f)
+
+    deadline = time.time() + wait
+    while True:
+        parts = _load_shard_results(directory) if os.path.isdir(directory) else []
+        count = max((part["shard"][1] for part in parts), default=0)
+        if (parts and len(parts) >= count) or time.time() >= deadline:
+            break
+        time.sleep(min(5.0, max(0.0, deadline - time.time())))
+
+    if not parts:
+        logger.error(f"掃描 {cycle} 沒有任何分片結果")
+        return None
+
+    received = sorted(part["shard"][0] for part in parts)
+    missing = sorted(set(range(1, count + 1)) - set(received))
+    if missing:
+        logger.warning(f"掃描 {cycle} 缺少分片: {', '.join(map(str, missing))}")
+
+    venue_counts, venue_symbols, patterns = {}, {}, {}
+    timeframes = []
+    for part in parts:
+        for venue, value in part["venues"].items():
+            venue_counts[venue] = venue_counts.get(venue, 0) + value
+        for venue, value in part["symbols"].items():
+            venue_symbols[venue] = venue_symbols.get(venue, 0) + value
+        for row in part["signals"]:
+            patterns[row["pattern"]] = patterns.get(row["pattern"], 0) + 1
+        timeframes += [tf for tf in part["timeframes"] if tf not in timeframes]
+
+    merged = {
+        "cycle": cycle,
+        "shards": received,
+        "missing": missing,
+        "signals": sum(venue_counts.values()),
+        "venues": venue_counts,
+        "symbols": venue_symbols,
+        "patterns": patterns,
+        "timeframes": timeframes,
+        "elapsed": max(part["elapsed"] for part in parts),
+    }
+    logger.info(
+        f"合併掃描 {cycle} | 分片: {len(parts)}/{count} | 交易對: {sum(venue_symbols.values())} | "
+        f"信號: {merged['signals']} | 最慢分片: {merged['elapsed']:.2f} 秒"
+    )
+
+    if send_notifications:
+        send_scan_summary(
+            merged["signals"], ", ".join(timeframes),
+            venue_counts if len(venue_counts) > 1 else None,
+            shards=f"{len(parts)}/{count}"
+        )
+        if _dispatcher is not None:
+            _dispatcher.flush(timeout=CONFIG["notify_flush_timeout"])
+
+    _write_json_atomic(marker, merged)
+    return merged
+
 # ============================================================================
 # 定時執行模組
 # ============================================================================
 
+class CandleCloseScheduler:
+    """
+    依 K線收盤時間觸發掃描的排程器
+
+    - 在每個時間框架的交易所 UTC 邊界（週線從週一開始）加上 settle_seconds 時喚醒，
+      只掃描剛收盤的時間框架（例如 4h 收盤時同時掃描 1h 與 4h）
+    - 掃描在背景執行緒進行；上一次尚未結束時依 overlap 略過（skip），
+      或在結束後合併補跑一次（coalesce，多次觸發的時間框架取聯集）
+    - 每次觸發記錄收盤到開始掃描的延遲（lateness）
+    """
+
+    def __init__(self, timeframes: list, settle_seconds: float = 5.0,
+                 overlap: str = "coalesce", run=None):
+        if overlap not in ("skip", "coalesce"):
+            raise ValueError(f"schedule_overlap 必須為 skip 或 coalesce，收到 {overlap!r}")
+        self.timeframes = sorted(timeframes, key=timeframe_to_ms)
+        self.settle = settle_seconds
+        self.overlap = overlap
+        self.run = run or (lambda due: run_scan(timeframes=due))
+        self._state = threading.Lock()
+        self._running = False
+        self._pending = None
+        self._stop = threading.Event()
+
+    def next_close(self, now: float) -> tuple:
+        """
+        計算 now 之後的下一個 K線收盤時間
+
+        返回：
+            元組：(收盤時間（毫秒）, 在該時間收盤的時間框架)
+        """
+        now_ms = int(now * 1000)
+        closes = {}
+        for timeframe in self.timeframes:
+            closes[timeframe] = last_close_ms(timeframe, now_ms) + timeframe_to_ms(timeframe)
+        close_ms = min(closes.values())
+        return close_ms, [tf for tf in self.timeframes if closes[tf] == close_ms]
+
+    def trigger(self, close_ms: int, due: list) -> bool:
+        """
+        觸發一次掃描
+
+        返回：
+            是否立即開始（上一次仍在執行時為 False）
+        """
+        with self._state:
+            if self._running:
+                if self.overlap == "coalesce":
+                    if self._pending is not None:
+                        due = sorted(set(due) | set(self._pending[1]), key=timeframe_to_ms)
+                    self._pending = (close_ms, due)
+                    _metrics.count("schedule_coalesced")
+                    logger.warning(f"上一次掃描尚未結束，{', '.join(due)} 將於結束後合併執行")
+                else:
+                    _metrics.count("schedule_skipped")
+                    logger.warning(f"上一次掃描尚未結束，略過 {', '.join(due)} 的收盤掃描")
+                return False
+            self._running = True
+
+        threading.Thread(
+            target=self._worker, args=(close_ms, due), name="scheduled-scan", daemon=True
+        ).start()
+        return True
+
+    def _worker(self, close_ms: int, due: list):
+        while True:
+            lateness = time.time() - close_ms / 1000
+            _metrics.schedule_run(due, lateness)
+            logger.info(f"K線收盤觸發掃描 | {', '.join(due)} | 收盤後 {lateness:.1f} 秒")
+            try:
+                self.run(due)
+            except Exception as e:
+                logger.error(f"定時掃描失敗: {str(e)}")
+
+            with self._state:
+                if self._pending is None:
+                    self._running = False
+                    return
+                (close_ms, due), self._pending = self._pending, None
+
+    def run_forever(self, run_now: bool = True):
+        """
+        執行排程迴圈直到 stop()
+
+        參數：
+            run_now: 啟動時是否先以最近一次收盤的 K線掃描所有時間框架
+        """
+        if run_now:
+            self.trigger(last_close_ms(self.timeframes[0]), self.timeframes)
+
+        while not self._stop.is_set():
+            close_ms, due = self.next_close(time.time())
+            delay = close_ms / 1000 + self.settle - time.time()
+            if self._stop.wait(max(0.0, delay)):
+                break
+            self.trigger(close_ms, due)
+
+    def stop(self):
+        self._stop.set()
+
+
 def start_scheduler():
     """
     啟動定時執行排程器
+
+    candle_close 模式在各時間框架 K線收盤後觸發；interval 模式以固定間隔執行。
     """
+    start_metrics_server()
+
+    for venue in get_venues():
+        cache = get_market_cache(venue)
+        if cache is not None:
+            cache.start_refresh(CONFIG["markets_refresh_minutes"])
+
+    if CONFIG["schedule_mode"] == "candle_close":
+        scheduler = CandleCloseScheduler(
+            get_scan_timeframes(),
+            settle_seconds=CONFIG["schedule_settle_seconds"],
+            overlap=CONFIG["schedule_overlap"]
+        )
+        logger.info(
+            f"啟動 K線收盤排程器 | 時間框架: {', '.join(scheduler.timeframes)} | "
+            f"收盤後 {scheduler.settle} 秒觸發 | 重疊處理: {scheduler.overlap}"
+        )
+        logger.info("定時任務已設定，按 Ctrl+C 停止")
+        try:
+            scheduler.run_forever()
+        except KeyboardInterrupt:
+            scheduler.stop()
+            logger.info("收到中斷信號，停止排程器")
+        return
+
     interval = CONFIG["schedule_interval_minutes"]
 
     logger.info(f"啟動定時排程器 | 執行間隔: 每 {interval} 分鐘")
@@ -855,6 +4483,8 @@ def start_scheduler():
     run_scan()
 
     # 設定定時任務
+    import schedule
+
     schedule.every(interval).minutes.do(run_scan)
 
     logger.info("定時任務已設定，按 Ctrl+C 停止")
@@ -866,6 +4496,305 @@ def start_scheduler():
     except KeyboardInterrupt:
         logger.info("收到中斷信號，停止排程器")
 
+# ============================================================================
+# 即時 K線串流模組
+# ============================================================================
+
+class KlineFeed:
+    """
+    K線串流來源介面
+
+    load_history() 提供暖機用的歷史 K線，stream() 為非同步產生器，
+    逐一產生 (幣種, [時間, 開, 高, 低, 收, 量]) 形式的已收盤 K線。
+    """
+
+    venue = DEFAULT_VENUE
+
+    def load_history(self, timeframe: str, limit: int) -> CandlePanel:
+        return collect_panel(timeframe, limit, venue=self.venue)
+
+    async def stream(self, symbols: list, timeframe: str):
+        raise NotImplementedError
+        yield
+
+
+class CcxtProKlineFeed(KlineFeed):
+    """
+    以 ccxt.pro WebSocket 訂閱整個幣種清單的 K線
+
+    ccxt 不會標示 K線是否收盤，因此當同一幣種出現更新的開盤時間時，
+    將前一根視為已收盤並輸出。訂閱依 chunk_size 分組以符合單一連線的串流上限。
+    """
+
+    def __init__(self, chunk_size: int = 100, retry_delay: float = 5.0,
+                 venue: str = DEFAULT_VENUE):
+        self.chunk_size = chunk_size
+        self.retry_delay = retry_delay
+        self.venue = venue
+
+    async def stream(self, symbols: list, timeframe: str):
+        import ccxt.pro as ccxtpro
+
+        exchange = _ccxt_client(ccxtpro, self.venue)
+        await load_markets_cached_async(exchange, self.venue)
+        queue = asyncio.Queue()
+
+        async def watch(chunk: list):
+            subscriptions = [[symbol, timeframe] for symbol in chunk]
+            current = {}
+            while True:
+                try:
+                    update = await exchange.watch_ohlcv_for_symbols(subscriptions)
+                except Exception as e:
+                    logger.warning(f"K線串流中斷，{self.retry_delay:.0f} 秒後重試: {str(e)}")
+                    await asyncio.sleep(self.retry_delay)
+                    continue
+
+                for symbol, by_timeframe in update.items():
+                    for candle in by_timeframe.get(timeframe, []):
+                        last = current.get(symbol)
+                        if last is not None and candle[0] > last[0]:
+                            await queue.put((symbol, last))
+                        if last is None or candle[0] >= last[0]:
+                            current[symbol] = candle
+
+        chunks = [symbols[i:i + self.chunk_size] for i in range(0, len(symbols), self.chunk_size)]
+        tasks = [asyncio.create_task(watch(chunk)) for chunk in chunks]
+        logger.info(f"已訂閱 K線串流 | 幣種: {len(symbols)} | 連線: {len(tasks)}")
+
+        try:
+            while True:
+                yield await queue.get()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await exchange.close()
+
+
+class ReplayKlineFeed(KlineFeed):
+    """
+    以本地 CandlePanel 重播 K線的串流來源（離線測試用）
+
+    每個幣種的前 warmup_bars 根作為暖機歷史，其餘 K線依開盤時間順序輸出，
+    每個時間點之間等待 interval 秒。
+    """
+
+    def __init__(self, panel: CandlePanel, warmup_bars: int = 499, interval: float = 0.0):
+        self.panel = panel
+        self.warmup_bars = warmup_bars
+        self.interval = interval
+
+    def _rows(self, symbol: str) -> np.ndarray:
+        s = self.panel.series(symbol)
+        return np.column_stack([s[field] for field in CandlePanel.FIELDS])
+
+    def load_history(self, timeframe: str, limit: int) -> CandlePanel:
+        return CandlePanel.from_candles(
+            [(symbol, self._rows(symbol)[:self.warmup_bars]) for symbol in self.panel.symbols]
+        )
+
+    async def stream(self, symbols: list, timeframe: str):
+        events = []
+        for symbol in symbols:
+            for row in self._rows(symbol)[self.warmup_bars:].tolist():
+                row[0] = int(row[0])
+                events.append((row[0], symbol, row))
+        events.sort(key=lambda event: event[0])
+
+        last_ts = None
+        for ts, symbol, row in events:
+            if self.interval and last_ts is not None and ts != last_ts:
+                await asyncio.sleep(self.interval)
+            last_ts = ts
+            yield symbol, row
+
+
+def get_kline_feed() -> KlineFeed:
+    """
+    依 CONFIG 建立串流來源：設定重播目錄時使用本地重播，
+    否則使用 exchanges 中第一個交易所的 WebSocket
+    """
+    if CONFIG["stream_replay_path"]:
+        return ReplayKlineFeed(
+            CandlePanel.load(CONFIG["stream_replay_path"]),
+            warmup_bars=CONFIG["limit"] - 1
+        )
+    return CcxtProKlineFeed(venue=get_venues()[0])
+
+
+class StreamScanner:
+    """
+    收盤即時掃描器
+
+    每收到一根已收盤 K線，只更新該幣種的 PivotTracker 並立即評估所有形態；
+    同一組 XABC 轉折點的同一形態在本次執行中只通知一次，
+    提供 signal_store 時也會與定時掃描共用跨次執行的去重紀錄。
+    本次執行的去重紀錄在最後一次符合的 D 點超出掃描視窗（limit 根 K線）後移除，
+    長時間執行時不會無限增長。
+    """
+
+    def __init__(self, timeframe: str, order: int = 10, send_notifications: bool = True,
+                 signal_store: SignalStore = None, sink: SignalSink = None,
+                 venue: str = DEFAULT_VENUE):
+        self.timeframe = timeframe
+        self.venue = venue
+        self.order = order
+        self.send_notifications = send_notifications
+        self.signal_store = signal_store
+        self.sink = sink
+        self.trackers = {}
+        # {(幣種, 形態, XABC 時間): 最後一次符合的 D 點開盤時間}
+        self.alerted = {}
+        self.window_ms = CONFIG["limit"] * timeframe_to_ms(timeframe)
+        self._expired_at = 0
+        self.signal_count = 0
+
+    def warmup(self, panel: CandlePanel):
+        """以歷史 K線初始化所有幣種的轉折點狀態"""
+        for coin in panel.symbols:
+            series = panel.series(coin)
+            tracker = self.trackers[coin] = PivotTracker(
+                order=self.order, tie=CONFIG["pivot_tie_break"]
+            )
+            tracker.warmup(series["timestamps"], series["high"], series["low"])
+
+        logger.info(f"串流掃描暖機完成 | 幣種: {len(self.trackers)}")
+
+    def expire_alerted(self, ts: int):
+        """移除 D 點早於 ts 往前一個掃描視窗的去重紀錄（每根 K線時間只執行一次）"""
+        if ts <= self._expired_at:
+            return
+        self._expired_at = ts
+        cutoff = ts - self.window_ms
+        self.alerted = {key: d_ts for key, d_ts in self.alerted.items() if d_ts >= cutoff}
+
+    def on_candle(self, symbol: str, candle: list) -> list:
+        """
+        處理一根已收盤 K線
+
+        返回：
+            本次新發現的 Signal 列表
+        """
+        tracker = self.trackers.get(symbol)
+        if tracker is None:
+            tracker = self.trackers[symbol] = PivotTracker(
+                order=self.order, tie=CONFIG["pivot_tie_break"]
+            )
+
+        ts = int(candle[0])
+        if tracker.last_ts is not None and ts <= tracker.last_ts:
+            return []
+        tracker.update(ts, float(candle[2]), float(candle[3]))
+        self.expire_alerted(ts)
+
+        pattern = tracker.current_pattern()
+        if pattern is None:
+            return []
+
+        current_pat, moves = pattern
+        matches = evaluate_patterns(moves, current_pat)
+        recent = tracker.recent_pivots(4)
+        pivot_bars = tuple(bar for bar, _, _ in recent)
+        pivot_ts = tuple(ts for _, ts, _ in recent)
+
+        signals = []
+        for p in np.nonzero(matches["mask"][:, 0])[0]:
+            pattern_name = PATTERN_NAMES[p]
+            key = (symbol, pattern_name, pivot_ts)
+            seen = key in self.alerted
+            self.alerted[key] = ts
+            if seen:
+                continue
+
+            signal = Signal(
+                symbol=display_symbol(symbol),
+                pattern=pattern_name,
+                timeframe=self.timeframe,
+                pivot_bars=pivot_bars,
+                pivot_ts=pivot_ts,
+                d_bar=tracker.bar_count - 1,
+                d_ts=ts,
+                venue=self.venue,
+                **{field: matches[field][p, 0] for field in ("prz", "sl", "tp1", "tp2", "tp3")}
+            )
+            if self.sink is not None:
+                self.sink.write(signal)
+                self.sink.flush()
+
+            if self.signal_store is not None:
+                is_new = bool(self.signal_store.filter_new([signal]))
+                self.signal_store.record([signal])
+                if not is_new:
+                    continue
+
+            signals.append(signal)
+            self.signal_count += 1
+
+            latency = time.time() - (ts + timeframe_to_ms(self.timeframe)) / 1000
+            logger.info(
+                f"發現信號: {signal.symbol} | {pattern_name} | 收盤後 {latency:.1f} 秒"
+            )
+
+            if self.send_notifications:
+                send_harmonic_signal(
+                    pattern_name, signal.symbol, signal.prz, signal.sl,
+                    signal.tp1, signal.tp2, signal.tp3, self.timeframe, self.venue
+                )
+
+        return signals
+
+
+def start_stream(feed: KlineFeed = None, send_notifications: bool = True):
+    """
+    啟動收盤即時掃描（auto --stream）
+
+    參數：
+        feed: K線串流來源，預設依 CONFIG 建立
+        send_notifications: 是否發送 Discord 通知
+    """
+    timeframe = CONFIG["harmonic_timeframe"]
+    feed = feed or get_kline_feed()
+
+    logger.info(f"啟動收盤即時掃描 | {venue_label(feed.venue)} | 時間框架: {timeframe}")
+    if len(get_venues()) > 1:
+        logger.warning(f"串流掃描只訂閱單一交易所（{venue_label(feed.venue)}），其他交易所請使用定時模式")
+    if CONFIG["pivot_mode"] != "window":
+        logger.warning("串流掃描只支援 window 轉折點模式，將以 window 模式執行")
+
+    start_metrics_server()
+
+    panel = feed.load_history(timeframe, CONFIG["limit"])
+    signal_store = open_signal_store()
+    sink = open_signal_sinks()
+    scanner = StreamScanner(
+        timeframe, CONFIG["peak_order"], send_notifications, signal_store, sink, feed.venue
+    )
+    scanner.warmup(panel)
+
+    async def consume():
+        async for symbol, candle in feed.stream(panel.symbols, timeframe):
+            try:
+                scanner.on_candle(symbol, candle)
+            except Exception as e:
+                if CONFIG["verbose"]:
+                    logger.debug(f"串流掃描 {symbol} 時發生錯誤: {str(e)}")
+
+    try:
+        asyncio.run(consume())
+    except KeyboardInterrupt:
+        logger.info("收到中斷信號，停止串流掃描")
+
+    if _dispatcher is not None:
+        _dispatcher.flush(timeout=CONFIG["notify_flush_timeout"])
+    if signal_store:
+        signal_store.close()
+    if sink:
+        sink.close()
+
+    logger.info(f"串流掃描結束 | 發現 {scanner.signal_count} 個信號")
+
+    return scanner
+
 # ============================================================================
 # 命令列介面
 # ============================================================================
@@ -883,13 +4812,24 @@ def print_usage():
 ║  1. 手動執行（單次掃描）：                                                     ║
 ║     python harmonic_scanner.py                                               ║
 ║     python harmonic_scanner.py scan                                          ║
+║     python harmonic_scanner.py scan --shard 2/8   （只掃描第 2 / 8 片）      ║
+║     python harmonic_scanner.py merge [--wait 600] （合併分片並發送摘要）     ║
 ║                                                                              ║
 ║  2. 定時自動執行：                                                            ║
 ║     python harmonic_scanner.py auto                                          ║
+║     python harmonic_scanner.py auto --stream   （K線收盤即時掃描）             ║
 ║                                                                              ║
 ║  3. 測試 Discord 通知：                                                       ║
 ║     python harmonic_scanner.py test                                          ║
 ║                                                                              ║
+║  4. 回測歷史形態（PRZ / SL / TP 命中率）：                                     ║
+║     python harmonic_scanner.py backtest <數據目錄或 .db> [--hold 200]          ║
+║                                                                              ║
+║  5. 下載長期歷史 K線（分頁並行、可中斷續傳）：                                 ║
+║     python harmonic_scanner.py download 2021-01-01 [2024-01-01]                ║
+║       [--timeframe 1d] [--symbols BTC,ETH] [--exchange binance]                ║
+║       [--output history.db]                                                    ║
+║                                                                              ║
 ║  ─────────────────────────────────────────────────────────────────────────   ║
 ║                                                                              ║
 ║  設定說明：                                                                   ║
@@ -901,10 +4841,18 @@ def print_usage():
 ║     - 將 URL 貼到程式碼中的 DISCORD_WEBHOOK_URL 變數                           ║
 ║                                                                              ║
 ║  2. 掃描參數設定（CONFIG 字典）：                                              ║
+║     - exchanges: 要掃描的交易所（binance, bybit, okx）                         ║
 ║     - harmonic_timeframe: 谐波形態時間框架（1h, 4h, 1d）                        ║
+║     - scan_timeframes: 多時間框架清單（由最小週期重採樣）                       ║
 ║     - limit: K線數據數量                                                      ║
 ║     - peak_order: 峰值檢測靈敏度                                              ║
-║     - schedule_interval_minutes: 定時執行間隔（分鐘）                          ║
+║     - pivot_tie_break: 等高平台處理（strict / first / last）                   ║
+║     - schedule_mode: 定時方式（candle_close = K線收盤觸發 / interval）         ║
+║     - schedule_interval_minutes: 定時執行間隔（分鐘，interval 模式）           ║
+║     - metrics_port: auto 模式的 Prometheus 指標埠（/metrics）                  ║
+║     - shard_spool_path: 分片掃描結果目錄（merge 合併後發送摘要）             ║
+║     - signal_sink_paths: 信號輸出檔（.jsonl / .csv / .parquet）               ║
+║     - adaptive_rate_limit: 依權重用量自適應調整並行請求數（AIMD）             ║
 ║                                                                              ║
 ║  ─────────────────────────────────────────────────────────────────────────   ║
 ║                                                                              ║
@@ -917,7 +4865,7 @@ def print_usage():
 ║  ─────────────────────────────────────────────────────────────────────────   ║
 ║                                                                              ║
 ║  相依套件安裝：                                                               ║
-║     pip install ccxt pandas numpy scipy requests schedule                    ║
+║     pip install ccxt pandas numpy requests schedule                          ║
 ║                                                                              ║
 ╚══════════════════════════════════════════════════════════════════════════════╝
     """
@@ -965,29 +4913,91 @@ def test_discord():
         logger.error("Discord 測試通知發送失敗，請檢查 Webhook URL")
 
 
+def run_single_scan():
+    """執行單次掃描，並將本次掃描的指標附加到 JSONL 紀錄"""
+    run_scan()
+
+    path = CONFIG["metrics_jsonl_path"]
+    if path:
+        try:
+            _metrics.append_jsonl(path)
+        except OSError as e:
+            logger.error(f"寫入掃描指標失敗：{str(e)}")
+
+
+def _get_option(args: list, name: str, default=None):
+    """讀取命令列選項值，支援 --name value 與 --name=value"""
+    for i, arg in enumerate(args):
+        if arg == name and i + 1 < len(args):
+            return args[i + 1]
+        if arg.startswith(name + "="):
+            return arg.split("=", 1)[1]
+    return default
+
+
 def main():
     """主程式入口"""
     import sys
 
     if len(sys.argv) < 2:
         # 預設執行掃描
-        run_scan()
+        run_single_scan()
         return
 
     command = sys.argv[1].lower()
 
+    shard = _get_option(sys.argv[2:], '--shard')
+    if shard:
+        try:
+            CONFIG["shard"] = parse_shard(shard)
+        except ValueError as e:
+            logger.error(str(e))
+            return
+
     if command in ['help', '-h', '--help', '?']:
         print_usage()
 
     elif command == 'scan':
-        run_scan()
+        run_single_scan()
+
+    elif command == 'merge':
+        cycle = sys.argv[2] if len(sys.argv) > 2 and not sys.argv[2].startswith('--') else None
+        merge_shards(cycle, wait=float(_get_option(sys.argv[2:], '--wait', 0)))
 
     elif command == 'auto':
-        start_scheduler()
+        if '--stream' in sys.argv[2:]:
+            start_stream()
+        else:
+            start_scheduler()
 
     elif command == 'test':
         test_discord()
 
+    elif command == 'download':
+        args = sys.argv[2:]
+        if not args or args[0].startswith('--'):
+            logger.error("請指定起始日期，例如 download 2021-01-01 [2024-01-01]")
+            return
+        until = args[1] if len(args) > 1 and not args[1].startswith('--') else None
+        venue = _get_option(args, '--exchange', DEFAULT_VENUE)
+        if venue not in EXCHANGES:
+            logger.error(f"未支援的交易所: {venue}（支援 {', '.join(EXCHANGES)}）")
+            return
+        symbols = _get_option(args, '--symbols')
+        download_history(
+            args[0], until,
+            timeframe=_get_option(args, '--timeframe'),
+            symbols=symbols.split(',') if symbols else None,
+            venue=venue,
+            path=_get_option(args, '--output'),
+        )
+
+    elif command == 'backtest':
+        if len(sys.argv) < 3:
+            logger.error("請指定回測數據來源（CandlePanel 目錄或 .db 檔）")
+            return
+        run_backtest(sys.argv[2], max_hold=int(_get_option(sys.argv[3:], '--hold', 200)))
+
     else:
         logger.error(f"未知命令: {command}")
         print_usage()
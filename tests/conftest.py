@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+測試共用設定：以 ExchangeRecording 錄製檔與 ReplayExchange 離線重播交易所
+
+合成市場沿用 benchmarks/bench_scan.py 的產生器（含植入的看漲蝙蝠形態），
+所有本地檔案（K線快取、信號紀錄、指標、錄製檔）都寫入 tmp_path。
+"""
+
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+import harmonic_scanner as hs  # noqa: E402
+from bench_scan import make_market  # noqa: E402
+
+ORDER = 10
+BARS = 300
+
+
+def write_recording(path: str, n_symbols: int, seed: int, timeframe: str = "1h") -> set:
+    """
+    產生合成市場並寫成錄製檔
+
+    返回：
+        植入形態的幣種集合（與信號的 symbol 相同，不含 /USDT）
+    """
+    market, planted = make_market(n_symbols, BARS, ORDER, 0.5, seed)
+    recording = hs.ExchangeRecording(path)
+    recording.save_markets({symbol: {"symbol": symbol} for symbol in market})
+    recording.save_tickers({
+        symbol: {"symbol": symbol, "quoteVolume": rows[-1][4] * rows[-1][5]}
+        for symbol, rows in market.items()
+    })
+    for symbol, rows in market.items():
+        recording.append_ohlcv(symbol, timeframe, None, len(rows), rows)
+    return {symbol.split("/")[0] for symbol in planted}
+
+
+@pytest.fixture
+def replay_config(tmp_path, monkeypatch):
+    """以重播後端掃描，本地檔案寫入 tmp_path，並清除跨掃描保留的單例"""
+    for key, value in {
+        "exchange_backend": "replay",
+        "exchange_recording_path": str(tmp_path / "recordings"),
+        "candle_store_path": str(tmp_path / "candles.db"),
+        "signal_store_path": str(tmp_path / "signals.db"),
+        "signal_sink_paths": [],
+        "metrics_jsonl_path": None,
+        "markets_cache_path": None,
+        "harmonic_timeframe": "1h",
+        "scan_timeframes": None,
+        "limit": BARS - 1,
+        "peak_order": ORDER,
+        "priority_symbols": 0,
+        "min_quote_volume": 0,
+        "shard": None,
+        "verbose": False,
+    }.items():
+        monkeypatch.setitem(hs.CONFIG, key, value)
+    for registry in (hs._exchanges, hs._market_caches, hs._rate_controllers, hs._pivot_trackers):
+        registry.clear()
+    hs._metrics.start_cycle()
+    yield tmp_path
+    for registry in (hs._exchanges, hs._market_caches, hs._rate_controllers, hs._pivot_trackers):
+        registry.clear()
+
+
+@pytest.fixture
+def venue_recordings(replay_config):
+    """
+    為指定的交易所寫入錄製檔（路徑依 venue_path 區分）
+
+    返回：
+        函數 record(venue, n_symbols, seed) -> 植入形態的幣種集合
+    """
+    def record(venue: str, n_symbols: int = 12, seed: int = 0) -> set:
+        path = hs.venue_path(hs.CONFIG["exchange_recording_path"], venue)
+        return write_recording(path, n_symbols, seed)
+
+    return record
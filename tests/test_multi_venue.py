@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+"""
+多交易所並行掃描：以錄製檔重播各交易所，驗證登錄表、_collect_venue 工作執行緒與合併後的 run_scan 結果
+"""
+
+import queue
+import threading
+
+import ccxt
+import pytest
+
+import harmonic_scanner as hs
+
+
+# ============================================================================
+# 交易所登錄表
+# ============================================================================
+
+def test_registry_entries_have_required_fields():
+    for venue, spec in hs.EXCHANGES.items():
+        assert {"ccxt", "options", "settle", "max_limit", "label"} <= set(spec), venue
+        assert spec["max_limit"] > 0
+    assert hs.DEFAULT_VENUE in hs.EXCHANGES
+
+
+def test_get_venues_dedupes_and_rejects_unknown(monkeypatch):
+    monkeypatch.setitem(hs.CONFIG, "exchanges", ["bybit", "binance", "bybit"])
+    assert hs.get_venues() == ["bybit", "binance"]
+
+    monkeypatch.setitem(hs.CONFIG, "exchanges", None)
+    assert hs.get_venues() == [hs.DEFAULT_VENUE]
+
+    monkeypatch.setitem(hs.CONFIG, "exchanges", ["binance", "kraken"])
+    with pytest.raises(ValueError, match="kraken"):
+        hs.get_venues()
+
+
+def test_venue_path_keeps_default_venue_path():
+    assert hs.venue_path("candles.db", hs.DEFAULT_VENUE) == "candles.db"
+    assert hs.venue_path("candles.db", "bybit") == "candles.bybit.db"
+    assert hs.venue_path("markets_cache.json.gz", "okx") == "markets_cache.okx.json.gz"
+    assert hs.venue_path("data/recordings/", "bybit").replace("\\", "/") == "data/recordings.bybit"
+    assert hs.venue_path(None, "bybit") is None
+
+
+def test_replay_exchange_per_venue(venue_recordings):
+    venue_recordings("binance", n_symbols=4, seed=1)
+    venue_recordings("bybit", n_symbols=6, seed=2)
+
+    binance = hs.get_exchange("binance")
+    bybit = hs.get_exchange("bybit")
+    assert isinstance(binance, hs.ReplayExchange) and isinstance(bybit, hs.ReplayExchange)
+    assert binance is not bybit
+    assert hs.get_exchange("bybit") is bybit
+    assert len(hs.select_symbols("binance")) == 4
+    assert len(hs.select_symbols("bybit")) == 6
+
+
+# ============================================================================
+# _collect_venue 工作執行緒
+# ============================================================================
+
+def _drain(ready: queue.Queue) -> list:
+    items = []
+    while True:
+        venue, data = ready.get(timeout=30)
+        items.append((venue, data))
+        if data is None:
+            return items
+
+
+def test_collect_venue_puts_batches_then_sentinel(venue_recordings, monkeypatch):
+    venue_recordings("bybit", n_symbols=10, seed=3)
+    monkeypatch.setitem(hs.CONFIG, "priority_symbols", 4)
+
+    ready = queue.Queue()
+    hs._collect_venue("bybit", "1h", hs.CONFIG["limit"], ready)
+    items = _drain(ready)
+
+    assert [venue for venue, _ in items] == ["bybit"] * 3
+    assert [len(data) for _, data in items[:-1]] == [4, 6]
+    assert items[-1][1] is None
+
+
+def test_collect_venue_failure_still_puts_sentinel(replay_config):
+    # 沒有錄製檔：select_symbols 失敗，仍須放入結束標記，否則 run_scan 會永遠等待
+    ready = queue.Queue()
+    hs._collect_venue("okx", "1h", hs.CONFIG["limit"], ready)
+
+    assert _drain(ready) == [("okx", None)]
+    assert hs._metrics.snapshot()["errors"].get("collect") == 1
+
+
+def test_venues_are_collected_concurrently(venue_recordings, monkeypatch):
+    for seed, venue in enumerate(("binance", "bybit", "okx")):
+        venue_recordings(venue, n_symbols=5, seed=seed)
+    monkeypatch.setitem(hs.CONFIG, "exchanges", ["binance", "bybit", "okx"])
+
+    # 三個交易所必須同時進入 collect_panel，否則 Barrier 逾時使收集失敗
+    barrier = threading.Barrier(3, timeout=10)
+    threads = {}
+    collect_panel = hs.collect_panel
+
+    def rendezvous(timeframe, limit, symbols=None, venue=hs.DEFAULT_VENUE):
+        threads[venue] = threading.current_thread().name
+        barrier.wait()
+        return collect_panel(timeframe, limit, symbols=symbols, venue=venue)
+
+    monkeypatch.setattr(hs, "collect_panel", rendezvous)
+    result = hs.run_scan(send_notifications=False)
+
+    assert threads == {venue: f"collect-{venue}" for venue in ("binance", "bybit", "okx")}
+    assert "collect" not in hs._metrics.snapshot()["errors"]
+    assert all(count > 0 for count in result["venues"].values())
+
+
+# ============================================================================
+# 合併的 run_scan 結果
+# ============================================================================
+
+def _signals(result: dict) -> list:
+    return [signal for signals in result["harmonic"].values() for signal in signals]
+
+
+def test_run_scan_merges_venues(venue_recordings, monkeypatch):
+    planted = {
+        "binance": venue_recordings("binance", n_symbols=12, seed=10),
+        "bybit": venue_recordings("bybit", n_symbols=8, seed=11),
+    }
+    monkeypatch.setitem(hs.CONFIG, "exchanges", ["binance", "bybit"])
+
+    result = hs.run_scan(send_notifications=False)
+    signals = _signals(result)
+
+    assert set(result["venues"]) == {"binance", "bybit"}
+    assert sum(result["venues"].values()) == len(signals)
+    for venue, symbols in planted.items():
+        found = {signal.symbol for signal in signals
+                 if signal.venue == venue and signal.pattern == "看漲蝙蝠"}
+        assert symbols <= found, venue
+        assert result["venues"][venue] == sum(signal.venue == venue for signal in signals)
+
+
+def test_run_scan_matches_single_venue_scans(venue_recordings, monkeypatch):
+    venue_recordings("binance", n_symbols=10, seed=20)
+    venue_recordings("okx", n_symbols=10, seed=21)
+
+    def keys(result):
+        return sorted((s.venue, s.symbol, s.pattern, s.timeframe) for s in _signals(result))
+
+    single = []
+    for venue in ("binance", "okx"):
+        monkeypatch.setitem(hs.CONFIG, "exchanges", [venue])
+        single += keys(hs.run_scan(send_notifications=False))
+
+    monkeypatch.setitem(hs.CONFIG, "exchanges", ["binance", "okx"])
+    assert keys(hs.run_scan(send_notifications=False)) == sorted(single)
+
+
+def test_failing_venue_does_not_block_others(venue_recordings, monkeypatch):
+    planted = venue_recordings("binance", n_symbols=12, seed=30)
+    venue_recordings("okx", n_symbols=6, seed=31)
+    # bybit 沒有錄製檔，重播交易所建立失敗
+    monkeypatch.setitem(hs.CONFIG, "exchanges", ["binance", "bybit", "okx"])
+
+    result = hs.run_scan(send_notifications=False)
+
+    assert result["venues"]["bybit"] == 0
+    assert result["venues"]["binance"] > 0 and result["venues"]["okx"] > 0
+    assert planted <= {s.symbol for s in _signals(result) if s.venue == "binance"}
+    assert hs._metrics.snapshot()["errors"].get("collect") == 1
+
+
+def test_failing_fetch_is_isolated_to_its_venue(venue_recordings, monkeypatch):
+    venue_recordings("binance", n_symbols=8, seed=40)
+    venue_recordings("bybit", n_symbols=8, seed=41)
+    monkeypatch.setitem(hs.CONFIG, "exchanges", ["binance", "bybit"])
+    monkeypatch.setitem(hs.CONFIG, "fetch_retries", 0)
+
+    # bybit 的每個 K線請求都失敗：該交易所沒有信號，binance 照常回報
+    class BrokenReplay(hs.AsyncReplayExchange):
+        async def fetch_ohlcv(self, symbol, timeframe="1m", since=None, limit=None, params=None):
+            raise ccxt.ExchangeError("replay: 模擬故障")
+
+    get_async_exchange = hs.get_async_exchange
+
+    def broken_bybit(venue=hs.DEFAULT_VENUE):
+        if venue == "bybit":
+            return BrokenReplay.from_config(hs.venue_path(hs.CONFIG["exchange_recording_path"], venue))
+        return get_async_exchange(venue)
+
+    monkeypatch.setattr(hs, "get_async_exchange", broken_bybit)
+    result = hs.run_scan(send_notifications=False)
+
+    assert result["venues"]["bybit"] == 0
+    assert result["venues"]["binance"] > 0
+    assert all(s.venue == "binance" for s in _signals(result))
+
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+"""
+跨掃描保留的 PivotTracker：轉折點離開面板視窗後，結果須與逐一檢測同一視窗相同
+"""
+
+import numpy as np
+
+import harmonic_scanner as hs
+from bench_scan import planted_bat
+
+from conftest import ORDER
+
+HOUR_MS = 3600 * 1000
+
+
+def _candles(close: np.ndarray) -> list:
+    timestamps = np.arange(len(close)) * HOUR_MS
+    return np.column_stack(
+        [timestamps, close, close * 1.002, close * 0.998, close, np.ones(len(close))]
+    ).tolist()
+
+
+def _scan(candles: list, trackers: dict = None) -> list:
+    panel = hs.CandlePanel.from_candles([("BAT/USDT", candles)])
+    results = hs.scan_harmonic_patterns(
+        panel, order=ORDER, send_notifications=False, trackers=trackers, timeframe="1h"
+    )
+    return [signal for signals in results.values() for signal in signals]
+
+
+def test_tracker_ignores_pivots_before_panel_window(monkeypatch):
+    monkeypatch.setitem(hs.CONFIG, "pivot_tie_break", "strict")
+    monkeypatch.setitem(hs.CONFIG, "verbose", False)
+
+    # 蝙蝠形態結束後價格持平：之後的視窗內沒有轉折點，最新低點仍落在 D 點
+    path = np.concatenate([np.linspace(105, 100, 3 * ORDER, endpoint=False), planted_bat(ORDER)])
+    close = np.concatenate([path, np.full(400, path[-1])])
+    candles = _candles(close)
+    window = 300
+
+    trackers = {}
+    first = _scan(candles[:window], trackers)
+    assert [signal.pattern for signal in first] == ["看漲蝙蝠"]
+    assert list(first[0].pivot_ts) == [candles[i][0] for i in first[0].pivot_bars]
+
+    # 視窗前移至 X/A/B/C 之後：追蹤器仍保留舊轉折點，但不得以錯誤的 K線位置回報
+    shifted = candles[len(path):len(path) + window]
+    assert _scan(shifted, trackers) == _scan(shifted) == []